@@ -1,5 +1,94 @@
+from datetime import date, timedelta
+
 from django.contrib import admin
-from .models import Customer, Bill, BillItem, OldGold, Payment, GoldRate, SilverRate, BarRate
+from django.utils import dateformat
+from .models import Customer, Bill, BillItem, OldGold, Payment, GoldRate, SilverRate, BarRate, BillSequence, DailySalesSummary, Job
+from .jobs import retry
+from .pagination import EstimatedCountPaginator
+from .search import search_bills
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Change list for tables that grow to millions of rows
+
+    The result count is an estimate (billing/pagination.py), the unfiltered
+    total is not counted at all, and searches go through the bill search
+    index (billing/search.py) instead of LIKE '%term%' scans. Subclasses
+    set ``list_select_related`` for the relations their columns show, and
+    ``search_bill_field`` to the path from their rows to Bill.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    search_bill_field = None
+
+    def get_search_results(self, request, queryset, search_term):
+        ranking = search_bills(search_term) if self.search_bill_field else None
+        if ranking is None:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(**{f'{self.search_bill_field}__in': ranking}), False
+
+
+class BusinessDateFilter(admin.SimpleListFilter):
+    """Year, month and day drill-down on the business date of bills
+
+    The admin's date_hierarchy lists the years, months or days to drill
+    into with a DISTINCT over the filtered table on every page load. Here
+    they come from the daily sales rollup, which has a few rows per day,
+    and the filter is a range on the indexed Bill.business_date.
+    """
+    title = 'bill date'
+    parameter_name = 'business_date'
+    field_path = 'business_date'
+
+    def period(self):
+        """(selected value, first day, last day), or None"""
+        value = self.value()
+        try:
+            parts = [int(part) for part in (value or '').split('-')]
+            if len(parts) == 1:
+                return value, date(parts[0], 1, 1), date(parts[0], 12, 31)
+            if len(parts) == 2:
+                first = date(parts[0], parts[1], 1)
+                return value, first, (first + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+            if len(parts) == 3:
+                day = date(*parts)
+                return value, day, day
+        except ValueError:
+            pass
+        return None
+
+    def lookups(self, request, model_admin):
+        period = self.period()
+        days = DailySalesSummary.objects.all()
+        if period is None:
+            return [(str(year.year), str(year.year)) for year in days.dates('day', 'year')]
+        value, first, last = period
+        year = str(first.year)
+        if value == year:
+            months = days.filter(day__range=(first, last)).dates('day', 'month')
+            return [(year, year)] + [
+                (month.strftime('%Y-%m'), dateformat.format(month, 'F Y')) for month in months
+            ]
+        month = first.strftime('%Y-%m')
+        if value == month:
+            days = days.filter(day__range=(first, last)).dates('day', 'day')
+        else:
+            days = [first]
+        return [(year, year), (month, dateformat.format(first, 'F Y'))] + [
+            (day.isoformat(), dateformat.format(day, 'j F Y')) for day in days
+        ]
+
+    def queryset(self, request, queryset):
+        period = self.period()
+        if period is None:
+            return queryset
+        _, first, last = period
+        return queryset.filter(**{f'{self.field_path}__range': (first, last)})
+
+
+class BillDateFilter(BusinessDateFilter):
+    """BusinessDateFilter for rows of a bill"""
+    field_path = 'bill__business_date'
 
 
 @admin.register(Customer)
@@ -28,28 +117,77 @@ class BarRateAdmin(admin.ModelAdmin):
 
 
 @admin.register(Bill)
-class BillAdmin(admin.ModelAdmin):
+class BillAdmin(LargeTableAdmin):
     list_display = ['bill_number', 'customer', 'bill_date', 'net_payable', 'status', 'created_by']
-    list_filter = ['status', 'bill_date', 'created_by']
+    list_filter = [BusinessDateFilter, 'status', 'created_by']
+    list_select_related = ['customer', 'created_by']
     search_fields = ['bill_number', 'customer__name']
+    search_bill_field = 'pk'
+    autocomplete_fields = ['customer']
+    raw_id_fields = ['created_by']
     readonly_fields = ['bill_number', 'created_at', 'updated_at']
 
 
+@admin.register(BillSequence)
+class BillSequenceAdmin(admin.ModelAdmin):
+    list_display = ['day', 'last_number']
+    date_hierarchy = 'day'
+
+
+@admin.register(DailySalesSummary)
+class DailySalesSummaryAdmin(admin.ModelAdmin):
+    list_display = ['day', 'material_type', 'status', 'bill_count', 'item_count', 'net_payable', 'sales', 'outstanding']
+    list_filter = ['material_type', 'status']
+    date_hierarchy = 'day'
+
+
 @admin.register(BillItem)
-class BillItemAdmin(admin.ModelAdmin):
+class BillItemAdmin(LargeTableAdmin):
     list_display = ['bill', 'item_type', 'material_type', 'description', 'net_weight', 'tunch_wstg', 'g_fine', 'amount']
-    list_filter = ['bill__bill_date', 'item_type', 'material_type']
+    list_filter = [BillDateFilter, 'item_type', 'material_type']
+    list_select_related = ['bill__customer']
+    search_fields = ['bill__bill_number']
+    search_bill_field = 'bill'
+    autocomplete_fields = ['bill']
+    # Newest first by primary key, not by the per-bill item order
+    ordering = ['-id']
 
 
 @admin.register(OldGold)
-class OldGoldAdmin(admin.ModelAdmin):
+class OldGoldAdmin(LargeTableAdmin):
     list_display = ['bill', 'weight', 'rate_per_gram', 'value', 'created_at']
-    list_filter = ['created_at']
+    list_filter = [BillDateFilter]
+    list_select_related = ['bill__customer']
+    search_fields = ['bill__bill_number']
+    search_bill_field = 'bill'
+    autocomplete_fields = ['bill']
+    ordering = ['-id']
 
 
 @admin.register(Payment)
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(LargeTableAdmin):
     list_display = ['bill', 'amount', 'payment_method', 'payment_date', 'created_by']
-    list_filter = ['payment_method', 'payment_date']
+    list_filter = [BillDateFilter, 'payment_method']
+    list_select_related = ['bill__customer', 'created_by']
     search_fields = ['bill__bill_number']
+    search_bill_field = 'bill'
+    autocomplete_fields = ['bill']
+    raw_id_fields = ['created_by']
+    ordering = ['-id']
 
+
+@admin.register(Job)
+class JobAdmin(LargeTableAdmin):
+    list_display = ['id', 'kind', 'bill', 'status', 'attempts', 'run_at', 'updated_at']
+    list_filter = ['status', 'kind']
+    list_select_related = ['bill__customer']
+    search_fields = ['bill__bill_number']
+    search_bill_field = 'bill'
+    raw_id_fields = ['bill', 'created_by']
+    readonly_fields = ['locked_by', 'locked_at', 'created_at', 'updated_at', 'finished_at']
+    actions = ['retry_jobs']
+
+    @admin.action(description='Retry selected jobs')
+    def retry_jobs(self, request, queryset):
+        for job in queryset.exclude(status__in=[Job.QUEUED, Job.RUNNING]):
+            retry(job)
@@ -0,0 +1,185 @@
+"""
+ESC/POS thermal receipts
+
+Counter customers mostly want a thermal receipt, and printing one through
+the browser or a PDF is slow on the counter PCs. render_receipt() writes a
+bill straight into the ESC/POS byte stream that 58mm and 80mm receipt
+printers understand. It uses only the commands every such printer
+supports: initialize, alignment, bold, double size, feed and cut.
+
+The layout mirrors bill_print.html: shop header, customer, items grouped by
+item type with weight and fine subtotals, old gold, GST, net payable, cash
+and balance, and the customer's CI balance.
+
+render_receipt() works on plain data (see bill_receipt()), so the same
+input always gives the same bytes. ``python manage.py check_receipts``
+compares a sample receipt against the golden files in billing/golden/.
+Text is printed in the printer's default code page, so anything outside
+ASCII (e.g. the rupee sign) is replaced. Whole rupees are rounded half up,
+like ``floatformat:0`` on the bill sheet and PDF.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.utils import timezone
+
+from .grouping import items_by_type
+
+ESC = b'\x1b'
+GS = b'\x1d'
+
+INITIALIZE = ESC + b'@'
+ALIGN_LEFT = ESC + b'a\x00'
+ALIGN_CENTER = ESC + b'a\x01'
+BOLD_ON = ESC + b'E\x01'
+BOLD_OFF = ESC + b'E\x00'
+DOUBLE_SIZE = GS + b'!\x11'
+NORMAL_SIZE = GS + b'!\x00'
+# Feed past the cutter, then a partial cut
+FEED_AND_CUT = ESC + b'd\x04' + GS + b'V\x01'
+
+# Characters per line in the printer's default font, by paper width (mm)
+PAPER_COLUMNS = {58: 32, 80: 48}
+
+
+def text(value):
+    return str(value).encode('ascii', 'replace') + b'\n'
+
+
+def fit(value, columns):
+    value = ' '.join(str(value).split())
+    return value if len(value) <= columns else value[:columns - 1] + '~'
+
+
+def pair(left, right, columns):
+    """One line with ``left`` flush left and ``right`` flush right"""
+    right = str(right)
+    left = fit(left, max(columns - len(right) - 1, 1))
+    return f'{left}{" " * (columns - len(left) - len(right))}{right}'
+
+
+def rupees(value):
+    """Whole rupees, rounded half up as ``floatformat:0`` does (never -0)"""
+    value = Decimal(value).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+    return value if value else Decimal(0)
+
+
+def row(values, widths):
+    """Cells right-aligned to their widths"""
+    return ''.join(f'{value:>{width}}' for value, width in zip(values, widths))
+
+
+def cell_widths(columns):
+    # Net weight, tunch, fine, amount
+    if columns >= 48:
+        return [12, 8, 12, columns - 32]
+    return [8, 6, 8, columns - 22]
+
+
+def bill_receipt(bill):
+    """The plain data render_receipt() prints for a bill"""
+    groups = [
+        {
+            'items': [
+                {
+                    'type': item.item_type[:1],
+                    'description': ' '.join(filter(None, [item.description, item.item_number])),
+                    'net_weight': item.net_weight,
+                    'tunch_wstg': item.tunch_wstg,
+                    'g_fine': item.g_fine,
+                    'amount': item.amount,
+                }
+                for item in group['items']
+            ],
+            'total_weight': group['total_weight'],
+            'total_gfine': group['total_gfine'],
+        }
+        for group in items_by_type(bill).values()
+    ]
+    return {
+        'shop_name': bill.shop_name,
+        'shop_address': bill.shop_address,
+        'shop_gstin': bill.shop_gstin,
+        'bill_number': bill.bill_number,
+        'bill_date': timezone.localtime(bill.bill_date) if bill.bill_date else None,
+        'customer': bill.customer.name,
+        'groups': groups,
+        'old_gold': [
+            {'weight': exchange.weight, 'rate': exchange.rate_per_gram, 'value': exchange.value}
+            for exchange in bill.old_gold_exchanges.all()
+        ],
+        'total_fine_gold': bill.total_fine_gold,
+        'total_amount': bill.total_amount,
+        'cgst_percent': bill.cgst_percent,
+        'cgst_amount': bill.cgst_amount,
+        'sgst_percent': bill.sgst_percent,
+        'sgst_amount': bill.sgst_amount,
+        'net_payable': bill.net_payable,
+        'cash_received': bill.cash_received,
+        'balance': bill.balance,
+        'ci_balance_gold': bill.ci_balance_gold,
+        'ci_balance_dr': bill.ci_balance_dr,
+        'ci_balance_cr': bill.ci_balance_cr,
+    }
+
+
+def render_receipt(receipt, paper_width=80):
+    """ESC/POS bytes of a receipt (see bill_receipt()) for 58 or 80mm paper"""
+    try:
+        columns = PAPER_COLUMNS[paper_width]
+    except KeyError:
+        raise ValueError(f'Unsupported paper width: {paper_width}mm')
+    rule = text('-' * columns)
+    widths = cell_widths(columns)
+    out = [INITIALIZE, ALIGN_CENTER, BOLD_ON, DOUBLE_SIZE, text(fit(receipt['shop_name'], columns // 2)), NORMAL_SIZE, BOLD_OFF]
+    for line in (receipt['shop_address'] or '').splitlines():
+        if line.strip():
+            out.append(text(fit(line, columns)))
+    if receipt['shop_gstin']:
+        out.append(text(f'GSTIN: {receipt["shop_gstin"]}'))
+    out.append(text('ROUGH ESTIMATE'))
+
+    bill_date = receipt['bill_date']
+    out += [
+        ALIGN_LEFT,
+        text(f'Bill: {receipt["bill_number"]}'),
+        text(f'Date: {bill_date:%d/%m/%Y %H:%M}' if bill_date else ''),
+        BOLD_ON, text(fit(receipt['customer'].upper(), columns)), BOLD_OFF,
+        rule,
+        text(row(['Net.Wt', 'Tunch', 'GFine', 'Amount'], widths)),
+        rule,
+    ]
+    for group in receipt['groups']:
+        for item in group['items']:
+            out.append(text(fit(f'{item["type"]} {item["description"]}', columns)))
+            out.append(text(row([
+                f'{item["net_weight"]:.3f}', f'{item["tunch_wstg"]:.2f}',
+                f'{item["g_fine"]:.3f}', f'{item["amount"]:.2f}',
+            ], widths)))
+        out += [
+            BOLD_ON,
+            text(pair(f'GWt: {group["total_weight"]:.3f}', f'GFine: {group["total_gfine"]:.3f}', columns)),
+            BOLD_OFF,
+        ]
+    out.append(rule)
+
+    out.append(text(pair('Fine Gold', f'{receipt["total_fine_gold"]:.3f}', columns)))
+    out.append(text(pair('Amount', f'{receipt["total_amount"]:.2f}', columns)))
+    for old in receipt['old_gold']:
+        out.append(text(pair(f'Old Gold {old["weight"]:.3f}g @ {old["rate"]:.2f}', f'-{old["value"]:.2f}', columns)))
+    if receipt['cgst_amount']:
+        out.append(text(pair(f'CGST {receipt["cgst_percent"]:.2f}%', f'{receipt["cgst_amount"]:.2f}', columns)))
+    if receipt['sgst_amount']:
+        out.append(text(pair(f'SGST {receipt["sgst_percent"]:.2f}%', f'{receipt["sgst_amount"]:.2f}', columns)))
+    out += [
+        BOLD_ON, text(pair('Net Payable', f'{rupees(receipt["net_payable"])}', columns)), BOLD_OFF,
+        text(pair('Receipt By CASH', f'-{rupees(receipt["cash_received"])}', columns)),
+        text(pair('Balance', f'{rupees(receipt["balance"])}', columns)),
+        rule,
+        text('CI Balance:'),
+        text(pair(f'Gold: {receipt["ci_balance_gold"]:.3f}', f'Dr {receipt["ci_balance_dr"]:.2f}', columns)),
+        text(pair('', f'Cr {receipt["ci_balance_cr"]:.2f}', columns)),
+        ALIGN_CENTER,
+        text('HAVE A NICE DAY'),
+        FEED_AND_CUT,
+    ]
+    return b''.join(out)
@@ -0,0 +1,170 @@
+"""
+Streaming exports of bills, items and payments
+
+Exports are generators of text lines, written to a StreamingHttpResponse
+as they are produced. Rows are read with ``iterator(chunk_size=...)`` (a
+server-side cursor on PostgreSQL), so a worker holds one chunk at a time
+however long the date range is.
+
+CSV exports are flat, one row per bill, item or payment, with the bill and
+customer columns repeated on item and payment rows. The JSONL export writes
+one bill per line with its customer, items, old gold and payments nested.
+"""
+import csv
+import json
+from collections import defaultdict
+from datetime import datetime
+from itertools import islice
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import BillItem, OldGold, Payment
+
+DATASETS = ['bills', 'items', 'payments']
+FORMATS = ['csv', 'jsonl']
+
+BILL_COLUMNS = [
+    ('bill_number', 'bill_number'),
+    ('bill_date', 'bill_date'),
+    ('status', 'status'),
+    ('customer_name', 'customer__name'),
+    ('customer_phone', 'customer__phone'),
+    ('customer_email', 'customer__email'),
+]
+
+DATASET_COLUMNS = {
+    'bills': BILL_COLUMNS + [
+        ('gold_rate', 'gold_rate'),
+        ('total_fine_gold', 'total_fine_gold'),
+        ('total_amount', 'total_amount'),
+        ('old_gold_weight', 'old_gold_weight'),
+        ('old_gold_value', 'old_gold_value'),
+        ('cgst_amount', 'cgst_amount'),
+        ('sgst_amount', 'sgst_amount'),
+        ('net_payable', 'net_payable'),
+        ('cash_received', 'cash_received'),
+        ('balance', 'balance'),
+    ],
+    'items': [(name, f'bill__{lookup}') for name, lookup in BILL_COLUMNS] + [
+        ('item_type', 'item_type'),
+        ('material_type', 'material_type'),
+        ('description', 'description'),
+        ('item_code', 'item_code'),
+        ('item_number', 'item_number'),
+        ('net_weight', 'net_weight'),
+        ('tunch_wstg', 'tunch_wstg'),
+        ('labour', 'labour'),
+        ('rate', 'rate'),
+        ('g_fine', 'g_fine'),
+        ('amount', 'amount'),
+    ],
+    'payments': [(name, f'bill__{lookup}') for name, lookup in BILL_COLUMNS] + [
+        ('payment_date', 'payment_date'),
+        ('payment_method', 'payment_method'),
+        ('amount', 'amount'),
+        ('notes', 'notes'),
+    ],
+}
+
+OLD_GOLD_FIELDS = ['weight', 'rate_per_gram', 'value', 'description']
+
+DATASET_MODELS = {
+    'items': BillItem,
+    'payments': Payment,
+}
+
+
+def chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 500)
+
+
+def local_value(value):
+    """Timestamps are exported in the shop's timezone, not UTC"""
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        return timezone.localtime(value).isoformat(sep=' ', timespec='seconds')
+    return value
+
+
+class Echo:
+    """File-like object whose write() returns the line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def dataset_rows(bills, dataset):
+    """Flat value tuples of one dataset, in bill order"""
+    lookups = [lookup for name, lookup in DATASET_COLUMNS[dataset]]
+    if dataset == 'bills':
+        rows = bills.order_by('bill_date', 'pk')
+    else:
+        rows = DATASET_MODELS[dataset].objects.filter(bill__in=bills.values('pk')).order_by(
+            'bill__bill_date', 'bill_id', 'pk'
+        )
+    return rows.values_list(*lookups).iterator(chunk_size=chunk_size())
+
+
+def export_csv(bills, dataset):
+    """Yield a CSV export of a dataset line by line, header first"""
+    writer = csv.writer(Echo())
+    yield writer.writerow([name for name, lookup in DATASET_COLUMNS[dataset]])
+    for row in dataset_rows(bills, dataset):
+        yield writer.writerow([local_value(value) for value in row])
+
+
+def own_lookups(dataset):
+    """Columns of a dataset that belong to the row itself, not its bill"""
+    return [lookup for name, lookup in DATASET_COLUMNS[dataset] if not lookup.startswith('bill__')]
+
+
+def rows_by_bill(queryset, bill_ids, fields):
+    """Rows of a child table for a set of bills, grouped by bill id"""
+    grouped = defaultdict(list)
+    rows = queryset.filter(bill_id__in=bill_ids).order_by('bill_id', 'pk').values('bill_id', *fields)
+    for row in rows:
+        bill_id = row.pop('bill_id')
+        grouped[bill_id].append({field: local_value(value) for field, value in row.items()})
+    return grouped
+
+
+def bill_records(bills):
+    """One chunk of bills with customer and rows nested, for the JSONL export"""
+    bill_ids = [bill['pk'] for bill in bills]
+    items = rows_by_bill(BillItem.objects.all(), bill_ids, own_lookups('items'))
+    old_gold = rows_by_bill(OldGold.objects.all(), bill_ids, OLD_GOLD_FIELDS)
+    payments = rows_by_bill(Payment.objects.all(), bill_ids, own_lookups('payments'))
+    for bill in bills:
+        bill_id = bill.pop('pk')
+        record = {
+            name: local_value(bill.pop(lookup))
+            for name, lookup in DATASET_COLUMNS['bills'] if not lookup.startswith('customer__')
+        }
+        record['customer'] = {
+            name[len('customer_'):]: bill.pop(lookup)
+            for name, lookup in DATASET_COLUMNS['bills'] if lookup.startswith('customer__')
+        }
+        record['items'] = items.get(bill_id, [])
+        record['old_gold'] = old_gold.get(bill_id, [])
+        record['payments'] = payments.get(bill_id, [])
+        yield record
+
+
+def export_jsonl(bills):
+    """Yield one JSON line per bill with everything it contains
+
+    Rows are read as plain values, a chunk of bills and then the items, old
+    gold and payments of that chunk, so nothing outlives its chunk. Model
+    instances with prefetched rows point back at each other and are only
+    freed by the cyclic garbage collector, which lets memory grow.
+    """
+    rows = bills.order_by('bill_date', 'pk').values(
+        'pk', *[lookup for name, lookup in DATASET_COLUMNS['bills']]
+    ).iterator(chunk_size=chunk_size())
+    while True:
+        chunk = list(islice(rows, chunk_size()))
+        if not chunk:
+            break
+        for record in bill_records(chunk):
+            yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
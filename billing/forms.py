@@ -1,5 +1,6 @@
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm
+from django.urls import reverse_lazy
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Row, Column, Submit, HTML
 from .models import Customer, Bill, BillItem, OldGold, Payment, GoldRate, SilverRate, BarRate
@@ -185,11 +186,40 @@ class OldGoldForm(forms.ModelForm):
         )
 
 
+class CustomerTypeaheadSelect(forms.Select):
+    """Select that renders only the chosen customer
+
+    The other options are filled in by the typeahead in static/js/main.js
+    from the customer_search API, so the page does not grow with the
+    number of customers. Validation is still ModelChoiceField's single
+    lookup of the chosen primary key.
+    """
+
+    def __init__(self, attrs=None):
+        attrs = {'class': 'form-control', 'data-typeahead-url': reverse_lazy('customer_search'), **(attrs or {})}
+        super().__init__(attrs)
+
+    def optgroups(self, name, value, attrs=None):
+        selected = [pk for pk in value if pk]
+        customers = self.choices.queryset.filter(pk__in=selected) if selected else []
+        options = [
+            self.create_option(name, customer.pk, customer_label(customer), True, index)
+            for index, customer in enumerate(customers)
+        ]
+        if not options:
+            options.append(self.create_option(name, '', self.choices.field.empty_label or '', False, 0))
+        return [(None, options, 0)]
+
+
+def customer_label(customer):
+    return f'{customer.name} ({customer.phone})' if customer.phone else customer.name
+
+
 class BillForm(forms.ModelForm):
     """Bill form"""
     customer = forms.ModelChoiceField(
         queryset=Customer.objects.all(),
-        widget=forms.Select(attrs={'class': 'form-control'}),
+        widget=CustomerTypeaheadSelect(),
         required=True
     )
 
@@ -217,10 +247,6 @@ class BillForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # If instance exists and has payments, set cash_received to sum of payments
-        if self.instance and self.instance.pk and self.instance.payments.exists():
-            total_payments = sum(p.amount for p in self.instance.payments.all())
-            self.initial['cash_received'] = total_payments
         self.helper = FormHelper()
         self.helper.layout = Layout(
             'customer',
@@ -281,7 +307,7 @@ class BillSearchForm(forms.Form):
         required=False,
         widget=forms.TextInput(attrs={
             'class': 'form-control',
-            'placeholder': 'Search by bill number or customer name...'
+            'placeholder': 'Search by bill number, customer, phone or item...'
         })
     )
     status = forms.ChoiceField(
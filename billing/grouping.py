@@ -0,0 +1,52 @@
+"""
+Bill items grouped by item type
+
+The bill sheet, the PDF, the thermal receipt and the snapshots all show a
+bill's items grouped by item type, each group with its net weight and GFine
+subtotals. items_by_type() builds the groups for all of them.
+
+It reads the items in one query. The database computes the subtotals in
+the same query, with a SUM() window over the item type, so they always
+match the rows that were read. Subtotals are exact Decimals. The old
+``sum_field`` template filter summed through floats.
+"""
+from decimal import Decimal
+
+from django.db.models import DecimalField, F, Sum, Window
+
+# Subtotal name -> item field it sums
+SUBTOTALS = {'total_weight': 'net_weight', 'total_gfine': 'g_fine'}
+# Decimal places of the summed fields
+PLACES = Decimal('0.001')
+
+
+def subtotal(field):
+    """SUM() of an item field over the item's type"""
+    source = DecimalField(max_digits=20, decimal_places=3)
+    return Window(Sum(field, output_field=source), partition_by=[F('item_type')], output_field=source)
+
+
+def items_by_type(bill, items=None):
+    """Items of a bill grouped by item type, with weight and fine subtotals
+
+    ``items`` may be passed when the caller already holds the bill's items
+    (prefetched, or loaded from a snapshot). Their subtotals are then summed
+    in memory.
+    """
+    groups = {}
+    if items is None:
+        items = bill.items.annotate(**{name: subtotal(field) for name, field in SUBTOTALS.items()})
+        for item in items:
+            if item.item_type not in groups:
+                # SQLite sums decimals as floats; round back to the fields' places
+                groups[item.item_type] = {'items': [], **{name: getattr(item, name).quantize(PLACES) for name in SUBTOTALS}}
+            groups[item.item_type]['items'].append(item)
+        return groups
+
+    for item in items:
+        if item.item_type not in groups:
+            groups[item.item_type] = {'items': [], **{name: Decimal('0.000') for name in SUBTOTALS}}
+        groups[item.item_type]['items'].append(item)
+        for name, field in SUBTOTALS.items():
+            groups[item.item_type][name] += getattr(item, field)
+    return groups
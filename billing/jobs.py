@@ -0,0 +1,257 @@
+"""
+Background jobs
+
+Slow work (rendering a bill PDF, talking to the SMTP server) runs in
+``python manage.py run_jobs`` workers instead of inside the request. Jobs
+are rows of billing.Job, so no broker is needed:
+
+* enqueue() inserts a queued job. Workers see it once the enqueuing
+  transaction commits.
+* claim() takes the oldest due job with a conditional
+  ``UPDATE ... WHERE status = 'queued'``, so two workers never run the same
+  job, on any database.
+* A failing job is retried with exponential backoff: JOB_RETRY_DELAY
+  seconds, doubling per attempt up to JOB_RETRY_MAX_DELAY. After
+  ``max_attempts`` it is left 'dead' and listed at /jobs/failed/ until
+  someone retries it.
+* A job left 'running' for longer than JOB_LOCK_TIMEOUT seconds lost its
+  worker and is queued again (or marked dead if it has no attempts left).
+  Jobs that may run longer call heartbeat() as they go.
+* Jobs registered with ``once=True`` (emails) are not queued again after
+  their worker was lost, as they may have finished their work already:
+  they are marked dead for someone to check and retry. An email job also
+  records on the job that its email went out before it is released, and
+  never sends it again once that is recorded.
+
+Handlers are registered with ``@handler(kind)``, receive the job and return
+a JSON-serializable result.
+"""
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+
+from . import pdf_archive
+from .models import Bill, Job
+from .snapshots import bill_pdf
+
+HANDLERS = {}
+# Kinds whose jobs must not run again after their worker was lost
+RUN_ONCE = set()
+
+# Characters of a traceback kept in Job.last_error
+MAX_ERROR_LENGTH = 4000
+
+
+def handler(kind, once=False):
+    """Register the function that runs jobs of one kind
+
+    With ``once``, a job whose worker was lost is left dead instead of
+    being queued again.
+    """
+    def decorator(func):
+        HANDLERS[kind] = func
+        if once:
+            RUN_ONCE.add(kind)
+        return func
+    return decorator
+
+
+def setting(name, default):
+    return getattr(settings, name, default)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue(kind, payload=None, bill=None, user=None, unique=False):
+    """Queue a job; with ``unique``, reuse a pending job of the same kind and bill"""
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    if unique:
+        pending = Job.objects.filter(kind=kind, bill=bill, status__in=[Job.QUEUED, Job.RUNNING]).first()
+        if pending is not None:
+            return pending
+    return Job.objects.create(
+        kind=kind,
+        payload=payload or {},
+        bill=bill,
+        created_by=user if user is not None and user.is_authenticated else None,
+        max_attempts=setting('JOB_MAX_ATTEMPTS', 5),
+    )
+
+
+def retry_delay(attempts):
+    """Seconds to wait before running a job again after its Nth failure"""
+    delay = setting('JOB_RETRY_DELAY', 30) * 2 ** max(attempts - 1, 0)
+    return min(delay, setting('JOB_RETRY_MAX_DELAY', 3600))
+
+
+def release_stale(now=None):
+    """Requeue (or give up on) running jobs whose worker went away"""
+    now = now or timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        locked_at__lt=now - timedelta(seconds=setting('JOB_LOCK_TIMEOUT', 600)),
+    )
+    dead = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.DEAD, last_error='Worker stopped while running the job', finished_at=now, updated_at=now,
+    )
+    dead += stale.filter(kind__in=RUN_ONCE).update(
+        status=Job.DEAD, finished_at=now, updated_at=now,
+        last_error='Worker stopped while running the job; check whether it finished before retrying it',
+    )
+    requeued = stale.update(status=Job.QUEUED, locked_by='', locked_at=None, run_at=now, updated_at=now)
+    return requeued + dead
+
+
+def heartbeat(job, result=None):
+    """Tell release_stale() that a long job's worker is still at it
+
+    ``result`` is stored as the job's result so far, e.g. its progress.
+    """
+    now = timezone.now()
+    fields = {'locked_at': now, 'updated_at': now}
+    if result is not None:
+        fields['result'] = result
+    Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by).update(**fields)
+
+
+def claim(worker):
+    """Take the oldest due job for a worker, or return None"""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+    for pk in due.values_list('pk', flat=True)[:10]:
+        # Another worker may have taken it since; only one UPDATE matches
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, locked_by=worker, locked_at=now,
+            attempts=F('attempts') + 1, updated_at=now,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run_job(job):
+    """Run a claimed job and record its outcome"""
+    func = HANDLERS.get(job.kind)
+    try:
+        if func is None:
+            raise LookupError(f'No handler for job kind {job.kind!r}')
+        result = func(job)
+    except Exception:
+        fail(job, traceback.format_exc())
+    else:
+        job.status = Job.SUCCEEDED
+        job.result = result
+        job.last_error = ''
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'result', 'last_error', 'finished_at', 'updated_at'])
+    return job
+
+
+def fail(job, error):
+    """Schedule a retry of a failed job, or leave it dead"""
+    now = timezone.now()
+    job.last_error = error[-MAX_ERROR_LENGTH:]
+    job.locked_by = ''
+    job.locked_at = None
+    if job.attempts >= job.max_attempts:
+        job.status = Job.DEAD
+        job.finished_at = now
+    else:
+        job.status = Job.QUEUED
+        job.run_at = now + timedelta(seconds=retry_delay(job.attempts))
+    job.save(update_fields=['status', 'last_error', 'locked_by', 'locked_at', 'run_at', 'finished_at', 'updated_at'])
+
+
+def retry(job):
+    """Queue a dead job again with a fresh set of attempts"""
+    job.status = Job.QUEUED
+    job.attempts = 0
+    job.run_at = timezone.now()
+    job.finished_at = None
+    job.save(update_fields=['status', 'attempts', 'run_at', 'finished_at', 'updated_at'])
+    return job
+
+
+def job_status(job):
+    """A job in the shape returned by the job status API"""
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'finished': job.is_finished,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'run_at': job.run_at.isoformat(),
+        'error': job.last_error.strip().splitlines()[-1] if job.last_error else '',
+        'status_url': reverse('job_status', args=[job.pk]),
+    }
+
+
+@handler('bill_pdf')
+def render_pdf(job):
+    """Render a bill's PDF into the PDF cache"""
+    _, pdf = bill_pdf(job.bill_id)
+    return {'bytes': len(pdf)}
+
+
+@handler('bill_email', once=True)
+def send_bill_email(job):
+    """Email a bill's PDF to its customer"""
+    if (job.result or {}).get('sent'):
+        # Sent by an earlier attempt that was lost before it finished
+        return job.result
+    bill, pdf_file = bill_pdf(job.bill_id)
+    to = job.payload.get('to') or bill.customer.email
+    if not to:
+        raise ValueError('Customer email not found')
+
+    email = EmailMessage(
+        subject=f'Bill {bill.bill_number} - {bill.customer.name}',
+        body=f'Please find attached bill {bill.bill_number} for {bill.customer.name}.',
+        from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'noreply@jewellerybilling.com'),
+        to=[to],
+    )
+    email.attach(f'bill_{bill.bill_number}.pdf', pdf_file, 'application/pdf')
+    email.send()
+    result = {'to': to, 'sent': True}
+    heartbeat(job, result)
+    return result
+
+
+@handler('pdf_archive')
+def build_pdf_archive(job):
+    """Render the PDFs of a date range's bills into a ZIP under MEDIA_ROOT"""
+    bills = Bill.objects.filter(
+        business_date__gte=job.payload['date_from'],
+        business_date__lte=job.payload['date_to'],
+    )
+    bill_ids = pdf_archive.archive_bills(bills)
+    path = pdf_archive.new_archive_path(job)
+    # Often enough for the pending page, which refreshes as often as
+    # workers poll, and to keep a long archive from outliving
+    # JOB_LOCK_TIMEOUT and being taken for the job of a dead worker
+    interval = min(setting('JOB_POLL_INTERVAL', 2), setting('JOB_LOCK_TIMEOUT', 600) / 4)
+    last_beat = time.monotonic()
+    heartbeat(job, {'done': 0, 'total': len(bill_ids)})
+
+    def progress(done, total):
+        nonlocal last_beat
+        if time.monotonic() - last_beat > interval:
+            heartbeat(job, {'done': done, 'total': total})
+            last_beat = time.monotonic()
+
+    pdf_archive.write_archive(path, bill_ids, workers=pdf_archive.worker_count(), progress=progress)
+    pdf_archive.evict()
+    return {'file': path.name, 'bills': len(bill_ids), 'bytes': path.stat().st_size}
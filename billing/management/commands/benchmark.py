@@ -0,0 +1,707 @@
+"""
+Django management command to benchmark billing hot paths.
+Usage: python manage.py benchmark [scenario ...] [--sizes 1,10,40,100]
+
+Every scenario runs inside a transaction that is rolled back at the end,
+so it is safe to run against a development database.
+"""
+import json
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from billing.models import Bill, Customer, Payment
+
+
+SCENARIOS = {}
+
+
+def scenario(name, atomic=True):
+    """Register a benchmark scenario
+
+    Scenarios that need to commit (e.g. to be seen by other threads) pass
+    ``atomic=False`` and must clean up after themselves.
+    """
+    def decorator(func):
+        func.atomic = atomic
+        SCENARIOS[name] = func
+        return func
+    return decorator
+
+
+def measure(func, *args, **kwargs):
+    """Run func and return (result, query count, elapsed milliseconds)"""
+    # The query log keeps only the last 9000 queries; start from an empty one
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = (time.perf_counter() - start) * 1000
+    return result, len(queries), elapsed
+
+
+def sample_items(count):
+    """Item payloads in the shape posted by the bill form"""
+    return [
+        {
+            'item_type': 'S' if idx % 4 else 'REC',
+            'material_type': 'gold',
+            'description': f'Benchmark item {idx}',
+            'item_code': f'BM{idx:04d}',
+            'item_number': str(5000 + idx),
+            'net_weight': '10.250',
+            'tunch_wstg': '91.60',
+            'labour': '250.00',
+            'rate': '7000.00',
+        }
+        for idx in range(count)
+    ]
+
+
+def sample_customer():
+    return Customer.objects.create(name='Benchmark Customer', phone='9999999999')
+
+
+def sample_bills(customer, count, items_per_bill=3):
+    """Create ``count`` bills (each with a few items) through assemble_bill"""
+    from billing.services import assemble_bill
+
+    bills = []
+    for _ in range(count):
+        bill = Bill(customer=customer, gold_rate=Decimal('7000.00'))
+        bill.save()
+        assemble_bill(bill, sample_items(items_per_bill), [])
+        bills.append(bill)
+    return bills
+
+
+def render_view(view, path='/', user=None, **kwargs):
+    """Render a view for a GET request and return the response"""
+    from django.test import RequestFactory
+
+    request = RequestFactory().get(path)
+    request.user = user or get_user_model()(username='benchmark', is_staff=True, is_superuser=True)
+    response = view(request, **kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+@scenario('bill_assembly')
+def bench_bill_assembly(command, sizes):
+    """Create a bill with N items and one old gold row through assemble_bill"""
+    from billing.services import assemble_bill
+
+    customer = sample_customer()
+    user = get_user_model().objects.first()
+    old_gold = [{'weight': '5.000', 'rate_per_gram': '6500.00'}]
+    for size in sizes:
+        items = json.loads(json.dumps(sample_items(size)))
+
+        def create():
+            bill = Bill(customer=customer, created_by=user, gold_rate=Decimal('7000.00'))
+            bill.save()
+            assemble_bill(bill, items, old_gold)
+            return bill
+
+        _, queries, elapsed = measure(create)
+        command.report('bill_assembly', size, queries, elapsed)
+
+
+@scenario('item_edit')
+def bench_item_edit(command, sizes):
+    """Edit one item and add one payment on a bill with N items"""
+    from billing.services import assemble_bill
+
+    customer = sample_customer()
+    for size in sizes:
+        bill = Bill(customer=customer, gold_rate=Decimal('7000.00'))
+        bill.save()
+        assemble_bill(bill, sample_items(size), [])
+        item = bill.items.first()
+        item.net_weight += Decimal('1.000')
+
+        _, queries, elapsed = measure(item.save)
+        command.report('item_edit', size, queries, elapsed)
+        _, queries, elapsed = measure(
+            Payment.objects.create, bill=bill, amount=Decimal('100.00')
+        )
+        command.report('payment_add', size, queries, elapsed)
+
+
+@scenario('deferred_recalc')
+def bench_deferred_recalc(command, sizes):
+    """Edit every item of a bill with N items, with and without deferred_recalc
+
+    The benchmark transaction never commits, so both paths run the on_commit
+    hooks they register (rollup, search index, PDF cache, snapshots) as soon
+    as they finish, as a commit would.
+    """
+    from billing.recalc import deferred_recalc
+    from billing.services import assemble_bill
+
+    def committed(func):
+        def run():
+            with TestCase.captureOnCommitCallbacks(execute=True):
+                return func()
+        return run
+
+    customer = sample_customer()
+    for size in sizes:
+        def create():
+            bill = Bill(customer=customer, gold_rate=Decimal('7000.00'))
+            bill.save()
+            assemble_bill(bill, sample_items(size), [])
+            return bill
+
+        # Flush the hooks of the setup so neither path pays for them
+        bill = committed(create)()
+        items = list(bill.items.all())
+
+        def edit_all():
+            for item in items:
+                item.labour += Decimal('1.00')
+                item.save()
+
+        def edit_all_deferred():
+            with deferred_recalc() as batch:
+                edit_all()
+            return batch
+
+        _, queries, elapsed = measure(committed(edit_all))
+        command.report('edit_items_immediate', size, queries, elapsed)
+        batch, queries, elapsed = measure(committed(edit_all_deferred))
+        command.report('edit_items_deferred', size, queries, elapsed)
+        command.stdout.write(
+            f'{"":<24} changes={batch.changes} recalculated={batch.recalculated} '
+            f'coalesced={batch.coalesced}'
+        )
+        if bill.totals_drift():
+            raise CommandError(f'Totals drifted for bill {bill.pk}: {bill.totals_drift()}')
+
+
+@scenario('bill_numbers', atomic=False)
+def bench_bill_numbers(command, sizes):
+    """Allocate N bill numbers from 8 threads and check they are unique"""
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import date
+    from django.db import connections
+    from billing.models import BillSequence
+    from billing import sequences
+    from billing.sequences import next_bill_number
+
+    threads = 8
+    # A day no real bill uses, removed again at the end
+    day = date(2999, 12, 31)
+
+    def allocate(count):
+        try:
+            return [next_bill_number(day) for _ in range(count)]
+        finally:
+            connections.close_all()
+
+    try:
+        for block_size in (1, 20):
+            for size in sizes:
+                def run():
+                    with ThreadPoolExecutor(max_workers=threads) as pool:
+                        chunks = [size // threads + (1 if idx < size % threads else 0) for idx in range(threads)]
+                        return [number for numbers in pool.map(allocate, chunks) for number in numbers]
+
+                with override_settings(BILL_NUMBER_BLOCK_SIZE=block_size):
+                    numbers, _, elapsed = measure(run)
+                if len(set(numbers)) != len(numbers):
+                    raise CommandError(f'Duplicate bill numbers allocated for n={size}')
+                command.stdout.write(
+                    f'{"bill_numbers":<24} n={size:<6} block={block_size:<4} unique={len(numbers):<6} '
+                    f'{elapsed:10.2f} ms {len(numbers) / elapsed * 1000:10.0f}/s'
+                )
+                BillSequence.objects.filter(day=day).delete()
+                sequences._blocks.clear()
+    finally:
+        BillSequence.objects.filter(day=day).delete()
+        sequences._blocks.clear()
+
+
+@scenario('rate_at')
+def bench_rate_at(command, sizes):
+    """Resolve N as-of rate lookups over a three-year hourly gold rate history"""
+    import random
+    from datetime import timedelta
+    from django.utils import timezone
+    from billing.models import GoldRate
+    from billing.rates import invalidate_rate_board, rate_at
+
+    now = timezone.now()
+    ticks = 3 * 365 * 24
+    start = now - timedelta(hours=ticks)
+    # Raw inserts: the ORM would overwrite updated_at (auto_now)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {GoldRate._meta.db_table} (rate_24k, updated_at, is_active) VALUES (%s, %s, %s)',
+            [
+                (
+                    connection.ops.adapt_decimalfield_value(Decimal(6000 + idx % 1500), 10, 2),
+                    connection.ops.adapt_datetimefield_value(start + timedelta(hours=idx)),
+                    False,
+                )
+                for idx in range(ticks)
+            ],
+        )
+    invalidate_rate_board()
+    rng = random.Random(42)
+    try:
+        for size in sizes:
+            recent = [now - timedelta(hours=rng.randint(0, 300 * 24)) for _ in range(size)]
+            old = [now - timedelta(hours=rng.randint(500 * 24, ticks)) for _ in range(size)]
+            for label, timestamps in (('rate_at_recent', recent), ('rate_at_old', old)):
+                resolved, queries, elapsed = measure(lambda: [rate_at('gold', ts) for ts in timestamps])
+                command.report(label, size, queries, elapsed)
+                for ts, rate in list(zip(timestamps, resolved))[:20]:
+                    expected = GoldRate.objects.filter(updated_at__lte=ts).latest().rate_24k
+                    if rate != expected:
+                        raise CommandError(f'rate_at({ts}) returned {rate}, expected {expected}')
+    finally:
+        invalidate_rate_board()
+
+
+@scenario('dashboard')
+def bench_dashboard(command, sizes):
+    """Render the dashboard as the number of bills grows; the query count must not"""
+    from billing.views import DashboardView
+
+    customers = [sample_customer() for _ in range(10)]
+    view = DashboardView.as_view()
+    created = 0
+    baseline = None
+    for size in sizes:
+        while created < size:
+            sample_bills(customers[created % len(customers)], 1)
+            created += 1
+        render_view(view)  # warm the rate board
+        _, queries, elapsed = measure(render_view, view)
+        command.report('dashboard', size, queries, elapsed)
+        baseline = queries if baseline is None else baseline
+        if queries != baseline:
+            raise CommandError(f'Dashboard query count grew from {baseline} to {queries} at n={size}')
+
+
+@scenario('reports')
+def bench_reports(command, sizes):
+    """Render the reports page as the number of bills grows, checking the rollup totals"""
+    from django.db.models import Sum
+    from billing.views import ReportsView
+
+    customers = [sample_customer() for _ in range(10)]
+    view = ReportsView.as_view()
+    created = 0
+    for size in sizes:
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            while created < size:
+                sample_bills(customers[created % len(customers)], 1)
+                created += 1
+        response, queries, elapsed = measure(render_view, view, '/reports/')
+        command.report('reports', size, queries, elapsed)
+        expected = Bill.objects.filter(
+            pk__in=[bill.pk for bill in response.context_data['bills']]
+        ).aggregate(total=Sum('net_payable'))['total'] or 0
+        if response.context_data['total_sales'] != expected:
+            raise CommandError(
+                f'Rollup total {response.context_data["total_sales"]} != bills total {expected} at n={size}'
+            )
+
+
+@scenario('bill_list')
+def bench_bill_list(command, sizes):
+    """Render the first and the last page of the bill list with N bills"""
+    from billing.views import BillListView
+
+    customer = sample_customer()
+    view = BillListView.as_view()
+    created = 0
+    for size in sizes:
+        while created < size:
+            Bill(customer=customer, gold_rate=Decimal('7000.00')).save()
+            created += 1
+        path = '/bills/'
+        response, queries, elapsed = measure(render_view, view, path)
+        command.report('bill_list_first', size, queries, elapsed)
+        # Walk to the last page, timing only the final request
+        while response.context_data['page_obj'].has_next():
+            path = '/bills/' + response.context_data['page_obj'].next_url
+            response = render_view(view, path)
+        _, queries, elapsed = measure(render_view, view, path)
+        command.report('bill_list_last', size, queries, elapsed)
+
+
+@scenario('search')
+def bench_search(command, sizes):
+    """Find one customer's bill by item number among N bills, indexed vs icontains"""
+    from django.db.models import Q
+    from billing.search import search_bills
+
+    customers = [Customer.objects.create(name=f'Customer {idx:03d}', phone=f'98000{idx:05d}') for idx in range(50)]
+    created = 0
+    for size in sizes:
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            while created < size:
+                sample_bills(customers[created % len(customers)], 1)
+                created += 1
+        target = Bill.objects.order_by('pk')[created // 2]
+        target.items.filter(pk=target.items.first().pk).update(item_number='5570')
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            target.items.first().save()
+        query = f'5570 {target.customer.name}'
+
+        found, queries, elapsed = measure(search_bills, query)
+        command.report('search_indexed', size, queries, elapsed)
+        if not found or found[0] != target.pk:
+            raise CommandError(f'Search for {query!r} did not rank bill {target.pk} first: {found[:5]}')
+
+        def scan():
+            return list(Bill.objects.filter(
+                Q(items__item_number__icontains='5570') & Q(customer__name__icontains=target.customer.name)
+            ).values_list('pk', flat=True).distinct())
+
+        _, queries, elapsed = measure(scan)
+        command.report('search_icontains', size, queries, elapsed)
+
+
+@scenario('bill_form')
+def bench_bill_form(command, sizes):
+    """Render the create and update bill pages with N customers; size must not grow"""
+    from billing.views import bill_create, bill_update
+
+    customer = sample_customer()
+    bill = sample_bills(customer, 1)[0]
+    created = 1
+    for size in sizes:
+        Customer.objects.bulk_create([
+            Customer(name=f'Customer {idx:06d}', phone=f'97{idx:08d}') for idx in range(created, size)
+        ])
+        created = max(created, size)
+        response, queries, elapsed = measure(render_view, bill_create, '/bills/create/')
+        command.stdout.write(
+            f'{"bill_create_page":<24} n={size:<6} queries={queries:<6} {elapsed:10.2f} ms '
+            f'{len(response.content) / 1024:8.1f} KiB'
+        )
+        response, queries, elapsed = measure(render_view, bill_update, f'/bills/{bill.pk}/update/', pk=bill.pk)
+        command.stdout.write(
+            f'{"bill_update_page":<24} n={size:<6} queries={queries:<6} {elapsed:10.2f} ms '
+            f'{len(response.content) / 1024:8.1f} KiB'
+        )
+
+
+@scenario('export')
+def bench_export(command, sizes):
+    """Stream every export of N bills; peak memory must stay flat as N grows"""
+    import tracemalloc
+    from billing.views import reports_export
+
+    customers = [sample_customer() for _ in range(10)]
+    created = 0
+    for size in sizes:
+        while created < size:
+            sample_bills(customers[created % len(customers)], 1)
+            created += 1
+        exports = {
+            'export_bills_csv': 'format=csv&dataset=bills',
+            'export_items_csv': 'format=csv&dataset=items',
+            'export_jsonl': 'format=jsonl',
+        }
+        for label, export in exports.items():
+            def stream():
+                response = render_view(reports_export, f'/reports/export/?{export}')
+                return sum(len(chunk) for chunk in response.streaming_content)
+
+            tracemalloc.start()
+            size_bytes, queries, elapsed = measure(stream)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            command.stdout.write(
+                f'{label:<24} '
+                f'n={size:<6} queries={queries:<6} {elapsed:10.2f} ms '
+                f'{size_bytes / 1024:8.0f} KiB out {peak / 1024:8.0f} KiB peak'
+            )
+
+
+@scenario('bill_pdf')
+def bench_bill_pdf(command, sizes):
+    """Render the PDF of a bill with N items, then serve it from the PDF cache"""
+    import tempfile
+    from billing import pdfs
+
+    if not pdfs.WEASYPRINT_AVAILABLE:
+        command.stdout.write('bill_pdf: skipped, WeasyPrint is not installed')
+        return
+    customer = sample_customer()
+    with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+        for size in sizes:
+            bill = sample_bills(customer, 1, items_per_bill=size)[0]
+            bill.refresh_from_db()
+            _, queries, elapsed = measure(pdfs.get_bill_pdf, bill)
+            command.report('bill_pdf_render', size, queries, elapsed)
+            _, queries, elapsed = measure(pdfs.get_bill_pdf, bill)
+            command.report('bill_pdf_cached', size, queries, elapsed)
+
+
+@scenario('pdf_cache_store')
+def bench_pdf_cache_store(command, sizes):
+    """Store N PDFs into a PDF cache already holding 2000 bills' PDFs
+
+    ``store_scan_each`` scans the cache after every write, as store() used
+    to; ``store`` keeps a running total and scans every SCAN_EVERY writes.
+    """
+    import tempfile
+    from pathlib import Path
+    from billing import pdfs
+
+    pdf = b'%PDF-1.7 ' + b'0' * 20000
+    with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+        for bill_id in range(2000):
+            directory = pdfs.cache_root() / str(bill_id)
+            directory.mkdir(parents=True)
+            (directory / 'old.pdf').write_bytes(pdf)
+
+        def store_all(start, scan_each):
+            for bill_id in range(start, start + size):
+                pdfs.store(pdfs.cache_root() / str(bill_id) / 'new.pdf', pdf)
+                if scan_each:
+                    pdfs.evict()
+
+        start = 10000
+        for size in sizes:
+            for label, scan_each in (('store_scan_each', True), ('store', False)):
+                pdfs.evict()  # both start from a fresh scan
+                _, queries, elapsed = measure(store_all, start, scan_each)
+                command.report(label, size, queries, elapsed)
+                start += size
+            files = sum(1 for _ in Path(media_root).glob('bill_pdfs/*/*.pdf'))
+            command.stdout.write(f'{"":<24} {files} cached files')
+
+
+@scenario('pdf_renderer')
+def bench_pdf_renderer(command, sizes):
+    """Render a bill with N items cold, with a warm local renderer and in the pool"""
+    from billing import pdfs, renderer
+    from billing.jinja2 import render_bill
+
+    if not pdfs.WEASYPRINT_AVAILABLE:
+        command.stdout.write('pdf_renderer: skipped, WeasyPrint is not installed')
+        return
+    customer = sample_customer()
+    pool = renderer.RendererPool(processes=1)
+    try:
+        for size in sizes:
+            bill = sample_bills(customer, 1, items_per_bill=size)[0]
+            html = render_bill(pdfs.PDF_TEMPLATE, {'bill': bill, 'items_by_type': pdfs.items_by_type(bill)})
+
+            def cold():
+                return renderer.Renderer(renderer.stylesheet_source()).write_pdf(html)
+
+            _, queries, elapsed = measure(cold)
+            command.report('pdf_render_cold', size, queries, elapsed)
+            renderer.local_renderer()  # warm up outside the measurement
+            _, queries, elapsed = measure(renderer.local_renderer().write_pdf, html)
+            command.report('pdf_render_warm', size, queries, elapsed)
+            pool.render(html)
+            _, queries, elapsed = measure(pool.render, html)
+            command.report('pdf_render_pool', size, queries, elapsed)
+    finally:
+        pool.close()
+
+
+@scenario('pdf_assets')
+def bench_pdf_assets(command, sizes):
+    """Fetch N static assets over HTTP, as WeasyPrint did, and with LocalFetcher
+
+    The HTTP side is a bare local file server, so it is a lower bound for a
+    self-fetch through gunicorn, Django and WhiteNoise.
+    """
+    import os
+    import threading
+    import urllib.request
+    from functools import partial
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urljoin
+    from billing import renderer
+
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    mounts = renderer.asset_mounts()
+    prefix, directories = mounts[0]
+    directory = next((path for path in reversed(directories) if os.path.isdir(path)), None)
+    if directory is None:
+        command.stdout.write('pdf_assets: skipped, no static files directory')
+        return
+    assets = sorted(
+        os.path.relpath(os.path.join(root, name), directory)
+        for root, _, names in os.walk(directory) for name in names
+    )
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    fetcher = renderer.LocalFetcher([(prefix, [directory])])
+    try:
+        for size in sizes:
+            names = [assets[idx % len(assets)] for idx in range(size)]
+
+            def over_http():
+                for name in names:
+                    with urllib.request.urlopen(f'http://127.0.0.1:{server.server_port}/{name}') as response:
+                        response.read()
+
+            def from_disk():
+                for name in names:
+                    fetcher(urljoin(renderer.BASE_URL, prefix + name))
+
+            _, queries, elapsed = measure(over_http)
+            command.report('assets_http', size, queries, elapsed)
+            _, queries, elapsed = measure(from_disk)
+            command.report('assets_local', size, queries, elapsed)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+
+@scenario('receipt')
+def bench_receipt(command, sizes):
+    """Print a bill with N items as HTML (bill_print) and as an ESC/POS receipt"""
+    from billing import escpos
+    from billing.views import bill_print
+
+    customer = sample_customer()
+    repeats = 100
+    for size in sizes:
+        bill = sample_bills(customer, 1, items_per_bill=size)[0]
+        _, queries, elapsed = measure(render_view, bill_print, pk=bill.pk)
+        command.report('receipt_html', size, queries, elapsed)
+        bill = Bill.objects.select_related('customer').get(pk=bill.pk)
+        receipt, queries, elapsed = measure(escpos.bill_receipt, bill)
+        command.report('receipt_data', size, queries, elapsed)
+
+        def render():
+            for _ in range(repeats):
+                escpos.render_receipt(receipt, 58)
+
+        # Too fast to time one at a time; report the mean of many
+        _, queries, elapsed = measure(render)
+        command.report('receipt_escpos', size, queries, elapsed / repeats)
+
+
+@scenario('bill_snapshot')
+def bench_bill_snapshot(command, sizes):
+    """View the detail and print pages of a paid bill with N items, live and frozen"""
+    from billing import snapshots
+    from billing.views import BillDetailView, bill_print
+
+    customer = sample_customer()
+    detail = BillDetailView.as_view()
+    for size in sizes:
+        bill = sample_bills(customer, 1, items_per_bill=size)[0]
+        bill.counter_cash = bill.cash_received = bill.net_payable
+        bill.calculate_derived()
+        bill.save()
+        # Commits never happen here, so nothing is frozen until asked
+        _, queries, elapsed = measure(render_view, detail, pk=bill.pk)
+        command.report('detail_live', size, queries, elapsed)
+        _, queries, elapsed = measure(render_view, bill_print, pk=bill.pk)
+        command.report('print_live', size, queries, elapsed)
+        snapshots.freeze(bill)
+        _, queries, elapsed = measure(render_view, detail, pk=bill.pk)
+        command.report('detail_frozen', size, queries, elapsed)
+        _, queries, elapsed = measure(render_view, bill_print, pk=bill.pk)
+        command.report('print_frozen', size, queries, elapsed)
+
+
+@scenario('bill_templates')
+def bench_bill_templates(command, sizes):
+    """Render the bill sheet and PDF templates of a bill with N items in each engine"""
+    from billing.grouping import items_by_type
+    from billing.jinja2 import render_bill
+    from billing.snapshots import SHEET_TEMPLATE
+
+    customer = sample_customer()
+    for size in sizes:
+        bill = sample_bills(customer, 1, items_per_bill=size)[0]
+        bill = Bill.objects.select_related('customer').get(pk=bill.pk)
+        context = {'bill': bill, 'items_by_type': items_by_type(bill)}
+        for template_name, label in ((SHEET_TEMPLATE, 'sheet'), ('billing/bill_pdf.html', 'pdf_html')):
+            for engine in ('django', 'jinja2'):
+                render_bill(template_name, context, engine=engine)  # load and compile outside the measurement
+                _, queries, elapsed = measure(render_bill, template_name, context, engine=engine)
+                command.report(f'{label}_{engine}', size, queries, elapsed)
+
+
+@scenario('item_groups')
+def bench_item_groups(command, sizes):
+    """Group the items of a bill with N items by type, as the print views used to and with billing.grouping"""
+    from billing.grouping import items_by_type
+
+    def grouped_in_python(bill):
+        # The copy the print views carried: one pass to check the items, one to group them
+        for item in bill.items.all():
+            item.g_fine
+        groups = {}
+        for item in bill.items.all():
+            if item.item_type not in groups:
+                groups[item.item_type] = {'items': [], 'total_weight': Decimal('0.000'), 'total_gfine': Decimal('0.000')}
+            groups[item.item_type]['items'].append(item)
+            groups[item.item_type]['total_weight'] += item.net_weight
+            groups[item.item_type]['total_gfine'] += item.g_fine
+        return groups
+
+    customer = sample_customer()
+    for size in sizes:
+        bill = sample_bills(customer, 1, items_per_bill=size)[0]
+        bill = Bill.objects.get(pk=bill.pk)
+        before, queries, elapsed = measure(grouped_in_python, bill)
+        command.report('groups_python', size, queries, elapsed)
+        after, queries, elapsed = measure(items_by_type, bill)
+        command.report('groups_window', size, queries, elapsed)
+        subtotals = [(key, group['total_weight'], group['total_gfine']) for key, group in before.items()]
+        if subtotals != [(key, group['total_weight'], group['total_gfine']) for key, group in after.items()]:
+            raise CommandError(f'Item group subtotals differ for a bill with {size} items')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark billing hot paths (query count and latency)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios',
+            nargs='*',
+            help=f'Scenarios to run (default: all). Available: {", ".join(SCENARIOS)}',
+        )
+        parser.add_argument(
+            '--sizes',
+            type=str,
+            default='1,10,40,100',
+            help='Comma separated workload sizes',
+        )
+
+    def report(self, name, size, queries, elapsed):
+        self.stdout.write(f'{name:<24} n={size:<6} queries={queries:<6} {elapsed:10.2f} ms')
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or list(SCENARIOS)
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f'Unknown scenario(s): {", ".join(unknown)}')
+        sizes = [int(size) for size in options['sizes'].split(',') if size]
+
+        for name in names:
+            func = SCENARIOS[name]
+            if not func.atomic:
+                func(self, sizes)
+                continue
+            with transaction.atomic():
+                func(self, sizes)
+                transaction.set_rollback(True)
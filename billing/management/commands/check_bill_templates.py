@@ -0,0 +1,65 @@
+"""
+Django management command to check the Jinja2 bill templates against the Django ones.
+Usage: python manage.py check_bill_templates [--items 0,1,10,100]
+
+Seeds bills inside a transaction (rolled back at the end) with items of
+every type, old gold, half-way roundings and a customer name that needs
+escaping, renders the bill sheet and PDF templates with both engines and
+fails if their output differs by a single byte.
+"""
+import difflib
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from billing.grouping import items_by_type
+from billing.jinja2 import render_bill
+from billing.management.commands.benchmark import sample_bills
+from billing.models import Bill, Customer, OldGold
+from billing.pdfs import PDF_TEMPLATE
+from billing.snapshots import SHEET_TEMPLATE
+
+TEMPLATES = [SHEET_TEMPLATE, PDF_TEMPLATE]
+
+
+class Command(BaseCommand):
+    help = 'Check that the Jinja2 bill templates render exactly like the Django ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=str, default='0,1,10,100', help='Comma separated item counts of the bills checked')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['items'].split(',')]
+        except ValueError:
+            raise CommandError('--items must be a comma separated list of integers')
+
+        failures = []
+        with transaction.atomic():
+            customer = Customer.objects.create(name='O\'Brien & <Sons> "Gold"', phone='9999999999')
+            for size in sizes:
+                bill = sample_bills(customer, 1, items_per_bill=size)[0]
+                OldGold.objects.create(bill=bill, weight=Decimal('2.500'), rate_per_gram=Decimal('6500.00'), value=Decimal('16250.00'))
+                # Half-way roundings and negative balances
+                Bill.objects.filter(pk=bill.pk).update(cash_received=Decimal('1234.50'), ci_balance_gold=Decimal('-1.250'))
+                bill = Bill.objects.select_related('customer').get(pk=bill.pk)
+                context = {'bill': bill, 'items_by_type': items_by_type(bill)}
+                for template_name in TEMPLATES:
+                    expected = render_bill(template_name, context, engine='django')
+                    actual = render_bill(template_name, context, engine='jinja2')
+                    status = self.style.SUCCESS('ok')
+                    if actual != expected:
+                        status = self.style.ERROR('DIFFERS')
+                        failures.append((template_name, size, expected, actual))
+                    self.stdout.write(f'{template_name:<32} {size:>5} items  {status}')
+            transaction.set_rollback(True)
+
+        for template_name, size, expected, actual in failures:
+            diff = difflib.unified_diff(
+                expected.splitlines(keepends=True), actual.splitlines(keepends=True),
+                f'django/{template_name}', f'jinja2/{template_name}',
+            )
+            self.stderr.write(f'\n[{template_name}, {size} items]\n' + ''.join(diff))
+        if failures:
+            raise CommandError(f'{len(failures)} rendering(s) differ between the engines')
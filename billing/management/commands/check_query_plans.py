@@ -0,0 +1,257 @@
+"""
+Django management command to check that hot queries are served by indexes.
+Usage: python manage.py check_query_plans [--bills 500] [--verbose]
+
+Seeds a database inside a transaction (rolled back at the end), runs the
+hot code paths (dashboard, bill lists and pages, customer lists, reports,
+rate lookups, customer phone check, search, bill numbers), captures every
+query they issue and runs EXPLAIN on it. Fails if any query reads a
+billing table with a sequential scan.
+
+On PostgreSQL sequential scans are disabled for the check
+(``SET LOCAL enable_seqscan = off``): on a small seeded table the planner
+may rightly prefer a scan, so the check asks whether an index *can* serve
+each query rather than whether it wins at this size.
+"""
+import json
+import re
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from billing.management.commands.benchmark import render_view, sample_bills, sample_customer
+from billing.models import BarRate, Bill, Customer, GoldRate, Job, Payment, SilverRate
+from billing.rollups import rebuild_day
+from billing.snapshots import freeze_bills
+
+HOT_PATHS = {}
+
+EXPLAINED = re.compile(r'^\s*(SELECT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+SQLITE_SCAN = re.compile(r'\bSCAN (billing_\w+)(?!.*\b(USING|VIRTUAL TABLE INDEX)\b)')
+POSTGRES_SCAN = re.compile(r'\bSeq Scan on (billing_\w+)')
+
+
+def hot_path(name):
+    """Register a code path whose queries must all use indexes"""
+    def decorator(func):
+        HOT_PATHS[name] = func
+        return func
+    return decorator
+
+
+@hot_path('dashboard')
+def dashboard(context):
+    from billing.rates import invalidate_rate_board
+    from billing.views import DashboardView
+
+    invalidate_rate_board()
+    render_view(DashboardView.as_view())
+
+
+@hot_path('bill_list')
+def bill_list(context):
+    from billing.views import BillListView
+
+    view = BillListView.as_view()
+    response = render_view(view, '/bills/')
+    render_view(view, '/bills/' + response.context_data['page_obj'].next_url)
+    today = timezone.localdate()
+    render_view(view, f'/bills/?status=unpaid&date_from={today - timedelta(days=7)}&date_to={today}')
+
+
+@hot_path('bill_search')
+def bill_search(context):
+    from billing.views import BillListView
+
+    render_view(BillListView.as_view(), '/bills/?search=5570+Customer')
+
+
+@hot_path('bill_detail')
+def bill_detail(context):
+    from billing.views import BillDetailView
+
+    render_view(BillDetailView.as_view(), pk=context['bill'].pk)
+
+
+@hot_path('bill_print')
+def bill_print(context):
+    from billing.views import bill_print
+
+    render_view(bill_print, pk=context['bill'].pk)
+
+
+@hot_path('customer_list')
+def customer_list(context):
+    from billing.views import CustomerListView
+
+    view = CustomerListView.as_view()
+    response = render_view(view, '/customers/')
+    render_view(view, '/customers/' + response.context_data['page_obj'].next_url)
+
+
+@hot_path('customer_phone_check')
+def customer_phone_check(context):
+    from django.test import RequestFactory
+    from billing.views import create_customer_ajax
+
+    customer = context['customer']
+    request = RequestFactory().post(
+        '/api/create-customer/',
+        data=json.dumps({'name': customer.name, 'phone': customer.phone}),
+        content_type='application/json',
+    )
+    request.user = context['user']
+    create_customer_ajax(request)
+
+
+@hot_path('customer_typeahead')
+def customer_typeahead(context):
+    from billing.views import customer_search
+
+    render_view(customer_search, '/api/customers/?q=cust')
+    render_view(customer_search, f'/api/customers/?q={context["customer"].phone[:6]}')
+
+
+@hot_path('reports')
+def reports(context):
+    from billing.views import ReportsView
+
+    render_view(ReportsView.as_view(), '/reports/')
+
+
+@hot_path('rates')
+def rates(context):
+    from billing.rates import RateBoard, invalidate_rate_board, rate_at
+
+    RateBoard.load()
+    invalidate_rate_board()
+    rate_at('gold', timezone.now())
+    rate_at('gold', timezone.now() - timedelta(days=5000))
+
+
+@hot_path('bill_numbers')
+def bill_numbers(context):
+    from billing.sequences import next_bill_number
+
+    next_bill_number()
+
+
+@hot_path('job_queue')
+def job_queue(context):
+    from billing.jobs import claim, release_stale
+    from billing.views import FailedJobListView
+
+    release_stale()
+    claim('check_query_plans')
+    render_view(FailedJobListView.as_view(), '/jobs/failed/')
+
+
+def seed(bills):
+    """Customers, bills with items and a rate history"""
+    customers = [
+        Customer.objects.create(name=f'Customer {idx:04d}', phone=f'98{idx:08d}')
+        for idx in range(max(bills // 5, 25))
+    ]
+    for idx in range(bills):
+        sample_bills(customers[idx % len(customers)], 1)
+
+    # Spread the bills over a year with one in ten outstanding, so that the
+    # planner's statistics look like a real shop's
+    today = timezone.localdate()
+    seeded = list(Bill.objects.order_by('pk').only('pk'))
+    for idx, bill in enumerate(seeded):
+        bill.business_date = today - timedelta(days=idx % 365)
+        bill.status = 'unpaid' if idx % 10 == 0 else 'paid'
+    Bill.objects.bulk_update(seeded, ['business_date', 'status'], batch_size=500)
+    Payment.objects.bulk_create([Payment(bill=bill, amount=Decimal('100.00')) for bill in seeded[::2]])
+    for day in {bill.business_date for bill in seeded}:
+        rebuild_day(day)
+    # Paid bills are frozen
+    freeze_bills(bill.pk for bill in seeded if bill.status == 'paid')
+    # Mostly finished jobs, a few waiting and a few failed
+    statuses = [Job.SUCCEEDED] * 18 + [Job.QUEUED, Job.DEAD]
+    Job.objects.bulk_create([
+        Job(kind='bill_pdf', bill=bill, status=statuses[idx % len(statuses)])
+        for idx, bill in enumerate(seeded)
+    ], batch_size=500)
+
+    for model, field in ((GoldRate, 'rate_24k'), (SilverRate, 'rate_per_gram'), (BarRate, 'rate_per_gram')):
+        model.objects.bulk_create([model(**{field: Decimal(1000 + idx)}, is_active=False) for idx in range(200)])
+        model.objects.create(**{field: Decimal('7000.00')}, is_active=True)
+    return customers
+
+
+def explain(sql):
+    """Query plan lines of a captured statement"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+        cursor.execute(f'EXPLAIN {sql}')
+        return [row[0] for row in cursor.fetchall()]
+
+
+def sequential_scans(plan):
+    pattern = SQLITE_SCAN if connection.vendor == 'sqlite' else POSTGRES_SCAN
+    return [match.group(1) for line in plan for match in [pattern.search(line)] if match]
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the queries of hot code paths and fail on sequential scans of billing tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help=f'Hot paths to check (default: all). Available: {", ".join(HOT_PATHS)}')
+        parser.add_argument('--bills', type=int, default=500, help='Bills to seed (default: 500)')
+        parser.add_argument('--verbose', action='store_true', help='Print the plan of every query')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f'Query plans cannot be checked on {connection.vendor}')
+        names = options['paths'] or list(HOT_PATHS)
+        unknown = [name for name in names if name not in HOT_PATHS]
+        if unknown:
+            raise CommandError(f'Unknown hot path(s): {", ".join(unknown)}')
+
+        from django.contrib.auth import get_user_model
+
+        failures = []
+        with transaction.atomic():
+            customers = seed(options['bills'])
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+                if connection.vendor == 'postgresql':
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            context = {
+                'bill': Bill.objects.order_by('-pk').first(),
+                'customer': customers[len(customers) // 2],
+                'user': get_user_model()(username='plans', is_staff=True, is_superuser=True),
+            }
+
+            for name in names:
+                # The query log keeps only the last 9000 queries (seeding fills it)
+                connection.queries_log.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    HOT_PATHS[name](context)
+                statements = [query['sql'] for query in queries if EXPLAINED.match(query['sql'])]
+                path_failures = []
+                for sql in statements:
+                    plan = explain(sql)
+                    scans = sequential_scans(plan)
+                    if scans:
+                        path_failures.append((sql, plan, scans))
+                    if options['verbose']:
+                        self.stdout.write(f'{sql}\n    ' + '\n    '.join(plan))
+                status = self.style.ERROR('SEQ SCAN') if path_failures else self.style.SUCCESS('ok')
+                self.stdout.write(f'{name:<24} {len(statements):>3} queries  {status}')
+                failures += [(name, *failure) for failure in path_failures]
+
+            transaction.set_rollback(True)
+
+        for name, sql, plan, scans in failures:
+            self.stderr.write(f'\n[{name}] sequential scan of {", ".join(sorted(set(scans)))}:\n{sql}\n    ' + '\n    '.join(plan))
+        if failures:
+            raise CommandError(f'{len(failures)} hot query(s) fall back to a sequential scan')
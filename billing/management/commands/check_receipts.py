@@ -0,0 +1,121 @@
+"""
+Django management command to check the ESC/POS receipts against golden files.
+Usage: python manage.py check_receipts [--update]
+
+Renders a fixed sample receipt (the plain data bill_receipt() returns) for
+every paper width and fails if the bytes differ from
+billing/golden/receipt_<width>mm.bin. The sample has long and non-ASCII
+text, two item groups, old gold, GST, negative balances and amounts ending
+in .50, which round up to the next rupee as on the bill sheet. After an
+intended change to the layout, check the printed receipts and run it with
+--update to write the new golden files.
+"""
+import difflib
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.escpos import PAPER_COLUMNS, render_receipt
+
+GOLDEN_DIR = Path(__file__).resolve().parents[2] / 'golden'
+
+SAMPLE_RECEIPT = {
+    'shop_name': 'Shree Ganesh Jewellers & Sons',
+    'shop_address': 'Shop 12, Zaveri Bazaar\n\nMumbai 400002, Maharashtra, India',
+    'shop_gstin': '27AAAPL1234C1ZV',
+    'bill_number': 'JB20240131-007',
+    'bill_date': datetime(2024, 1, 31, 18, 5),
+    'customer': 'Rāmesh "Gold" O\'Brien & <Sons>',
+    'groups': [
+        {
+            'items': [
+                {
+                    'type': 'G', 'description': 'Necklace with a very long description that never fits 7',
+                    'net_weight': Decimal('25.125'), 'tunch_wstg': Decimal('92.50'),
+                    'g_fine': Decimal('23.241'), 'amount': Decimal('145256.25'),
+                },
+                {
+                    'type': 'G', 'description': 'Ring ₹ 22K',
+                    'net_weight': Decimal('3.005'), 'tunch_wstg': Decimal('91.60'),
+                    'g_fine': Decimal('2.753'), 'amount': Decimal('17206.25'),
+                },
+            ],
+            'total_weight': Decimal('28.130'),
+            'total_gfine': Decimal('25.994'),
+        },
+        {
+            'items': [
+                {
+                    'type': 'S', 'description': 'Anklet pair',
+                    'net_weight': Decimal('120.000'), 'tunch_wstg': Decimal('70.00'),
+                    'g_fine': Decimal('0.000'), 'amount': Decimal('8400.00'),
+                },
+            ],
+            'total_weight': Decimal('120.000'),
+            'total_gfine': Decimal('0.000'),
+        },
+    ],
+    'old_gold': [
+        {'weight': Decimal('2.500'), 'rate': Decimal('6500.00'), 'value': Decimal('16250.00')},
+    ],
+    'total_fine_gold': Decimal('25.994'),
+    'total_amount': Decimal('170862.50'),
+    'cgst_percent': Decimal('1.50'),
+    'cgst_amount': Decimal('2319.00'),
+    'sgst_percent': Decimal('1.50'),
+    'sgst_amount': Decimal('2319.00'),
+    'net_payable': Decimal('159250.50'),
+    'cash_received': Decimal('1234.50'),
+    'balance': Decimal('158016.00'),
+    'ci_balance_gold': Decimal('-1.250'),
+    'ci_balance_dr': Decimal('0.00'),
+    'ci_balance_cr': Decimal('2500.00'),
+}
+
+
+def golden_path(paper_width):
+    return GOLDEN_DIR / f'receipt_{paper_width}mm.bin'
+
+
+class Command(BaseCommand):
+    help = 'Check that the ESC/POS receipts render byte for byte like the golden files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--update',
+            action='store_true',
+            help='Write the current renderings as the new golden files',
+        )
+
+    def handle(self, *args, **options):
+        failures = []
+        for paper_width in PAPER_COLUMNS:
+            path = golden_path(paper_width)
+            actual = render_receipt(SAMPLE_RECEIPT, paper_width)
+            if options['update']:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(actual)
+                self.stdout.write(f'{path.name:<20} {len(actual):>6} bytes  written')
+                continue
+            try:
+                expected = path.read_bytes()
+            except FileNotFoundError:
+                raise CommandError(f'{path} is missing; create it with --update')
+            status = self.style.SUCCESS('ok')
+            if actual != expected:
+                status = self.style.ERROR('DIFFERS')
+                failures.append((path.name, expected, actual))
+            self.stdout.write(f'{path.name:<20} {len(actual):>6} bytes  {status}')
+
+        for name, expected, actual in failures:
+            # Control bytes stay visible as escapes in the diff
+            diff = difflib.unified_diff(
+                expected.decode('latin-1').encode('unicode_escape').decode().split('\\n'),
+                actual.decode('latin-1').encode('unicode_escape').decode().split('\\n'),
+                f'golden/{name}', 'rendered', lineterm='',
+            )
+            self.stderr.write(f'\n[{name}]\n' + '\n'.join(diff))
+        if failures:
+            raise CommandError(f'{len(failures)} receipt(s) differ from their golden files')
@@ -0,0 +1,64 @@
+"""
+Django management command to export the PDFs of a date range's bills as a ZIP.
+Usage: python manage.py export_bill_pdfs --from YYYY-MM-DD --to YYYY-MM-DD [--output FILE] [--workers N]
+"""
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.models import Bill
+from billing.pdf_archive import archive_bills, worker_count, write_archive
+from billing.pdfs import WEASYPRINT_AVAILABLE
+
+
+class Command(BaseCommand):
+    help = 'Render the PDFs of all bills in a date range in parallel into one ZIP'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from',
+            dest='date_from',
+            type=date.fromisoformat,
+            required=True,
+            help='First business day to export',
+        )
+        parser.add_argument(
+            '--to',
+            dest='date_to',
+            type=date.fromisoformat,
+            required=True,
+            help='Last business day to export',
+        )
+        parser.add_argument(
+            '--output',
+            help='ZIP file to write (default: bills_<from>_<to>.zip)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='Rendering processes (default: PDF_ARCHIVE_WORKERS, or one per CPU)',
+        )
+
+    def handle(self, *args, **options):
+        if not WEASYPRINT_AVAILABLE:
+            raise CommandError('PDF generation requires WeasyPrint')
+        date_from = options['date_from']
+        date_to = options['date_to']
+        if date_from > date_to:
+            raise CommandError('--from must not be after --to')
+
+        bills = Bill.objects.filter(business_date__gte=date_from, business_date__lte=date_to)
+        bill_ids = archive_bills(bills)
+        output = options['output'] or f'bills_{date_from}_{date_to}.zip'
+        workers = options['workers'] or worker_count()
+        self.stdout.write(f'Rendering {len(bill_ids)} bill(s) with {workers} process(es)')
+
+        def progress(done, total):
+            self.stdout.write(f'\r{done}/{total}', ending='')
+            self.stdout.flush()
+
+        write_archive(output, bill_ids, workers=workers, progress=progress)
+        if bill_ids:
+            self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f'Wrote {len(bill_ids)} PDF(s) to {output}'))
@@ -0,0 +1,30 @@
+"""
+Django management command to take the snapshots of paid bills.
+Usage: python manage.py freeze_bills [--rebuild]
+"""
+from django.core.management.base import BaseCommand
+
+from billing.models import Bill
+from billing.snapshots import current_snapshot, freeze_bills
+
+
+class Command(BaseCommand):
+    help = 'Take the frozen snapshots of paid bills that have none, or an outdated one'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Retake the snapshots of all paid bills',
+        )
+
+    def handle(self, *args, **options):
+        bills = Bill.objects.filter(status='paid').select_related('snapshot').only(
+            'pk', 'status', 'updated_at', 'snapshot__bill_updated_at', 'snapshot__version',
+        )
+        bill_ids = [
+            bill.pk for bill in bills.iterator(chunk_size=2000)
+            if options['rebuild'] or current_snapshot(bill) is None
+        ]
+        count = freeze_bills(bill_ids)
+        self.stdout.write(self.style.SUCCESS(f'Froze {count} bill(s)'))
@@ -0,0 +1,64 @@
+"""
+Django management command to backfill or rebuild the daily sales rollup.
+Usage: python manage.py rebuild_sales_summary [--from YYYY-MM-DD] [--to YYYY-MM-DD] [--missing]
+"""
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.models import Bill, DailySalesSummary
+from billing.rollups import rebuild_day
+
+
+class Command(BaseCommand):
+    help = 'Backfill or rebuild the daily sales rollup (DailySalesSummary)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from',
+            dest='date_from',
+            type=date.fromisoformat,
+            help='First day to rebuild (default: first day with bills)',
+        )
+        parser.add_argument(
+            '--to',
+            dest='date_to',
+            type=date.fromisoformat,
+            help='Last day to rebuild (default: last day with bills)',
+        )
+        parser.add_argument(
+            '--missing',
+            action='store_true',
+            help='Only build days that have bills but no rollup rows yet',
+        )
+
+    def handle(self, *args, **options):
+        date_from = options['date_from']
+        date_to = options['date_to']
+        if date_from and date_to and date_from > date_to:
+            raise CommandError('--from must not be after --to')
+
+        bill_days = Bill.objects.order_by()
+        if date_from:
+            bill_days = bill_days.filter(business_date__gte=date_from)
+        if date_to:
+            bill_days = bill_days.filter(business_date__lte=date_to)
+        days = set(bill_days.values_list('business_date', flat=True).distinct())
+
+        if options['missing']:
+            days -= set(DailySalesSummary.objects.values_list('day', flat=True).distinct())
+        else:
+            # Days whose bills were all deleted still need their rows cleared
+            existing = DailySalesSummary.objects.all()
+            if date_from:
+                existing = existing.filter(day__gte=date_from)
+            if date_to:
+                existing = existing.filter(day__lte=date_to)
+            days |= set(existing.values_list('day', flat=True).distinct())
+
+        rows = 0
+        for day in sorted(days):
+            rows += rebuild_day(day)
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt {len(days)} day(s) of sales summary ({rows} rows)')
+        )
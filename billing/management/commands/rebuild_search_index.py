@@ -0,0 +1,34 @@
+"""
+Django management command to build the bill search index.
+Usage: python manage.py rebuild_search_index [--missing]
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.models import Bill
+from billing.search import get_backend, index_bills, indexed_bill_ids
+
+
+class Command(BaseCommand):
+    help = 'Build (or rebuild) the search documents of bills (billing_bill_search)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing',
+            action='store_true',
+            help='Only index bills that are not in the index yet',
+        )
+
+    def handle(self, *args, **options):
+        if get_backend() is None:
+            raise CommandError('The default database has no search backend')
+
+        bill_ids = set(Bill.objects.values_list('pk', flat=True))
+        indexed = indexed_bill_ids()
+        if options['missing']:
+            bill_ids -= indexed
+        else:
+            # Drop documents of bills that no longer exist too
+            bill_ids |= indexed
+
+        count = index_bills(bill_ids)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} bill(s)'))
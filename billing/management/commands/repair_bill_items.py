@@ -0,0 +1,89 @@
+"""
+Django management command to repair bill items with missing calculations.
+Usage: python manage.py repair_bill_items [--dry-run] [--batch-size N]
+
+Finds items whose fines were never calculated (zero GFine or SFine with a
+weight and tunch) or whose rate is zero on a bill with a gold rate, fixes
+them with one bulk UPDATE per batch, moves their figures in the sales
+rollup and recalculates the batch's bills once when it commits. The bill pages used to make these repairs on every view;
+they are read-only now (billing/readonly.py).
+"""
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+
+from billing.models import BillItem
+from billing.recalc import deferred_recalc, mark_dirty
+from billing.rollups import add_items
+
+FIELDS = ['rate', 'g_fine', 's_fine', 'amount']
+
+
+def broken_items():
+    missing_fines = (Q(g_fine=0) | Q(s_fine=0)) & Q(net_weight__gt=0, tunch_wstg__gt=0)
+    missing_rate = Q(rate=0, bill__gold_rate__gt=0)
+    return BillItem.objects.filter(missing_fines | missing_rate)
+
+
+def repair(item, places):
+    """Recalculate an item in memory; return True if its stored values change"""
+    stored = [getattr(item, field) for field in FIELDS]
+    if item.rate == 0 and item.bill_gold_rate > 0:
+        item.rate = item.bill_gold_rate
+    item.calculate_fines()
+    item.calculate_amount()
+    for field in FIELDS:
+        setattr(item, field, getattr(item, field).quantize(places[field]))
+    return [getattr(item, field) for field in FIELDS] != stored
+
+
+class Command(BaseCommand):
+    help = 'Recalculate bill items with missing fines, rate or amount, and their bills'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would be repaired without writing',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Items repaired per transaction (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        places = {
+            field: Decimal(1).scaleb(-BillItem._meta.get_field(field).decimal_places)
+            for field in FIELDS
+        }
+
+        item_ids = list(broken_items().order_by('pk').values_list('pk', flat=True))
+        repaired = 0
+        bill_ids = set()
+        for start in range(0, len(item_ids), batch_size):
+            items = [
+                item for item in BillItem.objects.filter(pk__in=item_ids[start:start + batch_size])
+                .annotate(bill_gold_rate=F('bill__gold_rate'))
+                if repair(item, places)
+            ]
+            repaired += len(items)
+            bill_ids.update(item.bill_id for item in items)
+            if options['dry_run'] or not items:
+                continue
+            # One bulk UPDATE, then one recalculation per bill on commit
+            with deferred_recalc(suppress_signals=True):
+                item_pks = [item.pk for item in items]
+                add_items(item_pks, sign=-1)
+                BillItem.objects.bulk_update(items, FIELDS)
+                add_items(item_pks)
+                for bill_id in {item.bill_id for item in items}:
+                    mark_dirty(bill_id)
+
+        verb = 'Would repair' if options['dry_run'] else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {repaired} item(s) on {len(bill_ids)} bill(s)'))
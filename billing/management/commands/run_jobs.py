@@ -0,0 +1,77 @@
+"""
+Django management command to run background jobs (see billing/jobs.py).
+Usage: python manage.py run_jobs [--once] [--sleep SECONDS] [--max-jobs N]
+"""
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from billing.jobs import claim, release_stale, run_job, worker_name
+from billing.models import Job
+from billing.pdfs import WEASYPRINT_AVAILABLE
+from billing.renderer import start_pool, stop_pool
+
+
+class Command(BaseCommand):
+    help = 'Run queued PDF and email jobs until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run the jobs that are due now, then exit',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=getattr(settings, 'JOB_POLL_INTERVAL', 2),
+            help='Seconds to wait before looking again when no job is due',
+        )
+        parser.add_argument(
+            '--max-jobs',
+            type=int,
+            default=0,
+            help='Exit after running this many jobs (0: no limit), e.g. to recycle the process',
+        )
+
+    def handle(self, *args, **options):
+        worker = worker_name()
+        self.stopping = False
+        # Finish the current job on SIGTERM/SIGINT, then exit
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        # Warm PDF renderers start now, not on the first PDF job
+        if WEASYPRINT_AVAILABLE:
+            start_pool()
+        try:
+            done = self.work(worker, options)
+        finally:
+            stop_pool()
+        self.stdout.write(self.style.SUCCESS(f'Ran {done} job(s)'))
+
+    def work(self, worker, options):
+        done = 0
+        while not self.stopping:
+            close_old_connections()
+            release_stale()
+            job = claim(worker)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            run_job(job)
+            done += 1
+            style = self.style.SUCCESS if job.status == Job.SUCCEEDED else self.style.WARNING
+            self.stdout.write(style(f'{job} attempt {job.attempts}/{job.max_attempts}'))
+            if options['max_jobs'] and done >= options['max_jobs']:
+                break
+        return done
+
+    def stop(self, signum, frame):
+        self.stopping = True
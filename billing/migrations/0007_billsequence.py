@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:41
+
+from datetime import datetime
+import re
+
+from django.db import migrations, models
+
+
+def seed_sequences(apps, schema_editor):
+    """Start each day's counter after the highest bill number already used"""
+    Bill = apps.get_model('billing', 'Bill')
+    BillSequence = apps.get_model('billing', 'BillSequence')
+    pattern = re.compile(r'^JB(\d{8})-(\d+)$')
+
+    highest = {}
+    for bill_number in Bill.objects.values_list('bill_number', flat=True).iterator():
+        match = pattern.match(bill_number)
+        if match:
+            day = datetime.strptime(match.group(1), '%Y%m%d').date()
+            highest[day] = max(highest.get(day, 0), int(match.group(2)))
+
+    BillSequence.objects.bulk_create(
+        [BillSequence(day=day, last_number=number) for day, number in highest.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0006_billitem_material_type_barrate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('last_number', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
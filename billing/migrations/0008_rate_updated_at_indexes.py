@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0007_billsequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='barrate',
+            index=models.Index(fields=['updated_at'], name='billing_barrate_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='goldrate',
+            index=models.Index(fields=['updated_at'], name='billing_goldrate_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='silverrate',
+            index=models.Index(fields=['updated_at'], name='billing_silverrate_updated_idx'),
+        ),
+    ]
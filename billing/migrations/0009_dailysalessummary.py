@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:44
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0008_rate_updated_at_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('material_type', models.CharField(max_length=10)),
+                ('status', models.CharField(choices=[('draft', 'Draft'), ('paid', 'Paid'), ('partial', 'Partial'), ('unpaid', 'Unpaid')], max_length=20)),
+                ('bill_count', models.PositiveIntegerField(default=0)),
+                ('net_payable', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('tax', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('cash_received', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('outstanding', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('old_gold_weight', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=12)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('net_weight', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=12)),
+                ('fine_gold', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=12)),
+                ('sales', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+            ],
+            options={
+                'verbose_name_plural': 'daily sales summaries',
+                'ordering': ['day', 'material_type', 'status'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailysalessummary',
+            constraint=models.UniqueConstraint(fields=('day', 'material_type', 'status'), name='billing_dailysales_day_material_status'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+from django.db import migrations
+
+# Search documents of bills, see billing/search.py. The table is created
+# here with raw SQL because its shape depends on the database: an FTS5
+# virtual table on SQLite, a table with a weighted tsvector and a trigram
+# index on PostgreSQL. Fill it with ``manage.py rebuild_search_index``.
+
+SQLITE_CREATE = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS billing_bill_search USING fts5(
+        bill_number, customer, items,
+        tokenize = 'unicode61', prefix = '2 3'
+    )
+    """,
+]
+
+POSTGRES_CREATE = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    """
+    CREATE TABLE IF NOT EXISTS billing_bill_search (
+        bill_id bigint PRIMARY KEY REFERENCES billing_bill (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        bill_number text NOT NULL,
+        customer text NOT NULL,
+        items text NOT NULL,
+        document text GENERATED ALWAYS AS (bill_number || ' ' || customer || ' ' || items) STORED,
+        vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple'::regconfig, bill_number), 'A') ||
+            setweight(to_tsvector('simple'::regconfig, customer), 'B') ||
+            setweight(to_tsvector('simple'::regconfig, items), 'C')
+        ) STORED
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS billing_bill_search_vector_idx ON billing_bill_search USING gin (vector)',
+    'CREATE INDEX IF NOT EXISTS billing_bill_search_trgm_idx ON billing_bill_search USING gin (document gin_trgm_ops)',
+]
+
+CREATE = {
+    'sqlite': SQLITE_CREATE,
+    'postgresql': POSTGRES_CREATE,
+}
+
+
+def create_search_table(apps, schema_editor):
+    for sql in CREATE.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE:
+        schema_editor.execute('DROP TABLE IF EXISTS billing_bill_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0010_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
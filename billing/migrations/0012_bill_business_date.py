@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:58
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_business_date(apps, schema_editor):
+    """Store each bill's date in the shop's timezone (TIME_ZONE)"""
+    Bill = apps.get_model('billing', 'Bill')
+    batch = []
+    for bill in Bill.objects.filter(business_date__isnull=True).only('pk', 'bill_date').iterator(chunk_size=2000):
+        bill.business_date = timezone.localdate(bill.bill_date)
+        batch.append(bill)
+        if len(batch) >= 2000:
+            Bill.objects.bulk_update(batch, ['business_date'])
+            batch = []
+    if batch:
+        Bill.objects.bulk_update(batch, ['business_date'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0011_bill_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='business_date',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_business_date, migrations.RunPython.noop),
+    ]
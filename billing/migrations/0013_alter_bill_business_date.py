@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0012_bill_business_date'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bill',
+            name='business_date',
+            field=models.DateField(db_index=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0013_alter_bill_business_date'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='barrate',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-updated_at'], name='billing_barrate_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(condition=models.Q(('status__in', ['unpaid', 'partial'])), fields=['status'], name='billing_bill_outstanding_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['phone'], name='billing_customer_phone_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='goldrate',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-updated_at'], name='billing_goldrate_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='silverrate',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-updated_at'], name='billing_silverrate_active_idx'),
+        ),
+    ]
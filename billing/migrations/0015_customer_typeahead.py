@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:05
+
+import re
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+def backfill_phone_digits(apps, schema_editor):
+    Customer = apps.get_model('billing', 'Customer')
+    batch = []
+    for customer in Customer.objects.only('pk', 'phone').iterator(chunk_size=2000):
+        customer.phone_digits = re.sub(r'\D', '', customer.phone or '')
+        batch.append(customer)
+        if len(batch) >= 2000:
+            Customer.objects.bulk_update(batch, ['phone_digits'])
+            batch = []
+    if batch:
+        Customer.objects.bulk_update(batch, ['phone_digits'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0014_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='phone_digits',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=20),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_phone_digits, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='billing_customer_name_idx'),
+        ),
+    ]
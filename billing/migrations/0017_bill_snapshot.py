@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0016_job_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillSnapshot',
+            fields=[
+                ('bill', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='billing.bill')),
+                ('bill_updated_at', models.DateTimeField()),
+                ('version', models.CharField(max_length=16)),
+                ('print_html', models.BinaryField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
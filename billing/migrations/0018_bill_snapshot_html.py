@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:12
+
+from django.db import migrations, models
+
+
+def drop_snapshots(apps, schema_editor):
+    # Snapshots of the old layout are never served again; freeze_bills retakes them
+    apps.get_model('billing', 'BillSnapshot').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0017_bill_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_snapshots, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='billsnapshot',
+            name='data',
+        ),
+        migrations.AddField(
+            model_name='billsnapshot',
+            name='detail_html',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='billsnapshot',
+            name='payments_html',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='billsnapshot',
+            name='pdf_html',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+    ]
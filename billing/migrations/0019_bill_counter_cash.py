@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:03
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counter_cash(apps, schema_editor):
+    """Counter cash is what cash received holds beyond the recorded payments"""
+    Bill = apps.get_model('billing', 'Bill')
+    Payment = apps.get_model('billing', 'Payment')
+    paid = (
+        Payment.objects.filter(bill=OuterRef('pk'))
+        .order_by()
+        .values('bill')
+        .annotate(total=Sum('amount'))
+        .values('total')
+    )
+    Bill.objects.update(
+        counter_cash=models.F('cash_received') - Coalesce(
+            Subquery(paid), Value(Decimal('0.00')), output_field=DecimalField(max_digits=12, decimal_places=2)
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0018_bill_snapshot_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='counter_cash',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.RunPython(backfill_counter_cash, migrations.RunPython.noop),
+    ]
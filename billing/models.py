@@ -1,13 +1,25 @@
-from django.db import models
+import re
+
+from django.db import models, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Lower
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 from decimal import Decimal
 
 
+def phone_digits(phone):
+    """A phone number with everything but its digits removed"""
+    return re.sub(r'\D', '', phone or '')
+
+
 class Customer(models.Model):
     """Customer model for storing customer information"""
     name = models.CharField(max_length=200)
     phone = models.CharField(max_length=20, blank=True)
+    # Digits of phone, for prefix lookups however the number was typed
+    phone_digits = models.CharField(max_length=20, blank=True, editable=False, db_index=True)
     email = models.EmailField(blank=True)
     address = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -15,10 +27,25 @@ class Customer(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of the customer list (billing.pagination)
+            models.Index(fields=['-created_at', '-id'], name='billing_customer_created_idx'),
+            # Duplicate phone check when creating customers
+            models.Index(fields=['phone'], name='billing_customer_phone_idx'),
+            # Name prefix lookups of the customer typeahead
+            models.Index(Lower('name'), name='billing_customer_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.phone_digits = phone_digits(self.phone)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'phone_digits'}
+        super().save(*args, **kwargs)
+
 
 class GoldRate(models.Model):
     """Gold rate management - stores current gold rate"""
@@ -35,6 +62,14 @@ class GoldRate(models.Model):
     class Meta:
         ordering = ['-updated_at']
         get_latest_by = 'updated_at'
+        indexes = [
+            # As-of lookups over the rate history (billing.rates.rate_at)
+            models.Index(fields=['updated_at'], name='billing_goldrate_updated_idx'),
+            # The current rate: the latest active row
+            models.Index(
+                fields=['-updated_at'], condition=models.Q(is_active=True), name='billing_goldrate_active_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"24K Gold: ₹{self.rate_24k}/gm"
@@ -60,6 +95,14 @@ class SilverRate(models.Model):
     class Meta:
         ordering = ['-updated_at']
         get_latest_by = 'updated_at'
+        indexes = [
+            # As-of lookups over the rate history (billing.rates.rate_at)
+            models.Index(fields=['updated_at'], name='billing_silverrate_updated_idx'),
+            # The current rate: the latest active row
+            models.Index(
+                fields=['-updated_at'], condition=models.Q(is_active=True), name='billing_silverrate_active_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"Silver: ₹{self.rate_per_gram}/gm"
@@ -85,6 +128,14 @@ class BarRate(models.Model):
     class Meta:
         ordering = ['-updated_at']
         get_latest_by = 'updated_at'
+        indexes = [
+            # As-of lookups over the rate history (billing.rates.rate_at)
+            models.Index(fields=['updated_at'], name='billing_barrate_updated_idx'),
+            # The current rate: the latest active row
+            models.Index(
+                fields=['-updated_at'], condition=models.Q(is_active=True), name='billing_barrate_active_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"Bar: ₹{self.rate_per_gram}/gm"
@@ -107,6 +158,9 @@ class Bill(models.Model):
     bill_number = models.CharField(max_length=50, unique=True)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='bills')
     bill_date = models.DateTimeField(auto_now_add=True)
+    # Day of bill_date in the shop's timezone, stored so that date filters
+    # are plain index range scans instead of per-row timezone conversions
+    business_date = models.DateField(db_index=True, editable=False)
     gold_rate = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
     
     # Shop details (can be configured in settings)
@@ -136,6 +190,9 @@ class Bill(models.Model):
     
     # Final amounts
     net_payable = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    # Cash taken at the counter when the bill was made or edited
+    counter_cash = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    # Counter cash plus every payment recorded against the bill
     cash_received = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     balance = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     
@@ -147,17 +204,26 @@ class Bill(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of the bill list (billing.pagination)
+            models.Index(fields=['-created_at', '-id'], name='billing_bill_created_idx'),
+            # Outstanding bills (dashboard, reports): a small slice of the table
+            models.Index(
+                fields=['status'], condition=models.Q(status__in=['unpaid', 'partial']),
+                name='billing_bill_outstanding_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.bill_number} - {self.customer.name}"
 
-    def calculate_totals(self):
-        """Calculate all totals for the bill"""
-        # Calculate total fine gold and amount from items
-        items = self.items.all()
-        self.total_fine_gold = sum(item.g_fine for item in items)
-        self.total_amount = sum(item.amount for item in items)
-        
+    # Stored totals that rows on other tables add to
+    DELTA_FIELDS = ['total_fine_gold', 'total_amount', 'old_gold_weight', 'old_gold_value', 'cash_received']
+    # Fields derived from the stored totals
+    DERIVED_FIELDS = ['cgst_amount', 'sgst_amount', 'net_payable', 'balance', 'status']
+
+    def calculate_derived(self):
+        """Calculate tax, net payable, balance and status from the stored totals"""
         # Calculate tax
         taxable_amount = self.total_amount - self.old_gold_value
         self.cgst_amount = (taxable_amount * self.cgst_percent) / 100
@@ -176,27 +242,142 @@ class Bill(models.Model):
             self.status = 'partial'
         else:
             self.status = 'unpaid'
+
+    def calculate_totals(self, items=None):
+        """Calculate all totals for the bill
+
+        ``items`` may be passed when the caller already holds the bill's
+        items in memory, which avoids re-reading them from the database.
+        """
+        # Calculate total fine gold and amount from items
+        if items is None:
+            items = self.items.all()
+        self.total_fine_gold = sum(item.g_fine for item in items)
+        self.total_amount = sum(item.amount for item in items)
         
+        self.calculate_derived()
+        self.save()
+
+    def compute_totals_from_rows(self):
+        """Re-aggregate every stored total from the bill's rows, without saving
+
+        Cash received is the counter cash plus the bill's payments.
+        """
+        items = self.items.aggregate(fine=Sum('g_fine'), amount=Sum('amount'))
+        old_gold = self.old_gold_exchanges.aggregate(weight=Sum('weight'), value=Sum('value'))
+        payments = self.payments.aggregate(amount=Sum('amount'))
+        self.total_fine_gold = items['fine'] or Decimal('0.000')
+        self.total_amount = items['amount'] or Decimal('0.00')
+        self.old_gold_weight = old_gold['weight'] or Decimal('0.000')
+        self.old_gold_value = old_gold['value'] or Decimal('0.00')
+        self.cash_received = self.counter_cash + (payments['amount'] or Decimal('0.00'))
+        self.calculate_derived()
+
+    def recalculate_totals(self):
+        """Full recompute of the stored totals from the bill's rows
+
+        Fallback/repair path; day-to-day edits go through apply_totals_delta.
+        """
+        self.compute_totals_from_rows()
         self.save()
 
+    def totals_drift(self):
+        """Compare stored totals against a full recompute from the rows
+
+        Returns a dict of field name to (stored, recomputed) for every total
+        that does not match; an empty dict means the totals are consistent.
+        """
+        check = Bill.objects.get(pk=self.pk)
+        stored = {field: getattr(check, field) for field in self.DELTA_FIELDS + self.DERIVED_FIELDS}
+        check.compute_totals_from_rows()
+        drift = {}
+        for field, value in stored.items():
+            recomputed = getattr(check, field)
+            if field != 'status':
+                places = Decimal(1).scaleb(-self._meta.get_field(field).decimal_places)
+                recomputed = Decimal(recomputed).quantize(places)
+            if value != recomputed:
+                drift[field] = (value, recomputed)
+        return drift
+
+    @classmethod
+    def apply_totals_delta(cls, bill_id, **deltas):
+        """Apply the old-vs-new change of one row to a bill's stored totals
+
+        ``deltas`` maps fields in DELTA_FIELDS to the amount to add. The totals
+        are adjusted with a single atomic F() update, so concurrent edits to
+        the same bill cannot overwrite each other, and only the bill row is
+        re-read to refresh tax, balance and status. Returns the updated bill,
+        or None if nothing changed or the bill no longer exists.
+        """
+        deltas = {field: value for field, value in deltas.items() if value}
+        if not deltas:
+            return None
+        with transaction.atomic():
+            updated = cls.objects.filter(pk=bill_id).update(
+                updated_at=timezone.now(),
+                **{field: F(field) + value for field, value in deltas.items()}
+            )
+            if not updated:
+                return None
+            bill = cls.objects.select_for_update().get(pk=bill_id)
+            bill.calculate_derived()
+            # For the sales rollup receivers, which never saw the update above
+            bill._applied_deltas = deltas
+            bill.save(update_fields=cls.DERIVED_FIELDS)
+        return bill
+
     def save(self, *args, **kwargs):
+        if not self.business_date:
+            self.business_date = timezone.localdate(self.bill_date) if self.bill_date else timezone.localdate()
         if not self.bill_number:
-            # Generate bill number
-            from datetime import datetime
-            date_str = datetime.now().strftime('%Y%m%d')
-            last_bill = Bill.objects.filter(bill_number__startswith=f'JB{date_str}').order_by('-bill_number').first()
-            if last_bill:
-                try:
-                    num = int(last_bill.bill_number.split('-')[-1]) + 1
-                except:
-                    num = 1
-            else:
-                num = 1
-            self.bill_number = f'JB{date_str}-{num:03d}'
+            # Generate bill number from the per-day sequence
+            from .sequences import next_bill_number
+            self.bill_number = next_bill_number(self.business_date)
         super().save(*args, **kwargs)
 
 
-class BillItem(models.Model):
+class BillSequence(models.Model):
+    """Per-day counter used to allocate bill numbers (see billing/sequences.py)"""
+    day = models.DateField(unique=True)
+    last_number = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.day}: {self.last_number}"
+
+
+class BillTotalsMixin:
+    """Track what a row contributes to its bill's stored totals
+
+    ``bill_totals`` maps row fields to the Bill total they add to. The values
+    loaded from the database are remembered so that saving or deleting the
+    row only has to apply the difference to the bill (see billing/signals.py).
+    """
+    bill_totals = {}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'bill_id' in field_names and all(field in field_names for field in cls.bill_totals):
+            instance.remember_bill_contribution()
+        return instance
+
+    def bill_contribution(self):
+        """Amounts this row currently adds to its bill's totals"""
+        return {total: getattr(self, field) or 0 for field, total in self.bill_totals.items()}
+
+    def remember_bill_contribution(self):
+        self._loaded_bill_id = self.bill_id
+        self._loaded_contribution = self.bill_contribution()
+
+    def loaded_bill_contribution(self):
+        """(bill_id, contribution) as last saved or loaded, or None if unknown"""
+        if not hasattr(self, '_loaded_contribution'):
+            return None
+        return self._loaded_bill_id, self._loaded_contribution
+
+
+class BillItem(BillTotalsMixin, models.Model):
     """Bill items model for storing individual items in a bill"""
     ITEM_TYPE_CHOICES = [
         ('S', 'S - New Gold'),
@@ -240,6 +421,8 @@ class BillItem(models.Model):
     amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     order = models.IntegerField(default=0)
 
+    bill_totals = {'g_fine': 'total_fine_gold', 'amount': 'total_amount'}
+
     class Meta:
         ordering = ['order', 'id']
 
@@ -263,12 +446,9 @@ class BillItem(models.Model):
         self.calculate_fines()
         self.calculate_amount()
         super().save(*args, **kwargs)
-        # Recalculate bill totals
-        if self.bill:
-            self.bill.calculate_totals()
 
 
-class OldGold(models.Model):
+class OldGold(BillTotalsMixin, models.Model):
     """Old gold exchange model"""
     bill = models.ForeignKey(Bill, on_delete=models.CASCADE, related_name='old_gold_exchanges')
     weight = models.DecimalField(
@@ -281,22 +461,17 @@ class OldGold(models.Model):
     description = models.CharField(max_length=200, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    bill_totals = {'weight': 'old_gold_weight', 'value': 'old_gold_value'}
+
     def __str__(self):
         return f"Old Gold - {self.bill.bill_number}"
 
     def save(self, *args, **kwargs):
         self.value = self.weight * self.rate_per_gram
         super().save(*args, **kwargs)
-        # Update bill old gold totals
-        if self.bill:
-            total_old_gold = sum(og.weight for og in self.bill.old_gold_exchanges.all())
-            total_old_gold_value = sum(og.value for og in self.bill.old_gold_exchanges.all())
-            self.bill.old_gold_weight = total_old_gold
-            self.bill.old_gold_value = total_old_gold_value
-            self.bill.calculate_totals()
 
 
-class Payment(models.Model):
+class Payment(BillTotalsMixin, models.Model):
     """Payment model for tracking payments"""
     PAYMENT_METHOD_CHOICES = [
         ('cash', 'Cash'),
@@ -317,20 +492,114 @@ class Payment(models.Model):
     notes = models.TextField(blank=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
 
+    bill_totals = {'amount': 'cash_received'}
+
     class Meta:
         ordering = ['-payment_date']
 
     def __str__(self):
         return f"Payment of ₹{self.amount} for {self.bill.bill_number}"
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        # Update bill cash received from sum of all payments
-        if self.bill:
-            total_payments = sum(p.amount for p in self.bill.payments.all())
-            self.bill.cash_received = total_payments
-            # Calculate totals (which also updates balance and status)
-            self.bill.calculate_totals()
-            # Save the bill with updated values
-            self.bill.save(update_fields=['cash_received', 'balance', 'status', 'updated_at'])
 
+
+class DailySalesSummary(models.Model):
+    """Per-day sales rollup by material and bill status (see billing/rollups.py)
+
+    Rows with material_type 'all' hold the bill-level figures (bill count,
+    net payable, tax, cash received, outstanding, old gold); rows for each
+    BillItem material hold that material's item figures.
+    """
+    ALL_MATERIALS = 'all'
+
+    day = models.DateField()
+    material_type = models.CharField(max_length=10)
+    status = models.CharField(max_length=20, choices=Bill.BILL_STATUS_CHOICES)
+
+    # Bill-level figures ('all' rows)
+    bill_count = models.PositiveIntegerField(default=0)
+    net_payable = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    tax = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    cash_received = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    outstanding = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    old_gold_weight = models.DecimalField(max_digits=12, decimal_places=3, default=Decimal('0.000'))
+
+    # Item figures (per-material rows)
+    item_count = models.PositiveIntegerField(default=0)
+    net_weight = models.DecimalField(max_digits=12, decimal_places=3, default=Decimal('0.000'))
+    fine_gold = models.DecimalField(max_digits=12, decimal_places=3, default=Decimal('0.000'))
+    sales = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        ordering = ['day', 'material_type', 'status']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'material_type', 'status'], name='billing_dailysales_day_material_status'
+            ),
+        ]
+        verbose_name_plural = 'daily sales summaries'
+
+    def __str__(self):
+        return f"{self.day} {self.material_type} {self.status}"
+
+
+class Job(models.Model):
+    """Background task run by ``manage.py run_jobs`` (see billing/jobs.py)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    DEAD = 'dead'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (DEAD, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    bill = models.ForeignKey(Bill, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    result = models.JSONField(null=True, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Workers look for due jobs; only queued rows are indexed
+            models.Index(fields=['run_at'], condition=models.Q(status='queued'), name='billing_job_due_idx'),
+            models.Index(fields=['status', '-updated_at'], name='billing_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.SUCCEEDED, self.DEAD)
+
+
+class BillSnapshot(models.Model):
+    """Frozen pages of a paid bill (see billing/snapshots.py)"""
+    bill = models.OneToOneField(Bill, on_delete=models.CASCADE, primary_key=True, related_name='snapshot')
+    # Bill.updated_at and the template version the snapshot was taken at
+    bill_updated_at = models.DateTimeField()
+    version = models.CharField(max_length=16)
+    # zlib-compressed renderings of bill_print_sheet.html, bill_pdf.html and
+    # the detail page's bill_detail_sheet.html and bill_detail_payments.html
+    print_html = models.BinaryField()
+    pdf_html = models.BinaryField()
+    detail_html = models.BinaryField()
+    payments_html = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Snapshot of bill #{self.bill_id}"
@@ -0,0 +1,296 @@
+"""
+Keyset (cursor) pagination
+
+OFFSET pagination reads and throws away every row before the requested
+page, and Django's Paginator counts the whole result for every page. The
+cursor paginator instead remembers the sort key of the last (or first) row
+shown and asks for the rows after (or before) it:
+
+    WHERE created_at < %s OR (created_at = %s AND id < %s)
+    ORDER BY created_at DESC, id DESC LIMIT 21
+
+which an index on the ordering answers by reading just one page, so page N
+costs the same as page 1. Pages are addressed by opaque ``cursor`` tokens
+instead of page numbers; there is no jumping to an arbitrary page.
+
+The total shown next to the page number is an estimate: the planner's row
+estimate on PostgreSQL, and a count capped at ``PAGINATION_COUNT_LIMIT``
+elsewhere. EstimatedCountPaginator uses the same estimate for admin change
+lists, which keep their page numbers.
+"""
+import base64
+import binascii
+import json
+import math
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(data):
+    payload = json.dumps(data, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        payload = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(payload)
+    except (binascii.Error, ValueError):
+        raise InvalidCursor(token)
+    if not isinstance(data, dict) or not isinstance(data.get('k'), list):
+        raise InvalidCursor(token)
+    return data
+
+
+def estimate_count(queryset, limit=None):
+    """Return ``(count, is_estimate)`` for a queryset without a full COUNT(*)"""
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        if not queryset.query.where:
+            # Unfiltered: the table's row estimate kept by VACUUM/ANALYZE
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= 0:
+                return row[0], True
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return plan[0]['Plan']['Plan Rows'], True
+
+    if limit is None:
+        limit = getattr(settings, 'PAGINATION_COUNT_LIMIT', 1000)
+    count = queryset.order_by()[:limit + 1].count()
+    if count > limit:
+        return limit, True
+    return count, False
+
+
+class EstimatedCountPaginator(Paginator):
+    """Page-number paginator counting with estimate_count()
+
+    Used by admin change lists of large tables. The estimate may be low, so
+    pages past it are served too (empty if there is nothing there).
+    """
+    count_is_estimate = False
+
+    @cached_property
+    def count(self):
+        count, self.count_is_estimate = estimate_count(self.object_list)
+        return count
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if self.count_is_estimate and int(number) > 1:
+                return int(number)
+            raise
+
+
+class CursorPage:
+    """One page of a CursorPaginator, in the shape templates use for page_obj"""
+
+    def __init__(self, object_list, paginator, number, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.number = number
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.total = None
+        self.total_is_estimate = False
+        self.next_url = None
+        self.previous_url = None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def num_pages(self):
+        if self.total is None:
+            return None
+        return max(math.ceil(self.total / self.paginator.per_page), self.number)
+
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return self.paginator.cursor_for(self.object_list[-1], self.number + 1, previous=False)
+
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return self.paginator.cursor_for(self.object_list[0], self.number - 1, previous=True)
+
+
+class CursorPaginator:
+    """Page a queryset by its ordering key instead of by OFFSET
+
+    ``ordering`` must be unique (end with the primary key) and all in one
+    direction, e.g. ``('-created_at', '-id')``.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-created_at', '-id')):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = list(ordering)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+        self.descending = self.ordering[0].startswith('-')
+        if any(field.startswith('-') != self.descending for field in self.ordering):
+            raise ValueError('All cursor ordering fields must sort in the same direction')
+
+    def cursor_for(self, obj, number, previous):
+        data = {'k': [getattr(obj, field) for field in self.fields], 'n': number}
+        if previous:
+            data['p'] = 1
+        return encode_cursor(data)
+
+    def key_values(self, values):
+        """Convert the key values of a cursor back to Python values"""
+        if len(values) != len(self.fields):
+            raise InvalidCursor(values)
+        model = self.queryset.model
+        try:
+            return [
+                model._meta.get_field('id' if field == 'pk' else field).to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+        except ValidationError:
+            raise InvalidCursor(values)
+
+    def seek(self, values, after):
+        """Filter for rows after (or before) a key in the paginator's ordering"""
+        lookup = 'lt' if self.descending == after else 'gt'
+        condition = Q()
+        for idx, field in enumerate(self.fields):
+            equal = {name: value for name, value in zip(self.fields[:idx], values[:idx])}
+            condition |= Q(**equal, **{f'{field}__{lookup}': values[idx]})
+        return condition
+
+    def page(self, cursor=None, with_total=True):
+        """Return the page a cursor token points to (default: the first)"""
+        queryset = self.queryset.order_by(*self.ordering)
+        number, previous = 1, False
+        if cursor:
+            data = decode_cursor(cursor)
+            try:
+                number = max(int(data.get('n', 1)), 1)
+            except (TypeError, ValueError):
+                raise InvalidCursor(cursor)
+            previous = bool(data.get('p'))
+            values = self.key_values(data['k'])
+            queryset = queryset.filter(self.seek(values, after=not previous))
+
+        if previous:
+            # Walk backwards from the cursor, then restore the display order
+            reverse = [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering]
+            rows = list(queryset.order_by(*reverse)[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            object_list = rows[:self.per_page][::-1]
+            has_next = True
+        else:
+            rows = list(queryset[:self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            object_list = rows[:self.per_page]
+            has_previous = bool(cursor)
+        if not has_previous:
+            number = 1
+
+        page = CursorPage(object_list, self, number, has_next, has_previous)
+        if with_total:
+            page.total, page.total_is_estimate = estimate_count(self.queryset)
+        return page
+
+
+class RankedPaginator:
+    """Page a ranking (e.g. search results) by position instead of by key
+
+    A ranking has no sort key of its own to seek from, so its cursors hold
+    the page number and the caller reads each page of the ranking with
+    LIMIT ``per_page + 1`` OFFSET offset(number).
+    """
+
+    def __init__(self, per_page):
+        self.per_page = int(per_page)
+
+    def number(self, cursor=None):
+        """The page number a cursor token points to (default: 1)"""
+        if not cursor:
+            return 1
+        data = decode_cursor(cursor)
+        try:
+            return max(int(data.get('n', 1)), 1)
+        except (TypeError, ValueError):
+            raise InvalidCursor(cursor)
+
+    def offset(self, number):
+        return (number - 1) * self.per_page
+
+    def cursor_for(self, obj, number, previous):
+        data = {'k': [], 'n': number}
+        if previous:
+            data['p'] = 1
+        return encode_cursor(data)
+
+    def page(self, objects, number):
+        """Page ``number`` of the ranking from the objects read at its offset"""
+        return CursorPage(objects[:self.per_page], self, number, len(objects) > self.per_page, number > 1)
+
+
+class CursorPaginationMixin:
+    """ListView mixin that pages with CursorPaginator instead of Paginator
+
+    Templates get ``page_obj.next_url`` and ``page_obj.previous_url``, which
+    keep the request's other query parameters (e.g. search filters).
+    """
+    cursor_param = 'cursor'
+    cursor_ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = CursorPaginator(queryset, page_size, ordering=self.cursor_ordering)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_param))
+        except InvalidCursor:
+            raise Http404('Invalid page cursor')
+        page.next_url = self.cursor_url(page.next_cursor())
+        page.previous_url = self.cursor_url(page.previous_cursor())
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def cursor_url(self, cursor):
+        if cursor is None:
+            return None
+        params = self.request.GET.copy()
+        params.pop('page', None)
+        if cursor_is_first(cursor):
+            params.pop(self.cursor_param, None)
+        else:
+            params[self.cursor_param] = cursor
+        return f'?{params.urlencode()}'
+
+
+def cursor_is_first(cursor):
+    """Whether a previous-page cursor leads back to page 1"""
+    data = decode_cursor(cursor)
+    return bool(data.get('p')) and data.get('n', 1) <= 1
@@ -0,0 +1,183 @@
+"""
+Bulk bill PDF archives
+
+The auditor's month-end pack is every bill PDF of a date range in one ZIP.
+Each PDF goes into the ZIP as soon as it is rendered, and the ZIP is
+written out as it grows, so only the PDFs in flight are held in memory,
+however many bills the range has. Paid bills are rendered from their
+snapshots, and bills that were downloaded or emailed before come from the
+PDF cache (billing/pdfs.py) instead of being rendered again.
+
+WeasyPrint is CPU-bound and holds the GIL, so the bills are rendered in a
+ProcessPoolExecutor with ``PDF_ARCHIVE_WORKERS`` processes (default: one
+per CPU). The pool forks the process that starts it, whose database
+connections are closed first, so only ``python manage.py
+export_bill_pdfs`` and the job worker (``manage.py run_jobs``) start one,
+never a web worker.
+
+/reports/export/pdfs/ (staff only) queues a 'pdf_archive' job. The job
+worker renders the archive into a file under MEDIA_ROOT/pdf_archives,
+storing how many bills are done on the job as it goes, and the page
+streams that file once the job is done. Archives older than
+``PDF_ARCHIVE_MAX_AGE`` seconds are deleted when the next one is written.
+"""
+import os
+import secrets
+import tempfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+from . import renderer
+from .snapshots import bill_pdf
+
+
+def worker_count():
+    return getattr(settings, 'PDF_ARCHIVE_WORKERS', 0) or os.cpu_count() or 1
+
+
+def init_worker():
+    """Set Django up in a pool process (a no-op for forked processes)"""
+    import django
+    django.setup()
+    # A job worker's warm renderers belong to the job worker
+    renderer.forget_pool()
+
+
+def render_in_worker(bill_id):
+    """Render one bill; returns (bill_number, pdf bytes)"""
+    bill, pdf = bill_pdf(bill_id)
+    return bill.bill_number, pdf
+
+
+def render_bills(bill_ids, workers=None):
+    """Yield (bill_number, pdf) for bills in the order their PDFs finish
+
+    With ``workers`` the bills are rendered in that many processes; only
+    management commands may ask for them. Without, they are rendered here,
+    one after the other.
+    """
+    if not workers:
+        for bill_id in bill_ids:
+            yield render_in_worker(bill_id)
+        return
+
+    # Forked processes must not share the parent's database connections
+    connections.close_all()
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+    try:
+        bill_ids = iter(bill_ids)
+        pending = {pool.submit(render_in_worker, bill_id) for bill_id in islice(bill_ids, workers * 2)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # Keep the processes busy before handing results on
+            for bill_id in islice(bill_ids, len(done)):
+                pending.add(pool.submit(render_in_worker, bill_id))
+            for future in done:
+                yield future.result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+class ZipStream:
+    """Write-only file object that collects what ZipFile writes to it
+
+    It has tell() but no seek(), so ZipFile writes sizes after each entry
+    instead of going back to patch its header.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        """Return and forget everything written since the last pop()"""
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def archive_bills(bills):
+    """Ids of the bills of a queryset, in the order an archive lists them"""
+    return list(bills.order_by('business_date', 'bill_number').values_list('pk', flat=True))
+
+
+def archive_chunks(bill_ids, workers=None, progress=None):
+    """Yield the bytes of a ZIP with the PDFs of bills as it is written
+
+    ``workers`` is as for render_bills(). ``progress(done, total)`` is
+    called after each PDF is added.
+    """
+    total = len(bill_ids)
+    stream = ZipStream()
+    # PDF content streams are compressed already
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for done, (bill_number, pdf) in enumerate(render_bills(bill_ids, workers), 1):
+            archive.writestr(f'bill_{bill_number}.pdf', pdf)
+            if progress is not None:
+                progress(done, total)
+            yield stream.pop()
+    yield stream.pop()
+
+
+def write_archive(path, bill_ids, workers=None, progress=None):
+    """Write the ZIP of bills to ``path``, replacing it only once complete"""
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            for chunk in archive_chunks(bill_ids, workers=workers, progress=progress):
+                handle.write(chunk)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def archive_root():
+    return Path(settings.MEDIA_ROOT) / 'pdf_archives'
+
+
+def new_archive_path(job):
+    """A file for the archive of a job, under a name that cannot be guessed"""
+    root = archive_root()
+    root.mkdir(parents=True, exist_ok=True)
+    return root / f'{job.pk}_{secrets.token_urlsafe(16)}.zip'
+
+
+def archive_path(job):
+    """The finished archive of a 'pdf_archive' job, or None"""
+    name = (job.result or {}).get('file')
+    if not name:
+        return None
+    path = archive_root() / name
+    return path if path.is_file() else None
+
+
+def evict(max_age=None):
+    """Delete archives older than ``PDF_ARCHIVE_MAX_AGE`` seconds"""
+    if max_age is None:
+        max_age = getattr(settings, 'PDF_ARCHIVE_MAX_AGE', 86400)
+    cutoff = time.time() - max_age
+    for path in archive_root().glob('*.zip'):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except FileNotFoundError:
+            pass
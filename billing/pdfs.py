@@ -0,0 +1,218 @@
+"""
+Bill PDFs
+
+Rendering a bill through WeasyPrint costs seconds of CPU, so rendered PDFs
+are kept on disk under ``MEDIA_ROOT/bill_pdfs/<bill id>/`` and served from
+there until the bill changes. A file's name is a digest of the bill's id,
+its ``updated_at`` and the version of the PDF template, so an edited bill
+or a new template never matches a stale file:
+
+* Bill saves (including total changes from items, old gold and payments)
+  move ``updated_at``.
+* Changes that leave the totals alone (an item's description, a
+  customer's address) drop the bill's files when the transaction commits,
+  see the receivers in billing/signals.py.
+
+The cache is bounded by ``BILL_PDF_CACHE_MAX_BYTES``: serving a file
+refreshes its mtime, and the least recently used files are removed until
+the cache is back under 90% of the bound. Scanning the cache costs a stat
+per file, so it is not scanned on every write: each process keeps a
+running total from its last scan plus what it wrote since, and scans when
+that total passes the bound or after SCAN_EVERY writes (which catches up
+with the other processes' writes).
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.template.loader import get_template
+
+from . import renderer
+from .grouping import items_by_type
+from .jinja2 import render_bill, template_digest
+
+try:
+    import weasyprint  # noqa: F401
+    WEASYPRINT_AVAILABLE = True
+except (ImportError, OSError):
+    WEASYPRINT_AVAILABLE = False
+
+PDF_TEMPLATE = 'billing/bill_pdf.html'
+# Bump to invalidate every cached PDF after a change outside the template
+# (e.g. to billing/grouping.py or the WeasyPrint version)
+RENDER_VERSION = 1
+# Writes between two scans of the cache by one process
+SCAN_EVERY = 100
+# Fraction of BILL_PDF_CACHE_MAX_BYTES the cache is evicted down to
+LOW_WATER = 0.9
+
+_local = threading.local()
+_evict_lock = threading.Lock()
+# Bytes in the cache as of this process's last scan plus its writes since,
+# and the writes since that scan; None until the first scan
+_cache_bytes = None
+_writes = 0
+
+
+def bill_html(bill, items=None):
+    """The HTML of a bill's PDF; ``items`` as for items_by_type()"""
+    return render_bill(PDF_TEMPLATE, {
+        'bill': bill,
+        'items_by_type': items_by_type(bill, items),
+    })
+
+
+def render_bill_pdf(bill, html=None):
+    """Render a bill to PDF bytes through WeasyPrint, bypassing the cache
+
+    ``html`` is the bill's PDF HTML when the caller already has it (from
+    the bill's snapshot); otherwise it is rendered from the live rows.
+    """
+    return renderer.write_pdf(html if html is not None else bill_html(bill))
+
+
+@lru_cache(maxsize=None)
+def template_version():
+    """Digest of the PDF template and stylesheet, computed once per process"""
+    stylesheet = get_template(renderer.STYLESHEET_TEMPLATE).template.source
+    return hashlib.sha256(f'{RENDER_VERSION}:{template_digest(PDF_TEMPLATE)}:{stylesheet}'.encode()).hexdigest()[:16]
+
+
+def cache_root():
+    return Path(settings.MEDIA_ROOT) / 'bill_pdfs'
+
+
+def cache_path(bill):
+    """Where the PDF of a bill in its current state is cached"""
+    key = f'{bill.pk}:{bill.updated_at.isoformat()}:{template_version()}'
+    digest = hashlib.sha256(key.encode()).hexdigest()[:32]
+    return cache_root() / str(bill.pk) / f'{digest}.pdf'
+
+
+def cached_bill_pdf(bill):
+    """PDF bytes of a bill from the disk cache, or None if not rendered yet"""
+    path = cache_path(bill)
+    try:
+        pdf = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    # Mark as recently used for eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return pdf
+
+
+def get_bill_pdf(bill, html=None):
+    """PDF bytes of a bill, from the disk cache or freshly rendered"""
+    pdf = cached_bill_pdf(bill)
+    if pdf is None:
+        pdf = render_bill_pdf(bill, html)
+        store(cache_path(bill), pdf)
+    return pdf
+
+
+def store(path, pdf):
+    """Write a PDF atomically, drop the bill's stale PDFs and evict if full"""
+    directory = path.parent
+    directory.mkdir(parents=True, exist_ok=True)
+    freed = 0
+    for stale in directory.glob('*.pdf'):
+        if stale != path:
+            try:
+                freed += stale.stat().st_size
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(pdf)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    note_write(len(pdf) - freed)
+
+
+def note_write(size):
+    """Count a write of ``size`` bytes; scan and evict when it is time"""
+    global _cache_bytes, _writes
+    max_bytes = getattr(settings, 'BILL_PDF_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+    with _evict_lock:
+        if _cache_bytes is not None and _writes < SCAN_EVERY and _cache_bytes + size <= max_bytes:
+            _cache_bytes += size
+            _writes += 1
+            return
+    evict(max_bytes)
+
+
+def evict(max_bytes=None):
+    """Remove the least recently used PDFs until the cache fits its bound
+
+    A cache over its bound is evicted down to LOW_WATER of it, so the
+    writes that follow do not each trigger another scan.
+    """
+    global _cache_bytes, _writes
+    if max_bytes is None:
+        max_bytes = getattr(settings, 'BILL_PDF_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+    with _evict_lock:
+        files = []
+        total = 0
+        for path in cache_root().glob('*/*.pdf'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        files.sort()
+        removed = 0
+        if total > max_bytes:
+            for _, size, path in files:
+                if total <= max_bytes * LOW_WATER:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                removed += 1
+                try:
+                    path.parent.rmdir()
+                except OSError:
+                    pass
+        _cache_bytes = total
+        _writes = 0
+    return removed
+
+
+def invalidate_bills(bill_ids):
+    """Remove the cached PDFs of bills"""
+    root = cache_root()
+    for bill_id in bill_ids:
+        shutil.rmtree(root / str(bill_id), ignore_errors=True)
+
+
+def mark_bills_stale(bill_ids):
+    """Remove the cached PDFs of bills when the transaction commits"""
+    pending = getattr(_local, 'pending', None)
+    if pending is None:
+        pending = _local.pending = set()
+    pending.update(bill_id for bill_id in bill_ids if bill_id is not None)
+    # Registered on every call: if an earlier transaction rolled back, its
+    # callback was dropped but its bills are still pending, and the next
+    # commit handles them too
+    transaction.on_commit(flush_pending)
+
+
+def flush_pending():
+    pending = getattr(_local, 'pending', None)
+    if not pending:
+        return
+    _local.pending = set()
+    invalidate_bills(pending)
@@ -0,0 +1,190 @@
+"""
+Current gold, silver and bar rates
+
+The rate board holds the active GoldRate, SilverRate and BarRate rows,
+loaded together in one query and cached in the process, so the dashboard
+and the bill create/update views read rates without touching the database.
+
+The board is stamped with a version kept in Django's cache. Saving or
+deleting a rate (and the update_*_rate views) bumps the version, and every
+process reloads its board the next time it reads one. With the default
+per-process cache a worker only sees another worker's version bump after
+RATE_BOARD_TTL seconds; configure a shared CACHES backend to make that
+immediate. Views that save rates into a bill (creating or updating one)
+load the board fresh on POST, so a bill is never priced at a rate another
+worker has already replaced.
+
+``rate_at(material, timestamp)`` resolves the rate that was in force at any
+moment. Rate rows are never deleted (updating a rate deactivates the old row
+and adds a new one), so each table is a full price history. Recent history
+is cached per process as a sorted array searched with bisect; older
+timestamps fall back to an indexed query on ``updated_at``.
+"""
+import threading
+import time
+import uuid
+from bisect import bisect_right
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import CharField, F, Subquery, Value
+from django.utils import timezone
+
+from .models import BarRate, GoldRate, SilverRate
+
+VERSION_CACHE_KEY = 'billing:rate_board:version'
+
+# material -> (model, rate field)
+RATE_MODELS = {
+    'gold': (GoldRate, 'rate_24k'),
+    'silver': (SilverRate, 'rate_per_gram'),
+    'bar': (BarRate, 'rate_per_gram'),
+}
+
+_board = None
+_board_lock = threading.Lock()
+_histories = {}
+_histories_lock = threading.Lock()
+
+
+class RateBoard:
+    """The active rate of each material, as model instances (or None)"""
+
+    def __init__(self, gold=None, silver=None, bar=None, version=None):
+        self.gold = gold
+        self.silver = silver
+        self.bar = bar
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls, version=None):
+        """Load the active rate of every material in one query"""
+        queries = []
+        for material, (model, rate_field) in RATE_MODELS.items():
+            current = model.objects.filter(is_active=True).order_by('-updated_at').values('pk')[:1]
+            queries.append(
+                model.objects.filter(pk=Subquery(current))
+                .annotate(material=Value(material, output_field=CharField()), rate=F(rate_field))
+                .values_list('material', 'pk', 'rate', 'updated_by_id', 'updated_at')
+                .order_by()
+            )
+        combined = queries[0].union(*queries[1:], all=True)
+        rates = {}
+        for material, pk, rate, updated_by_id, updated_at in combined:
+            model, rate_field = RATE_MODELS[material]
+            # from_db() takes the values in the model's field order
+            rates[material] = model.from_db(
+                combined.db,
+                ['id', rate_field, 'updated_by_id', 'updated_at', 'is_active'],
+                [pk, rate, updated_by_id, updated_at, True],
+            )
+        return cls(version=version, **rates)
+
+    def rate_for(self, material):
+        """Active rate instance for 'gold', 'silver' or 'bar'"""
+        return getattr(self, material)
+
+    def as_context(self):
+        return {
+            'gold_rate': self.gold,
+            'silver_rate': self.silver,
+            'bar_rate': self.bar,
+        }
+
+
+def get_rate_board(fresh=False):
+    """Return the cached rate board, reloading it if it is stale
+
+    ``fresh`` reloads it regardless (one query), for requests that save
+    the rates into a bill.
+    """
+    global _board
+    version = cache.get(VERSION_CACHE_KEY)
+    ttl = getattr(settings, 'RATE_BOARD_TTL', 30)
+    board = _board
+    if fresh or board is None or board.version != version or time.monotonic() - board.loaded_at > ttl:
+        with _board_lock:
+            board = _board = RateBoard.load(version=version)
+    return board
+
+
+def invalidate_rate_board():
+    """Make every process reload its rate board and history on the next read"""
+    global _board
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+    _board = None
+    _histories.clear()
+
+
+class RateHistory:
+    """Sorted (updated_at, rate) history of one material since a point in time"""
+
+    def __init__(self, material, timestamps, rates, version=None):
+        self.material = material
+        self.timestamps = timestamps
+        self.rates = rates
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls, material, days, version=None):
+        """Load the last ``days`` of history plus the rate in force before it"""
+        model, rate_field = RATE_MODELS[material]
+        since = timezone.now() - timedelta(days=days)
+        rows = list(
+            model.objects.filter(updated_at__gte=since)
+            .order_by('updated_at')
+            .values_list('updated_at', rate_field)
+        )
+        earlier = (
+            model.objects.filter(updated_at__lt=since)
+            .order_by('-updated_at')
+            .values_list('updated_at', rate_field)
+            .first()
+        )
+        if earlier:
+            rows.insert(0, earlier)
+        return cls(
+            material,
+            [updated_at for updated_at, rate in rows],
+            [rate for updated_at, rate in rows],
+            version=version,
+        )
+
+    def covers(self, timestamp):
+        return bool(self.timestamps) and timestamp >= self.timestamps[0]
+
+    def rate_at(self, timestamp):
+        """Rate in force at ``timestamp``; call only when covers() is true"""
+        return self.rates[bisect_right(self.timestamps, timestamp) - 1]
+
+
+def get_rate_history(material):
+    """Return the cached recent history of a material, reloading it if stale"""
+    version = cache.get(VERSION_CACHE_KEY)
+    ttl = getattr(settings, 'RATE_BOARD_TTL', 30)
+    history = _histories.get(material)
+    if history is None or history.version != version or time.monotonic() - history.loaded_at > ttl:
+        with _histories_lock:
+            days = getattr(settings, 'RATE_HISTORY_DAYS', 400)
+            history = _histories[material] = RateHistory.load(material, days, version=version)
+    return history
+
+
+def rate_at(material, timestamp):
+    """Rate per gram of 'gold', 'silver' or 'bar' in force at ``timestamp``
+
+    Returns None if no rate had been set yet at that time.
+    """
+    history = get_rate_history(material)
+    if history.covers(timestamp):
+        return history.rate_at(timestamp)
+    model, rate_field = RATE_MODELS[material]
+    return (
+        model.objects.filter(updated_at__lte=timestamp)
+        .order_by('-updated_at')
+        .values_list(rate_field, flat=True)
+        .first()
+    )
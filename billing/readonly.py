@@ -0,0 +1,51 @@
+"""
+Read-only request handling
+
+Showing a bill must not write to it: a write on a page view takes row locks
+and moves ``updated_at`` (dropping the bill's snapshot and cached PDFs) for
+every visitor. Views decorated with read_only_view serve GET and HEAD
+requests with writes to the database refused, so a write that creeps back
+into a read path fails loudly instead of running on every view. Data that
+needs fixing is fixed in bulk by ``python manage.py repair_bill_items``.
+"""
+from contextlib import contextmanager
+from functools import wraps
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+class ReadOnlyViolation(Exception):
+    pass
+
+
+def refuse_writes(execute, sql, params, many, context):
+    if sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+        raise ReadOnlyViolation(f'Write in a read-only block: {sql[:200]}')
+    return execute(sql, params, many, context)
+
+
+@contextmanager
+def read_only(using=DEFAULT_DB_ALIAS):
+    """Raise ReadOnlyViolation on any write to the database inside the block"""
+    with connections[using].execute_wrapper(refuse_writes):
+        yield
+
+
+def read_only_view(view):
+    """Serve the GET and HEAD requests of a view inside read_only()
+
+    Template responses are rendered inside the block too, so querysets
+    evaluated by the template are covered.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        with read_only():
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        return response
+    return wrapper
@@ -0,0 +1,352 @@
+"""
+Warm WeasyPrint renderers
+
+A cold ``HTML(...).write_pdf()`` pays for importing WeasyPrint, font
+discovery and parsing the bill stylesheet before it lays out a page. Here
+that work happens once per process: the stylesheet (billing/bill_pdf.css)
+is parsed with a shared FontConfiguration on first use and reused for
+every bill.
+
+Processes that render many PDFs (``manage.py run_jobs``) go one step
+further and use a RendererPool. Its worker processes warm up when they
+start, by rendering a throwaway page, and then take render requests over a
+pipe:
+
+* A render that takes longer than ``PDF_RENDER_TIMEOUT`` seconds kills its
+  worker and raises RenderTimeout. A worker that dies raises RenderError.
+  Either way a fresh worker takes its place.
+* A worker whose peak memory passes ``PDF_RENDERER_MAX_MEMORY_MB``, or that
+  has rendered ``PDF_RENDERER_MAX_JOBS`` PDFs, is retired after its
+  current render.
+
+Workers only need WeasyPrint, the stylesheet text and the asset
+directories, so they are started with the 'spawn' method and never touch
+Django or the database.
+
+Bills are rendered against BASE_URL, a host that never resolves, and
+LocalFetcher serves its ``/static/`` and ``/media/`` URLs straight from
+STATIC_ROOT (or STATICFILES_DIRS before collectstatic) and MEDIA_ROOT, with
+recently used files kept in memory. WeasyPrint never makes HTTP requests
+back to our own web workers, which would tie up a worker per asset and
+deadlock when all of them are busy rendering.
+"""
+import mimetypes
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import traceback
+from collections import OrderedDict
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.template.loader import render_to_string
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STYLESHEET_TEMPLATE = 'billing/bill_pdf.css'
+# Base URL of rendered bills; URLs on this host are served by LocalFetcher
+BASE_URL = 'http://billing.invalid/'
+# Rendered by new workers to load fonts and layout code before real work
+WARMUP_HTML = '<p>0123456789 ABCDEFGHIJKLMNOPQRSTUVWXYZ abcdefghijklmnopqrstuvwxyz ₹</p>'
+# Seconds a new worker may take to import WeasyPrint and warm up
+START_TIMEOUT = 120
+
+_warm = threading.local()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class RenderError(Exception):
+    pass
+
+
+class RenderTimeout(RenderError):
+    pass
+
+
+def stylesheet_source():
+    return render_to_string(STYLESHEET_TEMPLATE)
+
+
+def asset_mounts():
+    """(URL path prefix, directories) pairs LocalFetcher serves files from"""
+    def url_path(url):
+        return '/' + urlsplit(url).path.strip('/') + '/'
+
+    static_dirs = [settings.STATIC_ROOT] if settings.STATIC_ROOT else []
+    # Before collectstatic (development) the files are in the source dirs
+    static_dirs += [
+        directory[1] if isinstance(directory, (list, tuple)) else directory
+        for directory in getattr(settings, 'STATICFILES_DIRS', [])
+    ]
+    mounts = [(url_path(settings.STATIC_URL), [str(directory) for directory in static_dirs])]
+    if settings.MEDIA_URL and settings.MEDIA_ROOT:
+        mounts.append((url_path(settings.MEDIA_URL), [str(settings.MEDIA_ROOT)]))
+    return mounts
+
+
+class LocalFetcher:
+    """WeasyPrint url_fetcher that reads BASE_URL assets from disk
+
+    Other URLs go to WeasyPrint's default fetcher. Files are cached in
+    memory by path, modification time and size, up to ``max_bytes``.
+    """
+
+    def __init__(self, mounts, max_bytes=32 * 1024 * 1024):
+        self.host = urlsplit(BASE_URL).netloc
+        self.mounts = [
+            (prefix, [os.path.realpath(directory) for directory in directories])
+            for prefix, directories in mounts
+        ]
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+
+    def local_path(self, path):
+        """File for a URL path under one of the mounts, or None"""
+        for prefix, directories in self.mounts:
+            if not path.startswith(prefix):
+                continue
+            name = path[len(prefix):]
+            for directory in directories:
+                candidate = os.path.realpath(os.path.join(directory, name))
+                # No escaping the directory with ../
+                if os.path.commonpath([candidate, directory]) == directory and os.path.isfile(candidate):
+                    return candidate
+        return None
+
+    def read(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        data = self.cache.get(key)
+        if data is not None:
+            self.cache.move_to_end(key)
+            return data
+        with open(path, 'rb') as handle:
+            data = handle.read()
+        if len(data) <= self.max_bytes:
+            self.cache[key] = data
+            self.cached_bytes += len(data)
+            while self.cached_bytes > self.max_bytes:
+                _, evicted = self.cache.popitem(last=False)
+                self.cached_bytes -= len(evicted)
+        return data
+
+    def __call__(self, url, *args, **kwargs):
+        parts = urlsplit(url)
+        if parts.netloc != self.host:
+            from weasyprint import default_url_fetcher
+            return default_url_fetcher(url, *args, **kwargs)
+        path = self.local_path(unquote(parts.path))
+        if path is None:
+            raise FileNotFoundError(f'No static or media file for {url}')
+        return {
+            'string': self.read(path),
+            'mime_type': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+            'redirected_url': url,
+            'filename': os.path.basename(path),
+        }
+
+
+def peak_memory_mb():
+    """Peak resident memory of the current process in MiB (0 if unknown)"""
+    if resource is None:
+        return 0
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Renderer:
+    """WeasyPrint with the bill stylesheet and fonts loaded once"""
+
+    def __init__(self, stylesheet, mounts, asset_cache_bytes=32 * 1024 * 1024):
+        from weasyprint import CSS, HTML
+        from weasyprint.text.fonts import FontConfiguration
+
+        self.html_class = HTML
+        self.fetcher = LocalFetcher(mounts, asset_cache_bytes)
+        self.font_config = FontConfiguration()
+        self.stylesheet = CSS(
+            string=stylesheet, base_url=BASE_URL, url_fetcher=self.fetcher, font_config=self.font_config
+        )
+
+    def write_pdf(self, html, base_url=None):
+        document = self.html_class(string=html, base_url=base_url or BASE_URL, url_fetcher=self.fetcher)
+        return document.write_pdf(stylesheets=[self.stylesheet], font_config=self.font_config)
+
+
+def renderer_options():
+    """Arguments of Renderer besides the stylesheet, from the settings"""
+    return asset_mounts(), getattr(settings, 'PDF_ASSET_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+
+
+def local_renderer():
+    """This thread's Renderer, created on first use"""
+    renderer = getattr(_warm, 'renderer', None)
+    if renderer is None:
+        renderer = _warm.renderer = Renderer(stylesheet_source(), *renderer_options())
+    return renderer
+
+
+def serve(conn, stylesheet, mounts, asset_cache_bytes):
+    """Main loop of a pool worker: render (html, base_url) requests until told to stop"""
+    # Ctrl+C reaches the whole process group; the parent stops its workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        renderer = Renderer(stylesheet, mounts, asset_cache_bytes)
+        renderer.write_pdf(WARMUP_HTML)
+    except Exception:
+        conn.send(('error', traceback.format_exc(), peak_memory_mb()))
+        return
+    conn.send(('ready', None, peak_memory_mb()))
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        html, base_url = request
+        try:
+            conn.send(('ok', renderer.write_pdf(html, base_url=base_url), peak_memory_mb()))
+        except Exception:
+            conn.send(('error', traceback.format_exc(), peak_memory_mb()))
+
+
+class Worker:
+    """One warm renderer process and its end of the pipe"""
+
+    def __init__(self, context, args):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=serve, args=(child, *args), daemon=True)
+        self.process.start()
+        child.close()
+        self.started = False
+        self.jobs = 0
+
+    def receive(self, timeout):
+        if not self.conn.poll(timeout):
+            raise RenderTimeout(f'No reply from PDF renderer within {timeout} seconds')
+        try:
+            return self.conn.recv()
+        except EOFError:
+            raise RenderError(self.exit_message())
+
+    def exit_message(self):
+        self.process.join(1)
+        return f'PDF renderer exited with code {self.process.exitcode}'
+
+    def render(self, html, base_url, timeout):
+        if not self.started:
+            status, error, _ = self.receive(START_TIMEOUT)
+            if status != 'ready':
+                raise RenderError(error)
+            self.started = True
+        try:
+            self.conn.send((html, base_url))
+        except (BrokenPipeError, OSError):
+            raise RenderError(self.exit_message())
+        self.jobs += 1
+        return self.receive(timeout)
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class RendererPool:
+    """Warm renderer processes that render HTML to PDF on request"""
+
+    def __init__(self, processes=1, timeout=60, max_memory_mb=512, max_jobs=500):
+        self.context = multiprocessing.get_context('spawn')
+        self.worker_args = (stylesheet_source(), *renderer_options())
+        self.timeout = timeout
+        self.max_memory_mb = max_memory_mb
+        self.max_jobs = max_jobs
+        self.idle = queue.Queue()
+        self.workers = set()
+        for _ in range(processes):
+            self.idle.put(self.spawn())
+
+    def spawn(self):
+        worker = Worker(self.context, self.worker_args)
+        self.workers.add(worker)
+        return worker
+
+    def retire(self, worker):
+        self.workers.discard(worker)
+        worker.stop()
+
+    def render(self, html, base_url=None):
+        """Render HTML to PDF bytes in an idle worker, waiting for one if needed"""
+        worker = self.idle.get()
+        try:
+            status, value, memory_mb = worker.render(html, base_url, self.timeout)
+        except RenderError:
+            # Timed out or died: replace it
+            self.retire(worker)
+            self.idle.put(self.spawn())
+            raise
+        if (self.max_memory_mb and memory_mb > self.max_memory_mb) or \
+                (self.max_jobs and worker.jobs >= self.max_jobs):
+            self.retire(worker)
+            worker = self.spawn()
+        self.idle.put(worker)
+        if status != 'ok':
+            raise RenderError(value)
+        return value
+
+    def close(self):
+        for worker in list(self.workers):
+            self.retire(worker)
+
+
+def start_pool():
+    """Start the process-wide RendererPool, if PDF_RENDERER_PROCESSES asks for one"""
+    global _pool
+    processes = getattr(settings, 'PDF_RENDERER_PROCESSES', 0)
+    if not processes:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = RendererPool(
+                processes=processes,
+                timeout=getattr(settings, 'PDF_RENDER_TIMEOUT', 60),
+                max_memory_mb=getattr(settings, 'PDF_RENDERER_MAX_MEMORY_MB', 512),
+                max_jobs=getattr(settings, 'PDF_RENDERER_MAX_JOBS', 500),
+            )
+    return _pool
+
+
+def stop_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def forget_pool():
+    """Drop the pool a forked process inherited, leaving it to its parent"""
+    global _pool
+    _pool = None
+
+
+def write_pdf(html, base_url=None):
+    """Render HTML to PDF bytes in the pool if this process started one, else here"""
+    pool = _pool
+    if pool is not None:
+        return pool.render(html, base_url=base_url)
+    return local_renderer().write_pdf(html, base_url=base_url)
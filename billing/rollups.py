@@ -0,0 +1,248 @@
+"""
+Daily sales rollup
+
+DailySalesSummary keeps one row per business day, material and bill status,
+so reports over any date range read a few rows per day instead of every
+bill. The rows are maintained incrementally. The receivers in
+billing/signals.py turn each change to a bill or item into the difference
+it makes to a few rows and apply it with F() updates, in the transaction
+that makes the change:
+
+* A bill adds to the 'all' row of its day and status: one bill, its net
+  payable, tax, cash received, outstanding balance and old gold weight.
+* An item adds to the row of its bill's day and status and its material:
+  one item, its net weight, fine gold and amount.
+* When a bill's status (or day) changes, its figures and its items' move
+  from the old row to the new one.
+
+Differences are taken between values as stored, read back from the
+database, so the rows always equal a fresh aggregate of the bills.
+``python manage.py rebuild_sales_summary`` builds the rows of days from
+before the rollup existed, or rebuilds a range.
+"""
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Bill, BillItem, DailySalesSummary
+
+logger = logging.getLogger(__name__)
+
+OUTSTANDING_STATUSES = ['unpaid', 'partial']
+
+# Bill fields the rollup figures are taken from
+BILL_FIELDS = [
+    'business_date', 'status', 'net_payable', 'cgst_amount', 'sgst_amount', 'cash_received', 'balance',
+    'old_gold_weight',
+]
+COUNTS = ['bill_count', 'item_count']
+
+
+def quantized(field, value):
+    """A summed value at the places of its rollup field (SQLite sums decimals as floats)"""
+    places = DailySalesSummary._meta.get_field(field).decimal_places
+    return Decimal(value).quantize(Decimal(1).scaleb(-places))
+
+
+def bill_figures(bill):
+    """What a bill (a dict of BILL_FIELDS) adds to its 'all' row"""
+    return {
+        'bill_count': 1,
+        'net_payable': bill['net_payable'],
+        'tax': bill['cgst_amount'] + bill['sgst_amount'],
+        'cash_received': bill['cash_received'],
+        'outstanding': bill['balance'] if bill['status'] in OUTSTANDING_STATUSES else Decimal('0.00'),
+        'old_gold_weight': bill['old_gold_weight'],
+    }
+
+
+def item_figures(item):
+    """What an item adds to its material's row"""
+    return {'item_count': 1, 'net_weight': item.net_weight, 'fine_gold': item.g_fine, 'sales': item.amount}
+
+
+def stored_bill(bill_id):
+    """The BILL_FIELDS of a bill as stored, or None"""
+    return Bill.objects.filter(pk=bill_id).values(*BILL_FIELDS).first()
+
+
+def bill_key(bill_id):
+    """(day, status) of a bill as stored, or None"""
+    return Bill.objects.filter(pk=bill_id).values_list('business_date', 'status').first()
+
+
+def stored_item(item_id):
+    """(rollup row key, figures) of an item as stored, or None"""
+    row = BillItem.objects.filter(pk=item_id).values(
+        'material_type', 'net_weight', 'g_fine', 'amount', 'bill__business_date', 'bill__status',
+    ).first()
+    if row is None:
+        return None
+    key = row['bill__business_date'], row['material_type'], row['bill__status']
+    return key, {'item_count': 1, 'net_weight': row['net_weight'], 'fine_gold': row['g_fine'], 'sales': row['amount']}
+
+
+def items_by_key(items):
+    """Figures of items grouped by rollup row, summed in the database"""
+    rows = items.order_by().values('material_type', 'bill__business_date', 'bill__status').annotate(
+        item_count=Count('pk'),
+        net_weight=Sum('net_weight'),
+        fine_gold=Sum('g_fine'),
+        sales=Sum('amount'),
+    )
+    return {
+        (row.pop('bill__business_date'), row.pop('material_type'), row.pop('bill__status')): {
+            field: value if field in COUNTS else quantized(field, value) for field, value in row.items()
+        }
+        for row in rows
+    }
+
+
+class Changes:
+    """Differences to the rollup rows, applied together"""
+
+    def __init__(self):
+        self.rows = defaultdict(lambda: defaultdict(int))
+
+    def add(self, key, figures, sign=1):
+        for field, value in figures.items():
+            self.rows[key][field] += sign * value
+
+    def move(self, old_key, old_figures, new_key, new_figures):
+        """Replace one contribution by another; either may be None"""
+        if old_key is not None:
+            self.add(old_key, old_figures, -1)
+        if new_key is not None:
+            self.add(new_key, new_figures)
+
+    def apply(self):
+        for key, figures in self.rows.items():
+            apply_row(key, {field: value for field, value in figures.items() if value})
+        self.rows.clear()
+
+
+def apply_row(key, figures):
+    """Add figures to one rollup row with F() updates, creating it if needed"""
+    if not figures:
+        return
+    day, material_type, status = key
+    rows = DailySalesSummary.objects.filter(day=day, material_type=material_type, status=status)
+    updates = {field: F(field) + value for field, value in figures.items()}
+    if not rows.update(**updates):
+        if any(figures.get(field, 0) < 0 for field in COUNTS):
+            # A day from before the rollup existed, not backfilled yet
+            logger.warning('No sales summary row for %s; run rebuild_sales_summary for that day', key)
+            return
+        try:
+            with transaction.atomic():
+                DailySalesSummary.objects.create(day=day, material_type=material_type, status=status, **figures)
+        except IntegrityError:
+            # Created by a concurrent transaction since the update
+            rows.update(**updates)
+    if any(figures.get(field, 0) < 0 for field in COUNTS):
+        rows.filter(bill_count=0, item_count=0).delete()
+
+
+def bill_changed(bill_id, before, after):
+    """Apply the change of a bill from ``before`` to ``after`` (dicts of BILL_FIELDS, or None)"""
+    changes = Changes()
+    old_key = (before['business_date'], DailySalesSummary.ALL_MATERIALS, before['status']) if before else None
+    new_key = (after['business_date'], DailySalesSummary.ALL_MATERIALS, after['status']) if after else None
+    changes.move(old_key, before and bill_figures(before), new_key, after and bill_figures(after))
+    moved = before and after and (before['business_date'], before['status']) != (after['business_date'], after['status'])
+    if moved or (before and not after):
+        # The bill's items are on the rows of its old day and status
+        for (_, material_type, _), figures in items_by_key(BillItem.objects.filter(bill_id=bill_id)).items():
+            changes.add((before['business_date'], material_type, before['status']), figures, -1)
+            if after:
+                changes.add((after['business_date'], material_type, after['status']), figures)
+    changes.apply()
+
+
+def bill_deleted(bill_id):
+    """Take a bill and its items out of the rollup (before they are deleted)"""
+    bill_changed(bill_id, stored_bill(bill_id), None)
+
+
+def item_changed(before, after):
+    """Apply the change of an item; ``before`` and ``after`` are (key, figures) or None"""
+    changes = Changes()
+    changes.move(*(before or (None, None)), *(after or (None, None)))
+    changes.apply()
+
+
+def add_items(item_ids, sign=1):
+    """Add (or with ``sign=-1`` take out) items written without signals, e.g. by bulk_create"""
+    changes = Changes()
+    for key, figures in items_by_key(BillItem.objects.filter(pk__in=item_ids)).items():
+        changes.add(key, figures, sign)
+    changes.apply()
+
+
+def rebuild_day(day):
+    """Replace the rollup rows of one day with a fresh aggregate of its bills
+
+    For rebuild_sales_summary and other bulk loads; the receivers keep the
+    rows up to date after that.
+    """
+    bills = Bill.objects.filter(business_date=day)
+    money = DecimalField(max_digits=14, decimal_places=2)
+    rows = {}
+
+    bill_totals = bills.order_by().values('status').annotate(
+        bill_count=Count('pk'),
+        net_payable=Sum('net_payable'),
+        tax=Sum(F('cgst_amount') + F('sgst_amount'), output_field=money),
+        cash_received=Sum('cash_received'),
+        outstanding=Coalesce(
+            Sum('balance', filter=Q(status__in=OUTSTANDING_STATUSES)), Decimal('0.00'), output_field=money
+        ),
+        old_gold_weight=Sum('old_gold_weight'),
+    )
+    for totals in bill_totals:
+        status = totals.pop('status')
+        rows[DailySalesSummary.ALL_MATERIALS, status] = totals
+
+    for (_, material_type, status), totals in items_by_key(BillItem.objects.filter(bill__in=bills)).items():
+        rows[material_type, status] = totals
+
+    with transaction.atomic():
+        DailySalesSummary.objects.filter(day=day).delete()
+        DailySalesSummary.objects.bulk_create([
+            DailySalesSummary(day=day, material_type=material_type, status=status, **totals)
+            for (material_type, status), totals in rows.items()
+        ])
+    return len(rows)
+
+
+def summarize(date_from, date_to):
+    """Totals over a date range (inclusive) read from the rollup
+
+    Returns a dict with the bill-level totals and ``materials``, a list of
+    per-material item totals.
+    """
+    rows = DailySalesSummary.objects.filter(day__gte=date_from, day__lte=date_to)
+    totals = rows.filter(material_type=DailySalesSummary.ALL_MATERIALS).aggregate(
+        bill_count=Coalesce(Sum('bill_count'), 0),
+        net_payable=Coalesce(Sum('net_payable'), Decimal('0.00')),
+        tax=Coalesce(Sum('tax'), Decimal('0.00')),
+        cash_received=Coalesce(Sum('cash_received'), Decimal('0.00')),
+        outstanding=Coalesce(Sum('outstanding'), Decimal('0.00')),
+        old_gold_weight=Coalesce(Sum('old_gold_weight'), Decimal('0.000')),
+    )
+    totals['materials'] = list(
+        rows.exclude(material_type=DailySalesSummary.ALL_MATERIALS)
+        .order_by('material_type')
+        .values('material_type')
+        .annotate(
+            item_count=Sum('item_count'),
+            net_weight=Sum('net_weight'),
+            fine_gold=Sum('fine_gold'),
+            sales=Sum('sales'),
+        )
+    )
+    return totals
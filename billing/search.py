@@ -0,0 +1,241 @@
+"""
+Bill search
+
+Each bill has one search document in ``billing_bill_search`` holding its
+bill number, its customer's name and phone, and the codes, numbers and
+descriptions of its items. The table is indexed by the database itself:
+
+* SQLite: an FTS5 virtual table, matched with prefix queries and ranked
+  with bm25().
+* PostgreSQL: a weighted tsvector (bill number > customer > items) with a
+  GIN index, plus a pg_trgm index on the whole document for substring
+  matches, ranked with ts_rank() and word_similarity().
+
+Every word of the query must match, so "5570 sharma" finds Sharma's bills
+with item 5570. A Bill queryset passed as ``bills`` (e.g. the bill list's
+status and date filters) restricts the matches inside the ranked query,
+before its LIMIT, and ``offset`` pages through the ranking. Documents are rebuilt when a bill, its items or its
+customer change, once per bill when the transaction commits.
+``python manage.py rebuild_search_index`` builds the whole index.
+
+On other databases search_bills() returns None and callers fall back to
+plain ``icontains`` filters.
+
+customer_matches() serves the customer typeahead of the bill form: name or
+phone prefixes, looked up as index range scans on LOWER(name) and
+Customer.phone_digits.
+"""
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+from .models import Bill, BillItem, Customer, phone_digits
+
+SEARCH_TABLE = 'billing_bill_search'
+TOKEN_RE = re.compile(r'\w+')
+# Words of a query that are used at most
+MAX_TOKENS = 8
+# Bills indexed per round trip
+INDEX_CHUNK_SIZE = 500
+
+_local = threading.local()
+
+
+def tokens(query):
+    """Lower-cased words of a search query"""
+    return [token.lower() for token in TOKEN_RE.findall(query or '')][:MAX_TOKENS]
+
+
+def documents(bill_ids):
+    """Yield (bill_id, bill_number, customer, items) documents for bills"""
+    items = defaultdict(list)
+    item_rows = BillItem.objects.filter(bill_id__in=bill_ids).order_by('pk').values_list(
+        'bill_id', 'item_code', 'item_number', 'description'
+    )
+    for bill_id, *fields in item_rows:
+        items[bill_id].extend(field for field in fields if field)
+
+    bills = Bill.objects.filter(pk__in=bill_ids).values_list(
+        'pk', 'bill_number', 'customer__name', 'customer__phone', 'customer__phone_digits'
+    )
+    for bill_id, bill_number, name, phone, digits in bills:
+        customer = [name, phone]
+        # Match phone numbers typed with or without spaces
+        if digits != phone:
+            customer.append(digits)
+        yield bill_id, bill_number, ' '.join(filter(None, customer)), ' '.join(items[bill_id])
+
+
+class SQLiteSearch:
+    """FTS5 table keyed by rowid = bill id"""
+
+    def indexed_ids(self, cursor):
+        cursor.execute(f'SELECT rowid FROM {SEARCH_TABLE}')
+        return {row[0] for row in cursor.fetchall()}
+
+    def replace(self, cursor, bill_ids, docs):
+        placeholders = ', '.join(['%s'] * len(bill_ids))
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', list(bill_ids))
+        cursor.executemany(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, bill_number, customer, items) VALUES (%s, %s, %s, %s)',
+            docs,
+        )
+
+    def search(self, cursor, words, limit, offset=0, within=None):
+        # Quoted prefix terms, all required; words are \w+ only
+        match = ' '.join(f'"{word}"*' for word in words)
+        within_sql, within_params = within_clause('rowid', within)
+        cursor.execute(
+            f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s{within_sql} '
+            f'ORDER BY bm25({SEARCH_TABLE}, 10.0, 5.0, 1.0), rowid DESC LIMIT %s OFFSET %s',
+            [match, *within_params, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearch:
+    """Table with a weighted tsvector and a trigram-indexed document"""
+
+    def indexed_ids(self, cursor):
+        cursor.execute(f'SELECT bill_id FROM {SEARCH_TABLE}')
+        return {row[0] for row in cursor.fetchall()}
+
+    def replace(self, cursor, bill_ids, docs):
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE bill_id = ANY(%s)', [list(bill_ids)])
+        cursor.executemany(
+            f'INSERT INTO {SEARCH_TABLE} (bill_id, bill_number, customer, items) VALUES (%s, %s, %s, %s)',
+            docs,
+        )
+
+    def search(self, cursor, words, limit, offset=0, within=None):
+        # Each word matches as a prefix in the tsvector or anywhere in the
+        # document through the trigram index
+        tsquery = ' & '.join(f'{word}:*' for word in words)
+        patterns = ['%' + word.replace('_', r'\_') + '%' for word in words]
+        substring = ' AND '.join(['document ILIKE %s'] * len(patterns))
+        within_sql, within_params = within_clause('bill_id', within)
+        cursor.execute(
+            f"""
+            SELECT bill_id FROM {SEARCH_TABLE}
+            WHERE (vector @@ to_tsquery('simple'::regconfig, %s) OR ({substring})){within_sql}
+            ORDER BY ts_rank(vector, to_tsquery('simple'::regconfig, %s)) DESC,
+                     word_similarity(%s, document) DESC, bill_id DESC
+            LIMIT %s OFFSET %s
+            """,
+            [tsquery, *patterns, *within_params, tsquery, ' '.join(words), limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def within_clause(column, bills):
+    """SQL restricting search rows to the bills of a queryset, and its params"""
+    if bills is None:
+        return '', []
+    sql, params = bills.order_by().values('pk').query.sql_with_params()
+    return f' AND {column} IN ({sql})', list(params)
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearch,
+    'postgresql': PostgresSearch,
+}
+
+
+def get_backend():
+    """The search backend of the default database, or None if it has none"""
+    backend = BACKENDS.get(connection.vendor)
+    return backend() if backend else None
+
+
+def index_bills(bill_ids):
+    """Rebuild the search documents of bills; deleted bills are dropped"""
+    backend = get_backend()
+    if backend is None:
+        return 0
+    bill_ids = sorted(set(bill_ids))
+    indexed = 0
+    for start in range(0, len(bill_ids), INDEX_CHUNK_SIZE):
+        chunk = bill_ids[start:start + INDEX_CHUNK_SIZE]
+        docs = list(documents(chunk))
+        with transaction.atomic(), connection.cursor() as cursor:
+            backend.replace(cursor, chunk, docs)
+        indexed += len(docs)
+    return indexed
+
+
+def indexed_bill_ids():
+    backend = get_backend()
+    if backend is None:
+        return set()
+    with connection.cursor() as cursor:
+        return backend.indexed_ids(cursor)
+
+
+def search_bills(query, limit=None, offset=0, bills=None):
+    """Ids of the bills matching every word of a query, best match first
+
+    ``bills`` is a Bill queryset the matches are restricted to, before the
+    limit; ``offset`` skips that many matches of the ranking. Returns None
+    if the database has no search backend or the query has no words, so
+    the caller can fall back to a plain filter.
+    """
+    backend = get_backend()
+    words = tokens(query)
+    if backend is None or not words:
+        return None
+    if limit is None:
+        limit = getattr(settings, 'SEARCH_RESULT_LIMIT', 200)
+    with connection.cursor() as cursor:
+        return backend.search(cursor, words, limit, offset=offset, within=bills)
+
+
+def mark_bills_dirty(bill_ids):
+    """Rebuild the search documents of bills when the transaction commits"""
+    pending = getattr(_local, 'pending', None)
+    if pending is None:
+        pending = _local.pending = set()
+    pending.update(bill_id for bill_id in bill_ids if bill_id is not None)
+    # Registered on every call: if an earlier transaction rolled back, its
+    # callback was dropped but its bills are still pending, and the next
+    # commit handles them too
+    transaction.on_commit(flush_pending)
+
+
+def flush_pending():
+    pending = getattr(_local, 'pending', None)
+    if not pending:
+        return
+    _local.pending = set()
+    index_bills(pending)
+
+
+def prefix_filter(lookup, prefix):
+    """Q for values starting with ``prefix`` that an index can serve
+
+    LIKE 'abc%' only uses a plain index under some collations; the range
+    [prefix, prefix with its last character incremented) always can, and
+    the startswith condition keeps the result exact.
+    """
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return Q(**{f'{lookup}__gte': prefix, f'{lookup}__lt': upper, f'{lookup}__startswith': prefix})
+
+
+def customer_matches(query, limit):
+    """Customers whose name, or phone digits, start with ``query``, by name"""
+    query = ' '.join((query or '').split()).lower()
+    if not query:
+        return Customer.objects.none()
+    condition = prefix_filter('name_lower', query)
+    digits = phone_digits(query)
+    if len(digits) >= 3:
+        condition |= prefix_filter('phone_digits', digits)
+    return (
+        Customer.objects.annotate(name_lower=Lower('name'))
+        .filter(condition)
+        .order_by('name_lower', 'pk')[:limit]
+    )
@@ -0,0 +1,107 @@
+"""
+Bill number allocation
+
+Bill numbers look like ``JB20251219-007``: a prefix, the shop's local date
+and a per-day sequence number. Numbers come from a BillSequence counter row
+per day, so allocating one is a single-row update however many bills the
+day already has, and concurrent counters cannot hand out the same number.
+
+With ``BILL_NUMBER_BLOCK_SIZE`` above 1 each worker process reserves a block
+of numbers at a time and hands them out locally. That removes the counter
+row from the hot path but means numbers are no longer in creation order
+across workers, and a block's unused numbers are skipped when the worker
+restarts.
+"""
+import re
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Bill, BillSequence
+
+BILL_NUMBER_PREFIX = 'JB'
+BILL_NUMBER_RE = re.compile(r'^JB(\d{8})-(\d+)$')
+
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+def format_bill_number(day, number):
+    return f'{BILL_NUMBER_PREFIX}{day:%Y%m%d}-{number:03d}'
+
+
+def highest_existing_number(day):
+    """Highest sequence number already used by a bill on this day"""
+    highest = 0
+    prefix = f'{BILL_NUMBER_PREFIX}{day:%Y%m%d}-'
+    for bill_number in Bill.objects.filter(bill_number__startswith=prefix).values_list('bill_number', flat=True):
+        match = BILL_NUMBER_RE.match(bill_number)
+        if match:
+            highest = max(highest, int(match.group(2)))
+    return highest
+
+
+def _increment(day, count):
+    """Add ``count`` to the day's counter and return its new value
+
+    Returns None if the day has no counter row yet.
+    """
+    if connection.features.has_select_for_update:
+        sequence = BillSequence.objects.select_for_update().filter(day=day).first()
+        if sequence is None:
+            return None
+        sequence.last_number += count
+        sequence.save(update_fields=['last_number'])
+        return sequence.last_number
+    if not BillSequence.objects.filter(day=day).update(last_number=F('last_number') + count):
+        return None
+    return BillSequence.objects.filter(day=day).values_list('last_number', flat=True).get()
+
+
+def reserve_numbers(day, count=1):
+    """Atomically reserve ``count`` numbers for a day and return the first
+
+    On PostgreSQL the counter row is locked with SELECT ... FOR UPDATE;
+    on SQLite, which has no row locks, the increment is a single atomic
+    UPDATE issued first so the write lock is taken before anything is read.
+    """
+    while True:
+        with transaction.atomic():
+            last_number = _increment(day, count)
+            if last_number is None:
+                # First bill of the day: create the counter, seeded from any
+                # bills that were numbered before it existed
+                try:
+                    with transaction.atomic():
+                        last_number = highest_existing_number(day) + count
+                        BillSequence.objects.create(day=day, last_number=last_number)
+                except IntegrityError:
+                    # Another worker created the counter first
+                    continue
+        return last_number - count + 1
+
+
+def next_bill_number(day=None):
+    """Allocate the next bill number for a day (default: today)"""
+    day = day or timezone.localdate()
+    block_size = getattr(settings, 'BILL_NUMBER_BLOCK_SIZE', 1)
+
+    # Blocks can only be reserved outside a transaction: if the caller's
+    # transaction rolled back, the counter would forget the block while
+    # this process kept handing it out
+    if block_size <= 1 or connection.in_atomic_block:
+        return format_bill_number(day, reserve_numbers(day))
+
+    with _blocks_lock:
+        block = _blocks.get(day)
+        if block is None or block[0] > block[1]:
+            first = reserve_numbers(day, block_size)
+            # Blocks from previous days are no longer needed
+            _blocks.clear()
+            block = _blocks[day] = [first, first + block_size - 1]
+        number = block[0]
+        block[0] += 1
+    return format_bill_number(day, number)
@@ -0,0 +1,89 @@
+"""
+Bill assembly services
+
+Builds bill items and old gold rows from the JSON payloads posted by the
+bill create/update forms, computes their derived values in memory and writes
+them with a single INSERT per table, then runs the bill totals pass once.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+
+from .models import BillItem, OldGold
+from .rollups import add_items
+
+
+def default_item_rate(bill, material_type, silver_rate=None, bar_rate=None):
+    """Default rate per gram for an item of the given material type"""
+    if material_type == 'silver' and silver_rate:
+        return str(silver_rate.rate_per_gram)
+    if material_type == 'bar' and bar_rate:
+        return str(bar_rate.rate_per_gram)
+    return str(bill.gold_rate)
+
+
+def build_bill_items(bill, items_data, silver_rate=None, bar_rate=None):
+    """Build unsaved BillItem instances with g_fine, s_fine and amount calculated"""
+    items = []
+    for idx, item_data in enumerate(items_data):
+        material_type = item_data.get('material_type', 'gold')
+        default_rate = default_item_rate(bill, material_type, silver_rate, bar_rate)
+        item = BillItem(
+            bill=bill,
+            item_type=item_data.get('item_type', 'S'),
+            material_type=material_type,
+            description=item_data.get('description', ''),
+            item_code=item_data.get('item_code', ''),
+            item_number=item_data.get('item_number', ''),
+            net_weight=Decimal(item_data.get('net_weight', '0')),
+            tunch_wstg=Decimal(item_data.get('tunch_wstg', '91.60')),
+            labour=Decimal(item_data.get('labour', '0')),
+            rate=Decimal(item_data.get('rate', default_rate)),
+            order=idx
+        )
+        item.calculate_fines()
+        item.calculate_amount()
+        items.append(item)
+    return items
+
+
+def build_old_gold(bill, old_gold_data):
+    """Build unsaved OldGold instances with their value calculated"""
+    old_gold = []
+    for og_data in old_gold_data:
+        og = OldGold(
+            bill=bill,
+            weight=Decimal(og_data.get('weight', '0')),
+            rate_per_gram=Decimal(og_data.get('rate_per_gram', str(bill.gold_rate))),
+            description=og_data.get('description', '')
+        )
+        og.value = og.weight * og.rate_per_gram
+        old_gold.append(og)
+    return old_gold
+
+
+@transaction.atomic
+def assemble_bill(bill, items_data, old_gold_data, silver_rate=None, bar_rate=None, replace=False):
+    """Write a bill's items and old gold in one pass and recalculate its totals once
+
+    The bill must already be saved. With ``replace=True`` any existing items
+    and old gold rows are removed first (used when editing a bill).
+    Bulk inserts bypass ``BillItem.save``/``OldGold.save`` and their signals,
+    so the totals are computed here from the in-memory rows instead, and the
+    items are added to the sales rollup here.
+    Returns the created items.
+    """
+    if replace:
+        bill.items.all().delete()
+        bill.old_gold_exchanges.all().delete()
+
+    items = BillItem.objects.bulk_create(
+        build_bill_items(bill, items_data, silver_rate, bar_rate)
+    )
+    old_gold = OldGold.objects.bulk_create(build_old_gold(bill, old_gold_data))
+    add_items([item.pk for item in items])
+
+    bill.old_gold_weight = sum((og.weight for og in old_gold), Decimal('0.000'))
+    bill.old_gold_value = sum((og.value for og in old_gold), Decimal('0.00'))
+    bill.calculate_totals(items=items)
+    return items
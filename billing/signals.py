@@ -1,36 +1,271 @@
 """
 Signals for auto-calculations and model updates
 """
-from django.db.models.signals import post_save, pre_save
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
-from .models import Bill, BillItem, OldGold, Payment
+from .models import Customer, Bill, BillItem, OldGold, Payment, GoldRate, SilverRate, BarRate
+from .pdfs import mark_bills_stale
+from .rates import invalidate_rate_board
+from .recalc import current_batch, signals_suppressed
+from .rollups import BILL_FIELDS, bill_changed, bill_deleted, bill_key, item_changed, item_figures, stored_bill, stored_item
+from .search import mark_bills_dirty
+from .snapshots import mark_bills_changed
+
+
+# Sales rollup (billing/rollups.py). The item receivers are connected before
+# the bill totals receivers below: an item's change is applied to the row of
+# its bill's current status before a new total can move the bill, and with
+# it the bill's items, to another status.
+
+@receiver(pre_save, sender=BillItem)
+def load_item_sales_figures(sender, instance, raw=False, **kwargs):
+    """Read what an item adds to the sales rollup before it is saved"""
+    if raw:
+        return
+    instance._sales_figures_before = stored_item(instance.pk) if instance.pk else None
 
 
 @receiver(post_save, sender=BillItem)
-def update_bill_on_item_save(sender, instance, **kwargs):
-    """Recalculate bill totals when item is saved"""
-    if instance.bill:
-        instance.bill.calculate_totals()
+def update_sales_summary_on_item_save(sender, instance, raw=False, **kwargs):
+    """Apply the item's old-vs-new difference to the sales rollup"""
+    if raw:
+        return
+    item_changed(instance.__dict__.pop('_sales_figures_before', None), stored_item(instance.pk))
+
+
+@receiver(post_delete, sender=BillItem)
+def update_sales_summary_on_item_delete(sender, instance, origin=None, **kwargs):
+    """Take a deleted item out of the sales rollup
+
+    Items deleted with their bill or customer are taken out by
+    remove_bill_from_sales_summary.
+    """
+    if not (origin is instance or (isinstance(origin, QuerySet) and origin.model is BillItem)):
+        return
+    key = bill_key(instance.bill_id)
+    if key is not None:
+        day, status = key
+        item_changed(((day, instance.material_type, status), item_figures(instance)), None)
+
 
+def apply_contribution_change(instance, old, new):
+    """Apply the change in a row's contribution to its bill(s) totals
 
+    ``old`` and ``new`` are (bill_id, contribution) pairs, either may be None.
+    Inside deferred_recalc() the change is recorded on the batch instead.
+    """
+    deltas = {}
+    if old and new and old[0] == new[0]:
+        deltas[new[0]] = {
+            total: new[1][total] - old[1].get(total, 0) for total in new[1]
+        }
+    else:
+        if old:
+            deltas[old[0]] = {total: -value for total, value in old[1].items()}
+        if new:
+            deltas[new[0]] = new[1]
+
+    batch = current_batch()
+    recalculated = set()
+    for bill_id, bill_deltas in deltas.items():
+        if batch is not None:
+            batch.add_deltas(bill_id, bill_deltas)
+            continue
+        bill = Bill.apply_totals_delta(bill_id, **bill_deltas)
+        if bill is not None:
+            recalculated.add(bill_id)
+        # Keep the row's cached bill in step with the stored totals
+        if bill is not None and instance.bill_id == bill_id:
+            instance.bill = bill
+    # Saving these bills queued their refreeze already (refreeze_on_change)
+    instance._recalculated_bill_ids = recalculated
+
+
+@receiver(pre_save, sender=BillItem)
+@receiver(pre_save, sender=OldGold)
+@receiver(pre_save, sender=Payment)
+def load_previous_contribution(sender, instance, raw=False, **kwargs):
+    """Fetch the stored values of a row that was not loaded in full"""
+    if raw or signals_suppressed() or not instance.pk or instance.loaded_bill_contribution() is not None:
+        return
+    stored = sender.objects.filter(pk=instance.pk).values('bill_id', *sender.bill_totals).first()
+    if stored:
+        previous = sender(**stored)
+        instance._loaded_bill_id = stored['bill_id']
+        instance._loaded_contribution = previous.bill_contribution()
+
+
+@receiver(post_save, sender=BillItem)
 @receiver(post_save, sender=OldGold)
-def update_bill_on_old_gold_save(sender, instance, **kwargs):
-    """Recalculate bill totals when old gold is saved"""
-    if instance.bill:
-        # Update bill old gold totals
-        total_old_gold = sum(og.weight for og in instance.bill.old_gold_exchanges.all())
-        total_old_gold_value = sum(og.value for og in instance.bill.old_gold_exchanges.all())
-        instance.bill.old_gold_weight = total_old_gold
-        instance.bill.old_gold_value = total_old_gold_value
-        instance.bill.calculate_totals()
+@receiver(post_save, sender=Payment)
+def update_bill_on_row_save(sender, instance, created, raw=False, **kwargs):
+    """Apply the saved row's old-vs-new difference to the bill totals"""
+    if raw or signals_suppressed():
+        return
+    old = None if created else instance.loaded_bill_contribution()
+    apply_contribution_change(instance, old, (instance.bill_id, instance.bill_contribution()))
+    instance.remember_bill_contribution()
+
+
+@receiver(post_delete, sender=BillItem)
+@receiver(post_delete, sender=OldGold)
+@receiver(post_delete, sender=Payment)
+def update_bill_on_row_delete(sender, instance, origin=None, **kwargs):
+    """Remove a deleted row's contribution from the bill totals
+
+    Only direct deletes of the row are applied: cascades from the bill or
+    customer need no adjustment, and queryset (bulk) deletes, like
+    bulk_create, leave recalculation to the caller.
+    """
+    if origin is not instance or signals_suppressed():
+        return
+    old = instance.loaded_bill_contribution() or (instance.bill_id, instance.bill_contribution())
+    apply_contribution_change(instance, old, None)
+
+
+@receiver(post_save, sender=GoldRate)
+@receiver(post_save, sender=SilverRate)
+@receiver(post_save, sender=BarRate)
+@receiver(post_delete, sender=GoldRate)
+@receiver(post_delete, sender=SilverRate)
+@receiver(post_delete, sender=BarRate)
+def invalidate_rates_on_change(sender, **kwargs):
+    """Reload the cached rate board once the rate change is committed"""
+    transaction.on_commit(invalidate_rate_board)
+
+
+@receiver(pre_save, sender=Bill)
+def load_bill_sales_figures(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Read what a bill adds to the sales rollup before it is saved"""
+    # Totals just added by the F() update in Bill.apply_totals_delta, which
+    # sends no signals: the stored values before that update are wanted
+    applied = instance.__dict__.pop('_applied_deltas', {})
+    if raw or (update_fields is not None and not set(update_fields) & set(BILL_FIELDS)):
+        return
+    before = stored_bill(instance.pk) if instance.pk else None
+    if before is not None:
+        for field in set(applied) & set(BILL_FIELDS):
+            before[field] -= applied[field]
+    instance._sales_figures_before = before
+
+
+@receiver(post_save, sender=Bill)
+def update_sales_summary_on_bill_save(sender, instance, raw=False, **kwargs):
+    """Apply the bill's old-vs-new difference to the sales rollup
+
+    Item, old gold and payment changes that move the totals reach here too,
+    through the bill save in Bill.apply_totals_delta.
+    """
+    if raw or '_sales_figures_before' not in instance.__dict__:
+        return
+    bill_changed(instance.pk, instance.__dict__.pop('_sales_figures_before'), stored_bill(instance.pk))
+
+
+@receiver(pre_delete, sender=Bill)
+def remove_bill_from_sales_summary(sender, instance, **kwargs):
+    """Take a bill and its items out of the sales rollup before they are deleted"""
+    bill_deleted(instance.pk)
 
 
+# Fields that appear in the search documents of bills (billing/search.py)
+SEARCH_FIELDS = {
+    Bill: {'bill_number', 'customer'},
+    BillItem: {'bill', 'item_code', 'item_number', 'description'},
+    Customer: {'name', 'phone'},
+}
+
+
+def touches_search(sender, update_fields):
+    return update_fields is None or bool(SEARCH_FIELDS[sender] & set(update_fields))
+
+
+@receiver(post_save, sender=Bill)
+@receiver(post_delete, sender=Bill)
+def update_search_on_bill_change(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Reindex (or drop) the bill's search document after commit"""
+    if raw or not touches_search(sender, update_fields):
+        return
+    mark_bills_dirty([instance.pk])
+
+
+@receiver(post_save, sender=BillItem)
+@receiver(post_delete, sender=BillItem)
+def update_search_on_item_change(sender, instance, raw=False, update_fields=None, origin=None, **kwargs):
+    """Reindex the item's bill after commit
+
+    Items added with bulk_create reach the index through the bill save that
+    follows in assemble_bill.
+    """
+    if raw or isinstance(origin, Bill) or not touches_search(sender, update_fields):
+        return
+    mark_bills_dirty([instance.bill_id])
+
+
+@receiver(post_save, sender=Customer)
+def update_search_on_customer_change(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """Reindex a renamed customer's bills after commit"""
+    if raw or created or not touches_search(sender, update_fields):
+        return
+    mark_bills_dirty(instance.bills.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Bill)
+@receiver(post_delete, sender=Bill)
+def drop_cached_pdf_on_bill_change(sender, instance, raw=False, **kwargs):
+    """Remove the bill's cached PDFs after commit (billing/pdfs.py)"""
+    if raw:
+        return
+    mark_bills_stale([instance.pk])
+
+
+@receiver(post_save, sender=BillItem)
+@receiver(post_save, sender=OldGold)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=BillItem)
+@receiver(post_delete, sender=OldGold)
+@receiver(post_delete, sender=Payment)
+def drop_cached_pdf_on_row_change(sender, instance, raw=False, origin=None, **kwargs):
+    """Remove the cached PDFs of the row's bill, even if its totals stay put"""
+    if raw or isinstance(origin, Bill):
+        return
+    mark_bills_stale([instance.bill_id])
+
+
+@receiver(post_save, sender=Customer)
+def drop_cached_pdf_on_customer_change(sender, instance, created, raw=False, **kwargs):
+    """Remove the cached PDFs of a customer's bills, which print their details"""
+    if raw or created:
+        return
+    mark_bills_stale(instance.bills.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Bill)
+@receiver(post_save, sender=BillItem)
+@receiver(post_save, sender=OldGold)
 @receiver(post_save, sender=Payment)
-def update_bill_on_payment_save(sender, instance, **kwargs):
-    """Recalculate bill totals when payment is saved"""
-    if instance.bill:
-        # Update bill cash received
-        total_payments = sum(p.amount for p in instance.bill.payments.all())
-        instance.bill.cash_received = total_payments
-        instance.bill.calculate_totals()
+@receiver(post_delete, sender=BillItem)
+@receiver(post_delete, sender=OldGold)
+@receiver(post_delete, sender=Payment)
+def refreeze_on_change(sender, instance, raw=False, origin=None, **kwargs):
+    """Retake the snapshot of a changed bill after commit (billing/snapshots.py)
+
+    A row change that was applied to its bill's totals saved the bill,
+    which queued the refreeze with the new totals: queueing it again here
+    would freeze the bill a second time outside a transaction.
+    """
+    if raw or isinstance(origin, Bill):
+        return
+    if sender is Bill:
+        mark_bills_changed([instance.pk])
+    elif instance.bill_id not in instance.__dict__.pop('_recalculated_bill_ids', ()):
+        mark_bills_changed([instance.bill_id])
+
 
+@receiver(post_save, sender=Customer)
+def refreeze_on_customer_change(sender, instance, created, raw=False, **kwargs):
+    """Retake the snapshots of a customer's paid bills, which print their name"""
+    if raw or created:
+        return
+    mark_bills_changed(instance.bills.filter(snapshot__isnull=False).values_list('pk', flat=True))
@@ -0,0 +1,151 @@
+"""
+Frozen snapshots of paid bills
+
+A paid bill is almost never edited again, yet its detail, print and PDF
+pages were built from the live item, old gold and payment rows on every
+view. Once a bill is paid it is frozen into a BillSnapshot row holding
+those pages already rendered:
+
+* ``print_html``: bill_print_sheet.html, which bill_print puts in its page.
+* ``detail_html`` and ``payments_html``: the bill card and payment history
+  of the detail page (bill_detail_sheet.html and bill_detail_payments.html),
+  totals included, which BillDetailView puts in its page.
+* ``pdf_html``: bill_pdf.html, which bill_pdf() hands to WeasyPrint when
+  the bill's PDF is not cached yet (for the PDF and email jobs and the
+  PDF archives).
+
+All are zlib-compressed. Viewing a frozen bill reads the bill and its
+snapshot in one query and renders none of its rows.
+
+Any change to a bill, its rows or its customer deletes the snapshot when the
+transaction commits and, if the bill is still paid, takes a new one (see
+the receivers in billing/signals.py). A snapshot taken at another
+``updated_at`` or template version is never served, and
+``python manage.py freeze_bills`` takes the missing ones.
+"""
+import hashlib
+import threading
+import zlib
+from functools import lru_cache
+
+from django.db import transaction
+from django.template.loader import get_template, render_to_string
+
+from . import pdfs
+from .grouping import items_by_type
+from .jinja2 import render_bill, template_digest
+from .models import Bill, BillSnapshot
+
+SHEET_TEMPLATE = 'billing/bill_print_sheet.html'
+DETAIL_TEMPLATE = 'billing/bill_detail_sheet.html'
+PAYMENTS_TEMPLATE = 'billing/bill_detail_payments.html'
+# Bump to retire every snapshot after a change to what they contain
+SNAPSHOT_VERSION = 2
+
+_local = threading.local()
+
+
+@lru_cache(maxsize=None)
+def template_version():
+    """Digest of the snapshot templates, computed once per process"""
+    sources = ':'.join(get_template(name).template.source for name in (DETAIL_TEMPLATE, PAYMENTS_TEMPLATE))
+    key = f'{SNAPSHOT_VERSION}:{template_digest(SHEET_TEMPLATE)}:{pdfs.template_version()}:{sources}'
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def render_detail(bill, items, old_gold_exchanges, payments):
+    """The bill card and payment history of a bill's detail page"""
+    sheet = render_to_string(DETAIL_TEMPLATE, {'bill': bill, 'items': items, 'old_gold_exchanges': old_gold_exchanges})
+    payment_history = render_to_string(PAYMENTS_TEMPLATE, {'payments': payments})
+    return sheet, payment_history
+
+
+def freeze(bill):
+    """Take (or retake) the snapshot of a bill"""
+    bill = (
+        Bill.objects.select_related('customer')
+        .prefetch_related('items', 'old_gold_exchanges', 'payments')
+        .get(pk=bill.pk)
+    )
+    items = bill.items.all()
+    sheet, payment_history = render_detail(bill, items, bill.old_gold_exchanges.all(), bill.payments.all())
+    pages = {
+        'print_html': render_bill(SHEET_TEMPLATE, {'bill': bill, 'items_by_type': items_by_type(bill, items)}),
+        'pdf_html': pdfs.bill_html(bill, items),
+        'detail_html': sheet,
+        'payments_html': payment_history,
+    }
+    snapshot, _ = BillSnapshot.objects.update_or_create(bill=bill, defaults={
+        'bill_updated_at': bill.updated_at,
+        'version': template_version(),
+        **{field: zlib.compress(html.encode()) for field, html in pages.items()},
+    })
+    return snapshot
+
+
+def current_snapshot(bill):
+    """The bill's snapshot if it still matches the bill, else None
+
+    Select the bill with ``select_related('snapshot')`` to avoid a query.
+    """
+    try:
+        snapshot = bill.snapshot
+    except BillSnapshot.DoesNotExist:
+        return None
+    if bill.status != 'paid' or snapshot.bill_updated_at != bill.updated_at or snapshot.version != template_version():
+        return None
+    return snapshot
+
+
+def print_html(snapshot):
+    return zlib.decompress(snapshot.print_html).decode()
+
+
+def detail_html(snapshot):
+    return zlib.decompress(snapshot.detail_html).decode()
+
+
+def payments_html(snapshot):
+    return zlib.decompress(snapshot.payments_html).decode()
+
+
+def pdf_html(snapshot):
+    return zlib.decompress(snapshot.pdf_html).decode()
+
+
+def bill_pdf(bill_id):
+    """A bill and its PDF bytes; a paid bill's PDF is rendered from its snapshot"""
+    bill = Bill.objects.select_related('customer', 'snapshot').get(pk=bill_id)
+    snapshot = current_snapshot(bill)
+    return bill, pdfs.get_bill_pdf(bill, html=pdf_html(snapshot) if snapshot is not None else None)
+
+
+def freeze_bills(bill_ids):
+    """Drop the snapshots of bills and take new ones of those that are paid"""
+    bill_ids = list(bill_ids)
+    BillSnapshot.objects.filter(bill_id__in=bill_ids).delete()
+    count = 0
+    for bill in Bill.objects.filter(pk__in=bill_ids, status='paid').only('pk'):
+        freeze(bill)
+        count += 1
+    return count
+
+
+def mark_bills_changed(bill_ids):
+    """Refreeze bills when the transaction commits"""
+    pending = getattr(_local, 'pending', None)
+    if pending is None:
+        pending = _local.pending = set()
+    pending.update(bill_id for bill_id in bill_ids if bill_id is not None)
+    # Registered on every call: if an earlier transaction rolled back, its
+    # callback was dropped but its bills are still pending, and the next
+    # commit handles them too
+    transaction.on_commit(flush_pending)
+
+
+def flush_pending():
+    pending = getattr(_local, 'pending', None)
+    if not pending:
+        return
+    _local.pending = set()
+    freeze_bills(pending)
@@ -30,11 +30,20 @@ urlpatterns = [
     path('bills/<int:pk>/delete/', views.bill_delete, name='bill_delete'),
     path('bills/<int:pk>/print/', views.bill_print, name='bill_print'),
     path('bills/<int:pk>/pdf/', views.bill_pdf, name='bill_pdf'),
+    path('bills/<int:pk>/receipt/', views.bill_receipt, name='bill_receipt'),
     path('bills/<int:pk>/email/', views.bill_email, name='bill_email'),
     path('bills/<int:bill_id>/payment/', views.add_payment, name='add_payment'),
     
     # Reports
     path('reports/', views.ReportsView.as_view(), name='reports'),
+    path('reports/export/', views.reports_export, name='reports_export'),
+    path('reports/export/pdfs/', views.reports_export_pdfs, name='reports_export_pdfs'),
     path('api/create-customer/', views.create_customer_ajax, name='create_customer_ajax'),
+    path('api/customers/', views.customer_search, name='customer_search'),
+    
+    # Background jobs
+    path('api/jobs/<int:pk>/', views.job_status, name='job_status'),
+    path('jobs/failed/', views.FailedJobListView.as_view(), name='job_failed_list'),
+    path('jobs/<int:pk>/retry/', views.job_retry, name='job_retry'),
 ]
 
@@ -1,30 +1,37 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib import messages
 from django.contrib.auth import login, logout
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView
-from django.urls import reverse_lazy
-from django.http import JsonResponse, HttpResponse
+from django.urls import reverse, reverse_lazy
+from django.http import FileResponse, Http404, JsonResponse, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.db.models import Sum, Q, Count
 from django.utils import timezone
-from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
+from django.utils.decorators import method_decorator
+from django.utils.safestring import mark_safe
+from django.utils.dateparse import parse_date
 from django.conf import settings
 from datetime import datetime, timedelta
 from decimal import Decimal
 import json
 
-from .models import Customer, Bill, BillItem, OldGold, Payment, GoldRate, SilverRate, BarRate
+from .models import Customer, Bill, BillItem, OldGold, Payment, GoldRate, SilverRate, BarRate, Job
 from .forms import (
     LoginForm, CustomerForm, GoldRateForm, SilverRateForm, BarRateForm, BillForm, 
-    BillItemForm, OldGoldForm, PaymentForm, BillSearchForm
+    BillItemForm, OldGoldForm, PaymentForm, BillSearchForm, customer_label
 )
-try:
-    from weasyprint import HTML
-    WEASYPRINT_AVAILABLE = True
-except (ImportError, OSError):
-    WEASYPRINT_AVAILABLE = False
-    HTML = None  # Define HTML as None when not available
+from . import escpos, exports, jobs, pdf_archive, snapshots
+from .grouping import items_by_type
+from .jinja2 import render_bill
+from .pagination import CursorPaginationMixin, InvalidCursor, RankedPaginator
+from .pdfs import WEASYPRINT_AVAILABLE, cached_bill_pdf
+from .rates import get_rate_board, invalidate_rate_board
+from .readonly import read_only_view
+from .rollups import summarize
+from .search import customer_matches, search_bills
+from .services import assemble_bill
 
 
 class LoginView(TemplateView):
@@ -60,28 +67,29 @@ class DashboardView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Get current gold rate
-        gold_rate = GoldRate.get_current_rate()
-        context['gold_rate'] = gold_rate
-        # Get current silver rate
-        silver_rate = SilverRate.get_current_rate()
-        context['silver_rate'] = silver_rate
-        # Get current bar rate
-        bar_rate = BarRate.get_current_rate()
-        context['bar_rate'] = bar_rate
+        # Current gold, silver and bar rates
+        context.update(get_rate_board().as_context())
         
-        # Today's date
-        today = timezone.now().date()
+        # All of today's, yesterday's and outstanding figures in one
+        # conditional aggregation query
+        today = timezone.localdate()
+        yesterday = today - timedelta(days=1)
+        today_bills = Q(business_date=today)
+        yesterday_bills = Q(business_date=yesterday)
+        outstanding_bills = Q(status__in=['unpaid', 'partial'])
+        stats = Bill.objects.filter(today_bills | yesterday_bills | outstanding_bills).aggregate(
+            today_total_sales=Sum('net_payable', filter=today_bills),
+            today_cash_received=Sum('cash_received', filter=today_bills),
+            # Bill.old_gold_weight is the total of the bill's old gold rows
+            today_gold_received=Sum('old_gold_weight', filter=today_bills),
+            outstanding_balance=Sum('balance', filter=outstanding_bills),
+            outstanding_count=Count('pk', filter=outstanding_bills),
+            yesterday_sales=Sum('net_payable', filter=yesterday_bills),
+        )
         
         # Today's statistics
-        today_bills = Bill.objects.filter(bill_date__date=today)
-        context['today_total_sales'] = today_bills.aggregate(
-            total=Sum('net_payable')
-        )['total'] or Decimal('0.00')
-        
-        context['today_cash_received'] = today_bills.aggregate(
-            total=Sum('cash_received')
-        )['total'] or Decimal('0.00')
+        context['today_total_sales'] = stats['today_total_sales'] or Decimal('0.00')
+        context['today_cash_received'] = stats['today_cash_received'] or Decimal('0.00')
         
         # Calculate cash received percentage
         if context['today_total_sales'] > 0:
@@ -93,32 +101,17 @@ class DashboardView(LoginRequiredMixin, TemplateView):
             context['cash_received_percentage'] = 0
         
         # Old gold received today
-        today_old_gold = OldGold.objects.filter(
-            bill__bill_date__date=today
-        ).aggregate(
-            total=Sum('weight')
-        )['total'] or Decimal('0.000')
-        context['today_gold_received'] = today_old_gold
+        context['today_gold_received'] = stats['today_gold_received'] or Decimal('0.000')
         
         # Outstanding balance
-        outstanding_bills = Bill.objects.filter(
-            status__in=['unpaid', 'partial']
-        )
-        context['outstanding_balance'] = outstanding_bills.aggregate(
-            total=Sum('balance')
-        )['total'] or Decimal('0.00')
-        context['outstanding_count'] = outstanding_bills.count()
+        context['outstanding_balance'] = stats['outstanding_balance'] or Decimal('0.00')
+        context['outstanding_count'] = stats['outstanding_count']
         
         # Recent bills
-        context['recent_bills'] = Bill.objects.all()[:10]
+        context['recent_bills'] = Bill.objects.select_related('customer')[:10]
         
         # Yesterday comparison
-        yesterday = today - timedelta(days=1)
-        yesterday_bills = Bill.objects.filter(bill_date__date=yesterday)
-        yesterday_sales = yesterday_bills.aggregate(
-            total=Sum('net_payable')
-        )['total'] or Decimal('0.00')
-        
+        yesterday_sales = stats['yesterday_sales'] or Decimal('0.00')
         if yesterday_sales > 0:
             growth = ((context['today_total_sales'] - yesterday_sales) / yesterday_sales) * 100
             context['sales_growth'] = round(growth, 1)
@@ -128,7 +121,7 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         return context
 
 
-class CustomerListView(LoginRequiredMixin, ListView):
+class CustomerListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
     """Customer list view"""
     model = Customer
     template_name = 'billing/customer_list.html'
@@ -180,6 +173,7 @@ def update_gold_rate(request):
                     updated_by=request.user,
                     is_active=True
                 )
+                invalidate_rate_board()
                 return JsonResponse({'success': True, 'rate': str(gold_rate.rate_24k)})
             except (ValueError, TypeError):
                 return JsonResponse({'success': False, 'error': 'Invalid rate value'})
@@ -209,6 +203,7 @@ def update_silver_rate(request):
                     updated_by=request.user,
                     is_active=True
                 )
+                invalidate_rate_board()
                 return JsonResponse({'success': True, 'rate': str(silver_rate.rate_per_gram)})
             except (ValueError, TypeError):
                 return JsonResponse({'success': False, 'error': 'Invalid rate value'})
@@ -238,6 +233,7 @@ def update_bar_rate(request):
                     updated_by=request.user,
                     is_active=True
                 )
+                invalidate_rate_board()
                 return JsonResponse({'success': True, 'rate': str(bar_rate.rate_per_gram)})
             except (ValueError, TypeError):
                 return JsonResponse({'success': False, 'error': 'Invalid rate value'})
@@ -246,12 +242,13 @@ def update_bar_rate(request):
     return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
 
-class BillListView(LoginRequiredMixin, ListView):
+class BillListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
     """Bill list view"""
     model = Bill
     template_name = 'billing/bill_list.html'
     context_object_name = 'bills'
     paginate_by = 20
+    search_ranking = None
 
     def get_queryset(self):
         queryset = Bill.objects.select_related('customer').all()
@@ -263,23 +260,50 @@ class BillListView(LoginRequiredMixin, ListView):
             date_from = form.cleaned_data.get('date_from')
             date_to = form.cleaned_data.get('date_to')
             
-            if search:
-                queryset = queryset.filter(
-                    Q(bill_number__icontains=search) |
-                    Q(customer__name__icontains=search)
-                )
-            
             if status:
                 queryset = queryset.filter(status=status)
             
             if date_from:
-                queryset = queryset.filter(bill_date__date__gte=date_from)
+                queryset = queryset.filter(business_date__gte=date_from)
             
             if date_to:
-                queryset = queryset.filter(bill_date__date__lte=date_to)
+                queryset = queryset.filter(business_date__lt=date_to + timedelta(days=1))
+            
+            if search:
+                # One page of the ranking of the bills the filters above
+                # leave, read past the page to know if there is a next one
+                self.search_paginator = RankedPaginator(self.paginate_by)
+                try:
+                    self.search_page = self.search_paginator.number(self.request.GET.get(self.cursor_param))
+                except InvalidCursor:
+                    raise Http404('Invalid page cursor')
+                self.search_ranking = search_bills(
+                    search,
+                    limit=self.paginate_by + 1,
+                    offset=self.search_paginator.offset(self.search_page),
+                    bills=queryset,
+                )
+                if self.search_ranking is not None:
+                    queryset = queryset.filter(pk__in=self.search_ranking)
+                else:
+                    queryset = queryset.filter(
+                        Q(bill_number__icontains=search) |
+                        Q(customer__name__icontains=search)
+                    )
         
         return queryset
 
+    def paginate_queryset(self, queryset, page_size):
+        if self.search_ranking is None:
+            return super().paginate_queryset(queryset, page_size)
+        # Search results are paged through the ranking, best match first
+        position = {pk: idx for idx, pk in enumerate(self.search_ranking)}
+        bills = sorted(queryset, key=lambda bill: position[bill.pk])
+        page = self.search_paginator.page(bills, self.search_page)
+        page.next_url = self.cursor_url(page.next_cursor())
+        page.previous_url = self.cursor_url(page.previous_cursor())
+        return self.search_paginator, page, page.object_list, page.has_other_pages()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['search_form'] = BillSearchForm(self.request.GET)
@@ -289,9 +313,9 @@ class BillListView(LoginRequiredMixin, ListView):
 @login_required
 def bill_create(request):
     """Create bill view"""
-    gold_rate = GoldRate.get_current_rate()
-    silver_rate = SilverRate.get_current_rate()
-    bar_rate = BarRate.get_current_rate()
+    # The rates saved into a bill must not lag behind another worker's update
+    rates = get_rate_board(fresh=request.method == 'POST')
+    gold_rate, silver_rate, bar_rate = rates.gold, rates.silver, rates.bar
     
     if request.method == 'POST':
         bill_form = BillForm(request.POST)
@@ -299,53 +323,15 @@ def bill_create(request):
         if bill_form.is_valid():
             bill = bill_form.save(commit=False)
             bill.created_by = request.user
+            bill.counter_cash = bill.cash_received
             if gold_rate:
                 bill.gold_rate = gold_rate.rate_24k
             bill.save()
             
-            # Handle bill items
+            # Write items and old gold in one pass and recalculate totals once
             items_data = json.loads(request.POST.get('items', '[]'))
-            for idx, item_data in enumerate(items_data):
-                # Determine default rate based on material type
-                material_type = item_data.get('material_type', 'gold')
-                default_rate = str(bill.gold_rate)
-                if material_type == 'silver' and silver_rate:
-                    default_rate = str(silver_rate.rate_per_gram)
-                elif material_type == 'bar' and bar_rate:
-                    default_rate = str(bar_rate.rate_per_gram)
-                
-                BillItem.objects.create(
-                    bill=bill,
-                    item_type=item_data.get('item_type', 'S'),
-                    material_type=material_type,
-                    description=item_data.get('description', ''),
-                    item_code=item_data.get('item_code', ''),
-                    item_number=item_data.get('item_number', ''),
-                    net_weight=Decimal(item_data.get('net_weight', '0')),
-                    tunch_wstg=Decimal(item_data.get('tunch_wstg', '91.60')),
-                    labour=Decimal(item_data.get('labour', '0')),
-                    rate=Decimal(item_data.get('rate', default_rate)),
-                    order=idx
-                )
-            
-            # Handle old gold
             old_gold_data = json.loads(request.POST.get('old_gold', '[]'))
-            for og_data in old_gold_data:
-                OldGold.objects.create(
-                    bill=bill,
-                    weight=Decimal(og_data.get('weight', '0')),
-                    rate_per_gram=Decimal(og_data.get('rate_per_gram', str(bill.gold_rate))),
-                    description=og_data.get('description', '')
-                )
-            
-            # Recalculate totals after items and old gold are saved
-            bill.calculate_totals()
-            
-            # If payments exist, cash_received should be sum of payments, not form value
-            if bill.payments.exists():
-                total_payments = sum(p.amount for p in bill.payments.all())
-                bill.cash_received = total_payments
-                bill.calculate_totals()
+            assemble_bill(bill, items_data, old_gold_data, silver_rate=silver_rate, bar_rate=bar_rate)
             
             # Validate cash received doesn't exceed net payable
             if bill.cash_received > bill.net_payable:
@@ -358,10 +344,8 @@ def bill_create(request):
                     'gold_rate': gold_rate,
                     'silver_rate': silver_rate,
                     'bar_rate': bar_rate,
-                    'customers': Customer.objects.all(),
                 })
             
-            bill.save()  # Save again with updated totals
             return redirect('bill_detail', pk=bill.pk)
     else:
         bill_form = BillForm()
@@ -371,121 +355,76 @@ def bill_create(request):
         'gold_rate': gold_rate,
         'silver_rate': silver_rate,
         'bar_rate': bar_rate,
-        'customers': Customer.objects.all(),
     }
     return render(request, 'billing/bill_create.html', context)
 
 
+@method_decorator(read_only_view, name='get')
 class BillDetailView(LoginRequiredMixin, DetailView):
     """Bill detail view"""
     model = Bill
     template_name = 'billing/bill_detail.html'
     context_object_name = 'bill'
 
+    def get_queryset(self):
+        return Bill.objects.select_related('customer', 'snapshot')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['payment_form'] = PaymentForm()
         
-        # Recalculate any items that might have missing calculations
-        for item in self.object.items.all():
-            if (item.g_fine == 0 or item.s_fine == 0) and item.net_weight > 0 and item.tunch_wstg > 0:
-                item.calculate_fines()
-                item.calculate_amount()
-                item.save(update_fields=['g_fine', 's_fine', 'amount'])
-            if item.rate == 0 and self.object.gold_rate > 0:
-                item.rate = self.object.gold_rate
-                item.calculate_amount()
-                item.save(update_fields=['rate', 'amount'])
-        
-        # Calculate subtotals by type for print view
-        items_by_type = {}
-        for item in self.object.items.all():
-            if item.item_type not in items_by_type:
-                items_by_type[item.item_type] = {'items': [], 'total_weight': Decimal('0.000'), 'total_gfine': Decimal('0.000')}
-            items_by_type[item.item_type]['items'].append(item)
-            items_by_type[item.item_type]['total_weight'] += item.net_weight
-            items_by_type[item.item_type]['total_gfine'] += item.g_fine
-        
-        context['items_by_type'] = items_by_type
+        snapshot = snapshots.current_snapshot(self.object)
+        if snapshot is not None:
+            # Paid bill: the bill card and payments come rendered from the snapshot
+            sheet = snapshots.detail_html(snapshot)
+            payment_history = snapshots.payments_html(snapshot)
+        else:
+            sheet, payment_history = snapshots.render_detail(
+                self.object,
+                self.object.items.all(),
+                self.object.old_gold_exchanges.all(),
+                self.object.payments.all(),
+            )
+        context['sheet'] = mark_safe(sheet)
+        context['payment_history'] = mark_safe(payment_history)
+        # Latest PDF and email jobs, polled by the page until they finish
+        context['jobs'] = self.object.jobs.all()[:5]
         return context
 
 
 @login_required
+@read_only_view
 def bill_update(request, pk):
     """Update bill view"""
     bill = get_object_or_404(Bill, pk=pk)
+    rates = get_rate_board(fresh=request.method == 'POST')
     
     if request.method == 'POST':
+        # Cash received as maintained by the payments recorded against the bill
+        stored_cash_received = bill.cash_received
         bill_form = BillForm(request.POST, instance=bill)
         
         if bill_form.is_valid():
             # Save form but don't update cash_received if payments exist
             bill = bill_form.save(commit=False)
             
-            # Store original cash_received if payments exist
-            has_payments = bill.payments.exists()
-            if has_payments:
+            if bill.payments.exists():
                 # Don't update cash_received from form if payments exist
-                original_cash_received = sum(p.amount for p in bill.payments.all())
+                bill.cash_received = stored_cash_received
             else:
                 # Use cash_received from form if no payments
-                original_cash_received = bill_form.cleaned_data.get('cash_received', Decimal('0.00'))
+                bill.counter_cash = bill.cash_received = bill_form.cleaned_data.get('cash_received', Decimal('0.00'))
             
-            bill.save()
-            
-            # Update items
+            # Replace items and old gold in one pass; this also recalculates
+            # balance and status and saves the bill
             items_data = json.loads(request.POST.get('items', '[]'))
-            # Delete existing items
-            bill.items.all().delete()
-            # Get rates
-            silver_rate = SilverRate.get_current_rate()
-            bar_rate = BarRate.get_current_rate()
-            # Create new items
-            for idx, item_data in enumerate(items_data):
-                # Determine default rate based on material type
-                material_type = item_data.get('material_type', 'gold')
-                default_rate = str(bill.gold_rate)
-                if material_type == 'silver' and silver_rate:
-                    default_rate = str(silver_rate.rate_per_gram)
-                elif material_type == 'bar' and bar_rate:
-                    default_rate = str(bar_rate.rate_per_gram)
-                
-                BillItem.objects.create(
-                    bill=bill,
-                    item_type=item_data.get('item_type', 'S'),
-                    material_type=material_type,
-                    description=item_data.get('description', ''),
-                    item_code=item_data.get('item_code', ''),
-                    item_number=item_data.get('item_number', ''),
-                    net_weight=Decimal(item_data.get('net_weight', '0')),
-                    tunch_wstg=Decimal(item_data.get('tunch_wstg', '91.60')),
-                    labour=Decimal(item_data.get('labour', '0')),
-                    rate=Decimal(item_data.get('rate', default_rate)),
-                    order=idx
-                )
-            
-            # Update old gold
             old_gold_data = json.loads(request.POST.get('old_gold', '[]'))
-            bill.old_gold_exchanges.all().delete()
-            for og_data in old_gold_data:
-                OldGold.objects.create(
-                    bill=bill,
-                    weight=Decimal(og_data.get('weight', '0')),
-                    rate_per_gram=Decimal(og_data.get('rate_per_gram', str(bill.gold_rate))),
-                    description=og_data.get('description', '')
-                )
-            
-            # Recalculate totals after items and old gold are saved
-            bill.calculate_totals()
-            
-            # Set cash_received: use sum of payments if payments exist, otherwise use form value
-            if has_payments:
-                bill.cash_received = sum(p.amount for p in bill.payments.all())
-            else:
-                bill.cash_received = original_cash_received
-            
-            # Recalculate balance and status
-            bill.calculate_totals()
+            assemble_bill(
+                bill, items_data, old_gold_data,
+                silver_rate=rates.silver,
+                bar_rate=rates.bar,
+                replace=True
+            )
             
             # Validate cash received doesn't exceed net payable
             if bill.cash_received > bill.net_payable:
@@ -494,50 +433,20 @@ def bill_update(request, pk):
                 return render(request, 'billing/bill_update.html', {
                     'bill': bill,
                     'bill_form': bill_form,
-                    'gold_rate': GoldRate.get_current_rate(),
-                    'silver_rate': SilverRate.get_current_rate(),
-                    'bar_rate': BarRate.get_current_rate(),
-                    'customers': Customer.objects.all(),
+                    **rates.as_context(),
                 })
             
-            bill.save()  # Save again with updated totals
             return redirect('bill_detail', pk=bill.pk)
     else:
         bill_form = BillForm(instance=bill)
     
-    # Recalculate any items that might have missing calculations
-    for item in bill.items.all():
-        if (item.g_fine == 0 or item.s_fine == 0) and item.net_weight > 0 and item.tunch_wstg > 0:
-            item.calculate_fines()
-            item.calculate_amount()
-            item.save(update_fields=['g_fine', 's_fine', 'amount'])
-        if item.rate == 0 and bill.gold_rate > 0:
-            item.rate = bill.gold_rate
-            item.calculate_amount()
-            item.save(update_fields=['rate', 'amount'])
-    
-    # Recalculate bill totals to ensure they're correct
-    bill.calculate_totals()
-    
-    # If payments exist, set cash_received to sum of payments for display
-    if bill.payments.exists():
-        total_payments = sum(p.amount for p in bill.payments.all())
-        # Update the form instance to show correct cash_received
-        bill_form.initial['cash_received'] = total_payments
-        bill.cash_received = total_payments
-        bill.calculate_totals()
-        bill.save(update_fields=['cash_received', 'balance', 'status'])
-    else:
-        # If no payments, use the current cash_received value
-        bill_form.initial['cash_received'] = bill.cash_received
+    # Cash received already includes any payments recorded against the bill
+    bill_form.initial['cash_received'] = bill.cash_received
     
     context = {
         'bill': bill,
         'bill_form': bill_form,
-        'gold_rate': GoldRate.get_current_rate(),
-        'silver_rate': SilverRate.get_current_rate(),
-        'bar_rate': BarRate.get_current_rate(),
-        'customers': Customer.objects.all(),
+        **rates.as_context(),
     }
     return render(request, 'billing/bill_update.html', context)
 
@@ -564,8 +473,8 @@ def add_payment(request, bill_id):
             payment.bill = bill
             payment.created_by = request.user
             payment.save()
-            # Payment.save() method already updates bill.cash_received and calls calculate_totals()
-            # So we just need to refresh the bill from DB to get updated values
+            # Saving the payment applies its amount to the bill's cash_received,
+            # balance and status, so just refresh the bill from DB
             bill.refresh_from_db()
             return redirect('bill_detail', pk=bill.pk)
         else:
@@ -576,33 +485,23 @@ def add_payment(request, bill_id):
 
 
 @login_required
+@read_only_view
 def bill_print(request, pk):
     """Print bill view"""
-    bill = get_object_or_404(Bill, pk=pk)
-    
-    # Recalculate any items that might have missing calculations
-    for item in bill.items.all():
-        if (item.g_fine == 0 or item.s_fine == 0) and item.net_weight > 0 and item.tunch_wstg > 0:
-            item.calculate_fines()
-            item.calculate_amount()
-            item.save(update_fields=['g_fine', 's_fine', 'amount'])
-        if item.rate == 0 and bill.gold_rate > 0:
-            item.rate = bill.gold_rate
-            item.calculate_amount()
-            item.save(update_fields=['rate', 'amount'])
+    bill = get_object_or_404(Bill.objects.select_related('customer', 'snapshot'), pk=pk)
     
-    # Calculate subtotals by type
-    items_by_type = {}
-    for item in bill.items.all():
-        if item.item_type not in items_by_type:
-            items_by_type[item.item_type] = {'items': [], 'total_weight': Decimal('0.000'), 'total_gfine': Decimal('0.000')}
-        items_by_type[item.item_type]['items'].append(item)
-        items_by_type[item.item_type]['total_weight'] += item.net_weight
-        items_by_type[item.item_type]['total_gfine'] += item.g_fine
+    # Paid bills are printed from their snapshot
+    snapshot = snapshots.current_snapshot(bill)
+    if snapshot is not None:
+        return render(request, 'billing/bill_print.html', {
+            'bill': bill,
+            'sheet': mark_safe(snapshots.print_html(snapshot)),
+        })
     
+    sheet = render_bill('billing/bill_print_sheet.html', {'bill': bill, 'items_by_type': items_by_type(bill)})
     return render(request, 'billing/bill_print.html', {
         'bill': bill,
-        'items_by_type': items_by_type
+        'sheet': mark_safe(sheet),
     })
 
 
@@ -619,17 +518,38 @@ def bill_pdf(request, pk):
             status=503
         )
     
-    html_string = render_to_string('billing/bill_pdf.html', {'bill': bill})
-    
-    # Generate PDF
-    html = HTML(string=html_string, base_url=request.build_absolute_uri())
-    pdf_file = html.write_pdf()
+    # Served from the PDF cache; a bill that changed since it was last
+    # rendered is rendered by a job worker while the page refreshes itself
+    pdf_file = cached_bill_pdf(bill)
+    if pdf_file is None:
+        # The pending page refreshes with ?job=<id>; stop there if it failed
+        job_id = request.GET.get('job', '')
+        job = None
+        if job_id.isdigit():
+            job = bill.jobs.filter(pk=job_id, kind='bill_pdf', status=Job.DEAD).first()
+        if job is None:
+            job = jobs.enqueue('bill_pdf', bill=bill, user=request.user, unique=True)
+        return render(request, 'billing/bill_pdf_pending.html', {'bill': bill, 'job': job}, status=202)
     
     response = HttpResponse(pdf_file, content_type='application/pdf')
     response['Content-Disposition'] = f'attachment; filename="bill_{bill.bill_number}.pdf"'
     return response
 
 
+@login_required
+def bill_receipt(request, pk):
+    """ESC/POS thermal printer receipt of a bill (?width=58 or 80 mm)"""
+    bill = get_object_or_404(Bill.objects.select_related('customer'), pk=pk)
+    width = request.GET.get('width') or str(getattr(settings, 'RECEIPT_PAPER_WIDTH', 80))
+    width = int(width) if width.isdigit() else None
+    if width not in escpos.PAPER_COLUMNS:
+        return HttpResponseBadRequest(f'Paper width must be one of {", ".join(map(str, escpos.PAPER_COLUMNS))} mm')
+    
+    response = HttpResponse(escpos.render_receipt(escpos.bill_receipt(bill), width), content_type='application/octet-stream')
+    response['Content-Disposition'] = f'attachment; filename="receipt_{bill.bill_number}.bin"'
+    return response
+
+
 @login_required
 def create_customer_ajax(request):
     """Create customer via AJAX for bill form"""
@@ -650,8 +570,8 @@ def create_customer_ajax(request):
                 }, status=400)
             
             # Check if customer with same phone already exists
-            if Customer.objects.filter(phone=phone).exists():
-                existing = Customer.objects.get(phone=phone)
+            existing = Customer.objects.filter(phone=phone).only('name').first()
+            if existing:
                 return JsonResponse({
                     'success': False,
                     'error': f'Customer with phone {phone} already exists: {existing.name}'
@@ -686,6 +606,22 @@ def create_customer_ajax(request):
     }, status=405)
 
 
+@login_required
+def customer_search(request):
+    """Customer typeahead: customers whose name or phone starts with ?q="""
+    try:
+        limit = min(int(request.GET.get('limit', 10)), 50)
+    except ValueError:
+        limit = 10
+    customers = customer_matches(request.GET.get('q', ''), max(limit, 1))
+    return JsonResponse({
+        'results': [
+            {'id': customer.pk, 'name': customer.name, 'phone': customer.phone, 'label': customer_label(customer)}
+            for customer in customers
+        ]
+    })
+
+
 @login_required
 def bill_email(request, pk):
     """Email bill as PDF"""
@@ -700,41 +636,65 @@ def bill_email(request, pk):
             'error': 'PDF generation requires WeasyPrint with GTK3 runtime. Please install GTK3 runtime.'
         })
     
-    # Recalculate any items that might have missing calculations
-    for item in bill.items.all():
-        if (item.g_fine == 0 or item.s_fine == 0) and item.net_weight > 0 and item.tunch_wstg > 0:
-            item.calculate_fines()
-            item.calculate_amount()
-            item.save(update_fields=['g_fine', 's_fine', 'amount'])
-    
-    # Calculate subtotals by type
-    items_by_type = {}
-    for item in bill.items.all():
-        if item.item_type not in items_by_type:
-            items_by_type[item.item_type] = {'items': [], 'total_weight': Decimal('0.000'), 'total_gfine': Decimal('0.000')}
-        items_by_type[item.item_type]['items'].append(item)
-        items_by_type[item.item_type]['total_weight'] += item.net_weight
-        items_by_type[item.item_type]['total_gfine'] += item.g_fine
+    # Rendering and sending happen in a job worker (billing/jobs.py)
+    job = jobs.enqueue(
+        'bill_email',
+        {'to': bill.customer.email},
+        bill=bill,
+        user=request.user,
+    )
+    return JsonResponse({'success': True, 'message': 'Bill queued for sending', 'job': jobs.job_status(job)})
+
+
+@login_required
+def job_status(request, pk):
+    """Status of a background job, polled by the bill detail page"""
+    job = get_object_or_404(Job, pk=pk)
+    return JsonResponse(jobs.job_status(job))
+
+
+class FailedJobListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
+    """Dead-letter list: jobs that used up their attempts"""
+    model = Job
+    template_name = 'billing/job_failed_list.html'
+    context_object_name = 'jobs'
+    paginate_by = 20
+    cursor_ordering = ('-updated_at', '-id')
+
+    def get_queryset(self):
+        return Job.objects.filter(status=Job.DEAD).select_related('bill')
+
+
+@login_required
+def job_retry(request, pk):
+    """Queue a failed job again"""
+    job = get_object_or_404(Job, pk=pk, status=Job.DEAD)
+    if request.method == 'POST':
+        jobs.retry(job)
+        messages.success(request, f'Job #{job.pk} queued again.')
+    return redirect('job_failed_list')
+
+
+def report_bills(request):
+    """Bills in the report's date range (default: current month) and the range"""
+    try:
+        date_from = parse_date(request.GET.get('date_from') or '')
+        date_to = parse_date(request.GET.get('date_to') or '')
+    except ValueError:
+        date_from = date_to = None
     
-    # Generate PDF
-    html_string = render_to_string('billing/bill_pdf.html', {
-        'bill': bill,
-        'items_by_type': items_by_type
-    })
-    html = HTML(string=html_string, base_url=request.build_absolute_uri())
-    pdf_file = html.write_pdf()
+    if not (date_from and date_to):
+        # Default to current month
+        today = timezone.localdate()
+        date_from = today.replace(day=1)
+        date_to = today
     
-    # Create email
-    email = EmailMessage(
-        subject=f'Bill {bill.bill_number} - {bill.customer.name}',
-        body=f'Please find attached bill {bill.bill_number} for {bill.customer.name}.',
-        from_email=settings.DEFAULT_FROM_EMAIL if hasattr(settings, 'DEFAULT_FROM_EMAIL') else 'noreply@jewellerybilling.com',
-        to=[bill.customer.email],
+    # Half-open range on the indexed business day
+    bills = Bill.objects.filter(
+        business_date__gte=date_from,
+        business_date__lt=date_to + timedelta(days=1)
     )
-    email.attach(f'bill_{bill.bill_number}.pdf', pdf_file, 'application/pdf')
-    email.send()
-    
-    return JsonResponse({'success': True, 'message': 'Bill sent successfully'})
+    return bills, date_from, date_to
 
 
 class ReportsView(LoginRequiredMixin, TemplateView):
@@ -744,30 +704,73 @@ class ReportsView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Date range
-        date_from = self.request.GET.get('date_from')
-        date_to = self.request.GET.get('date_to')
-        
-        if date_from and date_to:
-            bills = Bill.objects.filter(
-                bill_date__date__gte=date_from,
-                bill_date__date__lte=date_to
-            )
-        else:
-            # Default to current month
-            today = timezone.now().date()
-            bills = Bill.objects.filter(
-                bill_date__date__year=today.year,
-                bill_date__date__month=today.month
-            )
+        bills, date_from, date_to = report_bills(self.request)
+        context['bills'] = bills.select_related('customer')
         
-        context['bills'] = bills
-        context['total_sales'] = bills.aggregate(total=Sum('net_payable'))['total'] or Decimal('0.00')
-        context['total_cash'] = bills.aggregate(total=Sum('cash_received'))['total'] or Decimal('0.00')
-        context['total_outstanding'] = bills.filter(status__in=['unpaid', 'partial']).aggregate(
-            total=Sum('balance')
-        )['total'] or Decimal('0.00')
-        context['bill_count'] = bills.count()
+        # Totals come from the daily sales rollup, a few rows per day
+        summary = summarize(date_from, date_to)
+        context['total_sales'] = summary['net_payable']
+        context['total_cash'] = summary['cash_received']
+        context['total_outstanding'] = summary['outstanding']
+        context['bill_count'] = summary['bill_count']
+        context['material_summary'] = summary['materials']
         
         return context
 
+
+
+@login_required
+def reports_export(request):
+    """Stream bills, items or payments in the report's date range as CSV or JSONL"""
+    export_format = request.GET.get('format', 'csv')
+    dataset = request.GET.get('dataset', 'bills')
+    if export_format not in exports.FORMATS or dataset not in exports.DATASETS:
+        return HttpResponseBadRequest('Unknown export format or dataset')
+    
+    bills, date_from, date_to = report_bills(request)
+    if export_format == 'jsonl':
+        # One line per bill with items, old gold and payments nested
+        lines = exports.export_jsonl(bills)
+        content_type = 'application/x-ndjson'
+        filename = f'bills_{date_from}_{date_to}.jsonl'
+    else:
+        lines = exports.export_csv(bills, dataset)
+        content_type = 'text/csv'
+        filename = f'{dataset}_{date_from}_{date_to}.csv'
+    
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@staff_member_required
+def reports_export_pdfs(request):
+    """ZIP of the PDFs of every bill in the report's date range
+
+    A job worker builds the archive; the pending page refreshes with
+    ?job=<id> and the finished ZIP is streamed from disk.
+    """
+    if not WEASYPRINT_AVAILABLE:
+        return HttpResponse(
+            "PDF generation requires WeasyPrint with GTK3 runtime.",
+            content_type='text/plain',
+            status=503
+        )
+    
+    job_id = request.GET.get('job', '')
+    if not job_id.isdigit():
+        _, date_from, date_to = report_bills(request)
+        job = jobs.enqueue('pdf_archive', payload={
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+        }, user=request.user)
+        return redirect(f"{reverse('reports_export_pdfs')}?job={job.pk}")
+    
+    job = get_object_or_404(Job, pk=job_id, kind='pdf_archive')
+    path = pdf_archive.archive_path(job) if job.status == Job.SUCCEEDED else None
+    if path is None:
+        # Bills done so far, stored on the job by its worker
+        progress = job.result if job.status == Job.RUNNING and job.result else None
+        return render(request, 'billing/pdf_archive_pending.html', {'job': job, 'progress': progress}, status=202)
+    filename = f"bills_{job.payload['date_from']}_{job.payload['date_to']}.zip"
+    return FileResponse(path.open('rb'), as_attachment=True, filename=filename, content_type='application/zip')
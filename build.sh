@@ -15,6 +15,12 @@ python manage.py collectstatic --noinput
 # Run migrations
 python manage.py migrate --noinput
 
+# Build the daily sales rollup for any days that do not have it yet
+python manage.py rebuild_sales_summary --missing
+
+# Index any bills that are not in the search index yet
+python manage.py rebuild_search_index --missing
+
 # Create superuser automatically with hardcoded credentials
 echo "Creating superuser..."
 python manage.py shell << EOF
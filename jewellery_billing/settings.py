@@ -62,6 +62,15 @@ TEMPLATES = [
             ],
         },
     },
+    {
+        # Jinja2 ports of the bill templates (see billing/jinja2.py)
+        'BACKEND': 'django.template.backends.jinja2.Jinja2',
+        'DIRS': [BASE_DIR / 'jinja2'],
+        'APP_DIRS': False,
+        'OPTIONS': {
+            'environment': 'billing.jinja2.environment',
+        },
+    },
 ]
 
 WSGI_APPLICATION = 'jewellery_billing.wsgi.application'
@@ -136,7 +145,9 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 # Media files
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
+# The job worker writes PDFs and archives here that the web server serves,
+# so both must see the same directory
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', BASE_DIR / 'media')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -161,3 +172,54 @@ EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'noreply@example.com')
 
+
+# Billing
+# Bill numbers each worker process reserves at a time (see billing/sequences.py)
+BILL_NUMBER_BLOCK_SIZE = int(os.environ.get('BILL_NUMBER_BLOCK_SIZE', 1))
+# Seconds a worker may serve its cached gold/silver/bar rates without
+# re-checking them (see billing/rates.py)
+RATE_BOARD_TTL = int(os.environ.get('RATE_BOARD_TTL', 30))
+# Days of rate history each worker keeps in memory for as-of lookups
+RATE_HISTORY_DAYS = int(os.environ.get('RATE_HISTORY_DAYS', 400))
+# Rows fetched per round trip by the streaming report exports
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 500))
+# Rows counted at most for the page totals of cursor-paginated lists on
+# databases without planner estimates (see billing/pagination.py)
+PAGINATION_COUNT_LIMIT = int(os.environ.get('PAGINATION_COUNT_LIMIT', 1000))
+# Bills returned at most by an admin search, best match first; the bill
+# list pages through every match
+SEARCH_RESULT_LIMIT = int(os.environ.get('SEARCH_RESULT_LIMIT', 200))
+# Bytes of rendered bill PDFs kept on disk under MEDIA_ROOT/bill_pdfs,
+# least recently used first out (see billing/pdfs.py)
+BILL_PDF_CACHE_MAX_BYTES = int(os.environ.get('BILL_PDF_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# Background jobs run by ``manage.py run_jobs`` (see billing/jobs.py):
+# attempts before a job is given up, the retry delay in seconds (doubled
+# per attempt, up to the maximum), seconds after which a running job is
+# assumed lost with its worker, and seconds an idle worker waits
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_DELAY = int(os.environ.get('JOB_RETRY_DELAY', 30))
+JOB_RETRY_MAX_DELAY = int(os.environ.get('JOB_RETRY_MAX_DELAY', 3600))
+JOB_LOCK_TIMEOUT = int(os.environ.get('JOB_LOCK_TIMEOUT', 600))
+JOB_POLL_INTERVAL = int(os.environ.get('JOB_POLL_INTERVAL', 2))
+# Processes rendering bill PDFs for ZIP archives, in ``manage.py
+# export_bill_pdfs`` and the job worker (see billing/pdf_archive.py); 0
+# starts one per CPU. ZIPs built for /reports/export/pdfs/ are kept this
+# many seconds
+PDF_ARCHIVE_WORKERS = int(os.environ.get('PDF_ARCHIVE_WORKERS', 0))
+PDF_ARCHIVE_MAX_AGE = int(os.environ.get('PDF_ARCHIVE_MAX_AGE', 86400))
+# Warm PDF renderer processes started by ``manage.py run_jobs`` (see
+# billing/renderer.py; 0 renders in the job worker itself), the seconds one
+# PDF may take, and the peak memory (MiB) and PDF count after which a
+# renderer process is replaced
+PDF_RENDERER_PROCESSES = int(os.environ.get('PDF_RENDERER_PROCESSES', 1))
+PDF_RENDER_TIMEOUT = int(os.environ.get('PDF_RENDER_TIMEOUT', 60))
+PDF_RENDERER_MAX_MEMORY_MB = int(os.environ.get('PDF_RENDERER_MAX_MEMORY_MB', 512))
+PDF_RENDERER_MAX_JOBS = int(os.environ.get('PDF_RENDERER_MAX_JOBS', 500))
+# Bytes of static and media files each PDF renderer keeps in memory
+PDF_ASSET_CACHE_MAX_BYTES = int(os.environ.get('PDF_ASSET_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# Paper width (58 or 80 mm) of ESC/POS receipts unless ?width= says otherwise
+# (see billing/escpos.py)
+RECEIPT_PAPER_WIDTH = int(os.environ.get('RECEIPT_PAPER_WIDTH', 80))
+# Template engine ('jinja2' or 'django') of the bill sheet and PDF
+# templates (see billing/jinja2.py)
+BILL_TEMPLATE_ENGINE = os.environ.get('BILL_TEMPLATE_ENGINE', 'jinja2')
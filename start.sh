@@ -5,5 +5,16 @@ set -o errexit
 # Run migrations (in case of any pending migrations)
 python manage.py migrate --noinput
 
+# Build the sales rollup of days that have none yet; it is kept up to date
+# from then on (see billing/rollups.py)
+python manage.py rebuild_sales_summary --missing
+
+# Snapshot paid bills that have none yet, or one of an older template
+# (see billing/snapshots.py)
+python manage.py freeze_bills
+
+# The background job worker (PDFs and emails, see billing/jobs.py) runs as
+# its own service: see worker.sh and the Procfile
+
 # Start Gunicorn using Python module syntax (more reliable)
 python -m gunicorn jewellery_billing.wsgi:application --bind 0.0.0.0:$PORT
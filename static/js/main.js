@@ -50,3 +50,52 @@ function hideLoading(element, originalText) {
     element.disabled = false;
 }
 
+
+// Customer typeahead: selects with data-typeahead-url render only the chosen
+// customer; typing a name or phone prefix fills in the matching customers
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('select[data-typeahead-url]').forEach(function(select) {
+        var input = document.createElement('input');
+        input.type = 'search';
+        input.className = 'form-control';
+        input.placeholder = 'Type a name or phone number...';
+        input.setAttribute('autocomplete', 'off');
+        select.parentNode.insertBefore(input, select);
+
+        var timer = null;
+        var latest = 0;
+        input.addEventListener('input', function() {
+            clearTimeout(timer);
+            var query = input.value.trim();
+            if (query.length < 2) {
+                return;
+            }
+            timer = setTimeout(function() {
+                var request = ++latest;
+                var url = select.dataset.typeaheadUrl + '?limit=20&q=' + encodeURIComponent(query);
+                fetch(url, {headers: {'X-Requested-With': 'XMLHttpRequest'}})
+                    .then(function(response) { return response.json(); })
+                    .then(function(data) {
+                        if (request !== latest) {
+                            return;  // a newer query is on its way
+                        }
+                        var selected = select.value;
+                        Array.from(select.options).forEach(function(option) {
+                            if (option.value !== selected || !option.value) {
+                                option.remove();
+                            }
+                        });
+                        data.results.forEach(function(customer) {
+                            if (String(customer.id) === selected) {
+                                return;
+                            }
+                            select.appendChild(new Option(customer.label, customer.id));
+                        });
+                        if (!selected && data.results.length) {
+                            select.value = String(data.results[0].id);
+                        }
+                    });
+            }, 200);
+        });
+    });
+});
@@ -0,0 +1,8 @@
+#!/usr/bin/env bash
+# Exit on error
+set -o errexit
+
+# Run the background job worker (PDFs and emails, see billing/jobs.py) in
+# the foreground, so the platform restarts it if it stops. The web service
+# (start.sh) runs the migrations.
+exec python manage.py run_jobs